@@ -0,0 +1,417 @@
+"""
+Synthetic accounting data in the formats read by the site postprocessors.
+
+Every generator writes ``days`` daily input files ending yesterday (so
+they fall inside the time window of the postprocessor's fileiterator)
+with ``rows`` jobs per day, a ``nairr_fraction`` of which are charged to
+accounts that are in the synthetic account mapping. Generators return the
+input files written and the mapping keys that belong to NAIRR grants so
+that the matching mapping spreadsheet can be written.
+"""
+
+import datetime
+import gzip
+import json
+import os
+import random
+import string
+
+SLURM_STATES = ['COMPLETED'] * 8 + ['FAILED', 'CANCELLED by 0', 'TIMEOUT', 'OUT_OF_MEMORY', 'NODE_FAIL']
+
+JOB_NAMES = ['train', 'eval', 'preprocess', 'bash', 'jupyter', 'llm-finetune', 'sweep_{}', 'run.sh', 'interactive']
+
+# Number of distinct accounts generated for each site
+NAIRR_ACCOUNTS = 40
+OTHER_ACCOUNTS = 400
+
+
+class Job:
+    """ A single synthetic job, formatted differently by each generator """
+
+    def __init__(self, rng, jobid, day, account, partition, pipe_in_name=0.0):
+        self.jobid = jobid
+        self.account = account
+        self.partition = partition
+        self.user = 'user%03d' % rng.randint(0, 300)
+        self.group = 'G-%05d' % rng.randint(0, 2000)
+        self.uid = 10000 + rng.randint(0, 300)
+        self.gid = 800000 + rng.randint(0, 2000)
+        self.nnodes = rng.choice([1, 1, 1, 1, 2, 4, 8])
+        self.ncpus = self.nnodes * rng.choice([1, 4, 16, 32, 64, 128])
+        self.state = rng.choice(SLURM_STATES)
+
+        self.submit = day + datetime.timedelta(seconds=rng.randint(0, 86399))
+        self.start = self.submit + datetime.timedelta(seconds=rng.randint(0, 7200))
+        # A few jobs run for longer than a day
+        self.end = self.start + datetime.timedelta(seconds=int(rng.expovariate(1.0 / 5400)))
+        self.timelimit = rng.choice(['00:30:00', '02:00:00', '12:00:00', '1-00:00:00', '2-00:00:00'])
+        self.nodelist = 'c%03d-%03d' % (rng.randint(0, 500), rng.randint(0, 100))
+
+        self.name = rng.choice(JOB_NAMES).format(rng.randint(0, 99))
+        if rng.random() < pipe_in_name:
+            self.name += '|part%d' % rng.randint(0, 9)
+        self.gpus = 0
+
+    @property
+    def elapsed(self):
+        return int((self.end - self.start).total_seconds())
+
+    def slurm_fields(self, cluster, qos='normal'):
+        """ The 26 fields of the pipe delimited Slurm format read by xdmod-shredder """
+
+        fmt = '%Y-%m-%dT%H:%M:%S'
+        tres = 'billing=%d,cpu=%d,node=%d' % (self.ncpus, self.ncpus, self.nnodes)
+        if self.gpus:
+            tres += ',gres/gpu=%d' % self.gpus
+        return [
+            str(self.jobid), str(self.jobid), cluster, self.partition, qos, self.account, self.group,
+            str(self.gid), self.user, str(self.uid), self.submit.strftime(fmt), self.submit.strftime(fmt),
+            self.start.strftime(fmt), self.end.strftime(fmt), str(self.elapsed), '0:0', self.state,
+            str(self.nnodes), str(self.ncpus), str(self.ncpus), '4000M', tres, tres, self.timelimit,
+            self.nodelist, self.name
+        ]
+
+    def slurmjson(self, cluster):
+        """ A job as it appears in the jobs array of sacct --json """
+
+        def epoch(value):
+            return int(value.replace(tzinfo=datetime.timezone.utc).timestamp())
+
+        tres = [{'type': 'cpu', 'name': '', 'id': 1, 'count': self.ncpus},
+                {'type': 'mem', 'name': '', 'id': 2, 'count': 4000 * self.ncpus},
+                {'type': 'node', 'name': '', 'id': 4, 'count': self.nnodes}]
+        if self.gpus:
+            tres.append({'type': 'gres', 'name': 'gpu', 'id': 1001, 'count': self.gpus})
+
+        return {
+            'account': self.account,
+            'allocation_nodes': self.nnodes,
+            'array': {'job_id': 0, 'limits': {'max': {'running': {'tasks': 0}}}, 'task_id': {'set': False, 'infinite': False, 'number': 0}, 'task': ''},
+            'cluster': cluster,
+            'comment': {'administrator': '', 'job': '', 'system': ''},
+            'derived_exit_code': {'status': ['SUCCESS'], 'return_code': {'set': True, 'infinite': False, 'number': 0}},
+            'time': {
+                'elapsed': self.elapsed,
+                'eligible': epoch(self.submit),
+                'end': epoch(self.end),
+                'start': epoch(self.start),
+                'submission': epoch(self.submit),
+                'suspended': 0,
+                'limit': {'set': True, 'infinite': False, 'number': 120}
+            },
+            'exit_code': {'status': ['SUCCESS'], 'return_code': {'set': True, 'infinite': False, 'number': 0}},
+            'group': self.group,
+            'job_id': self.jobid,
+            'name': self.name,
+            'nodes': self.nodelist,
+            'partition': self.partition,
+            'qos': 'normal',
+            'state': {'current': [self.state.split()[0]], 'reason': 'None'},
+            'steps': [],
+            'tres': {'allocated': tres, 'requested': tres},
+            'user': self.user,
+            'wckey': {'wckey': '', 'flags': []},
+            'working_directory': '/home/%s' % self.user
+        }
+
+
+def _days(days):
+    today = datetime.datetime.combine(datetime.date.today(), datetime.time())
+    return [today - datetime.timedelta(days=n) for n in range(days, 0, -1)]
+
+
+def _accounts(rng, make):
+    """ Disjoint lists of NAIRR and other accounts from make(rng) """
+
+    nairr = set()
+    while len(nairr) < NAIRR_ACCOUNTS:
+        nairr.add(make(rng))
+    other = set()
+    while len(other) < OTHER_ACCOUNTS:
+        account = make(rng)
+        if account not in nairr:
+            other.add(account)
+    return sorted(nairr), sorted(other)
+
+
+def _jobs(rng, day, rows, nairr_fraction, nairr, other, partitions, firstid, pipe_in_name=0.0):
+    for n in range(rows):
+        accounts = nairr if rng.random() < nairr_fraction else other
+        yield Job(rng, firstid + n, day, rng.choice(accounts), rng.choice(partitions), pipe_in_name)
+
+
+def _letters(rng, count):
+    return ''.join(rng.choice(string.ascii_lowercase) for _ in range(count))
+
+
+class Generator:
+    """ Base class: write rows jobs per day for days days into indir """
+
+    # Partitions and their GPUs per node
+    partitions = {'normal': 0}
+    pipe_in_name = 0.0
+    mapping = None
+    # Sites without a mapping table identify NAIRR accounts by prefix
+    nairr_prefix = None
+
+    def __init__(self, rows, days, nairr_fraction, seed=0):
+        self.rows = rows
+        self.days = days
+        self.nairr_fraction = nairr_fraction
+        self.rng = random.Random(seed)
+        self.nairr, self.other = _accounts(self.rng, self.account)
+
+        if self.nairr_prefix is not None:
+            accounts = self.nairr + self.other
+            self.nairr = [a for a in accounts if a.startswith(self.nairr_prefix)]
+            self.other = [a for a in accounts if not a.startswith(self.nairr_prefix)]
+
+    def account(self, rng):
+        return 'TG-%s%06d' % (_letters(rng, 3).upper(), rng.randint(0, 999999))
+
+    def jobs(self, day, index):
+        for job in _jobs(self.rng, day, self.rows, self.nairr_fraction, self.nairr, self.other,
+                         sorted(self.partitions), 1000000 + index * self.rows, self.pipe_in_name):
+            job.gpus = job.nnodes * self.partitions[job.partition]
+            yield job
+
+    def mapping_keys(self):
+        """ The keys of the NAIRR accounts in the account mapping """
+
+        return [] if self.nairr_prefix is not None else self.nairr
+
+    def generate(self, indir):
+        os.makedirs(indir, exist_ok=True)
+        files = []
+        for index, day in enumerate(_days(self.days)):
+            files.extend(self.write_day(indir, day, index))
+        return files
+
+    def write_day(self, indir, day, index):
+        raise NotImplementedError
+
+
+class SlurmPipe(Generator):
+    """ Raw 26 field pipe delimited sacct dumps (TACC Frontera and Vista) """
+
+    cluster = 'cluster'
+    suffix = '.txt'
+    nairr_prefix = 'nairr'
+
+    def account(self, rng):
+        if rng.random() < 0.5:
+            return super().account(rng)
+        return 'nairr%06d' % rng.randint(0, 999999)
+
+    def write_day(self, indir, day, index):
+        path = os.path.join(indir, day.strftime('%Y-%m-%d') + self.suffix)
+        with open(path, 'w', encoding='utf-8') as filep:
+            for job in self.jobs(day, index):
+                filep.write('|'.join(job.slurm_fields(self.cluster)) + '\n')
+        return [path]
+
+
+class Frontera(SlurmPipe):
+    cluster = 'frontera'
+    suffix = '.log'
+    # sacct does not report the 4 GPUs per node of the rtx partitions, the
+    # postprocessor adds them to the TRES
+    partitions = {'normal': 0, 'development': 0, 'large': 0, 'flex': 0, 'rtx': 0, 'rtx-dev': 0}
+
+
+class Vista(SlurmPipe):
+    cluster = 'vista'
+    partitions = {'gh': 1, 'gh-dev': 1, 'gg': 0}
+
+
+class Lonestar6(SlurmPipe):
+    """ TACC Lonestar6 sacct dump with a header line and a subset of the fields """
+
+    cluster = 'ls6'
+    partitions = {'development': 0, 'normal': 0, 'large': 0, 'vm-small': 0,
+                  'gpu-a100': 3, 'gpu-a100-dev': 3, 'gpu-a100-small': 1, 'gpu-h100': 2}
+    header = ['JobID', 'User', 'Account', 'Start', 'End', 'Submit', 'Partition', 'Timelimit',
+              'JobName', 'State', 'NNodes', 'ReqCPUS', 'NodeList']
+
+    def write_day(self, indir, day, index):
+        fmt = '%Y-%m-%dT%H:%M:%S'
+        path = os.path.join(indir, day.strftime('%Y-%m-%d') + self.suffix)
+        with open(path, 'w', encoding='utf-8') as filep:
+            filep.write('|'.join(self.header) + '\n')
+            for job in self.jobs(day, index):
+                start = job.start.strftime(fmt) if job.state != 'CANCELLED by 0' else 'None'
+                filep.write('|'.join([
+                    str(job.jobid), job.user, job.account, start, job.end.strftime(fmt), job.submit.strftime(fmt),
+                    job.partition, job.timelimit, job.name, job.state, str(job.nnodes), str(job.ncpus), job.nodelist
+                ]) + '\n')
+        return [path]
+
+
+class Bridges2(Generator):
+    """ PSC Bridges-2 24 field dumps (no qos or reqtres) with '|' in some job names """
+
+    partitions = {'RM': 0, 'RM-shared': 0, 'RM-512': 0, 'EM': 0, 'GPU': 8, 'GPU-shared': 1}
+    pipe_in_name = 0.02
+    mapping = 'PSC'
+
+    def account(self, rng):
+        return '%s%06dp' % (_letters(rng, 3), rng.randint(0, 999999))
+
+    def write_day(self, indir, day, index):
+        path = os.path.join(indir, day.strftime('%Y-%m-%d') + '.jobs')
+        with open(path, 'w', encoding='utf-8') as filep:
+            for job in self.jobs(day, index):
+                fields = job.slurm_fields('bridges2')
+                del fields[21]
+                del fields[4]
+                filep.write('|'.join(fields) + '\n')
+        return [path]
+
+
+class Anvil(Generator):
+    """ Purdue Anvil 26 field dumps with '|' in some job names """
+
+    partitions = {'wholenode': 0, 'shared': 0, 'wide': 0, 'highmem': 0, 'gpu': 4, 'gpu-debug': 4}
+    pipe_in_name = 0.02
+    nairr_prefix = 'ai'
+
+    def account(self, rng):
+        prefix = 'ai' if rng.random() < 0.5 else rng.choice(['cis', 'see', 'phy'])
+        return '%s%06d' % (prefix, rng.randint(0, 999999))
+
+    def write_day(self, indir, day, index):
+        path = os.path.join(indir, day.strftime('%Y%m%d'))
+        with open(path, 'w', encoding='utf-8') as filep:
+            for job in self.jobs(day, index):
+                filep.write('|'.join(job.slurm_fields('anvil')) + '\n')
+        return [path]
+
+
+class SlurmJson(Generator):
+    """ Daily sacct --json documents """
+
+    cluster = 'cluster'
+    compress = False
+
+    def filenames(self, day):
+        return [day.strftime('%Y-%m-%d') + '.json']
+
+    def write_document(self, path, jobs):
+        opener = gzip.open if self.compress else open
+        with opener(path, 'wt', encoding='utf-8') as filep:
+            filep.write('{"meta": {"plugin": {"type": "openapi/slurmctld", "name": "Slurm OpenAPI slurmctld", "data_parser": "data_parser/v0.0.40", "accounting_storage": "accounting_storage/slurmdbd"}, "client": {"source": "synthetic", "user": "slurm", "group": "slurm"}, "command": ["sacct", "--json"], "slurm": {"version": {"major": "24", "micro": "1", "minor": "05"}, "release": "24.05.1", "cluster": ' + json.dumps(self.cluster) + '}}, "jobs": [')
+            for count, job in enumerate(jobs):
+                if count:
+                    filep.write(', ')
+                filep.write(json.dumps(job.slurmjson(self.cluster)))
+            filep.write('], "warnings": [], "errors": []}')
+
+    def write_day(self, indir, day, index):
+        names = self.filenames(day)
+        jobs = list(self.jobs(day, index))
+        per_file = -(-len(jobs) // len(names))
+        paths = []
+        for part, name in enumerate(names):
+            path = os.path.join(indir, name)
+            self.write_document(path, self.file_jobs(name, jobs[part * per_file:(part + 1) * per_file]))
+            paths.append(path)
+        return paths
+
+    def file_jobs(self, name, jobs):
+        return jobs
+
+
+class Neocortex(SlurmJson):
+    cluster = 'neocortex'
+    partitions = {'sdf': 0, 'sdflex': 0}
+    mapping = 'PSC'
+
+    def account(self, rng):
+        return '%s%06dp' % (_letters(rng, 3), rng.randint(0, 999999))
+
+    def filenames(self, day):
+        return ['neocortex-' + day.strftime('%Y-%m-%d') + '.json']
+
+    def file_jobs(self, name, jobs):
+        # Some Neocortex records have no user
+        for job in jobs:
+            if self.rng.random() < 0.05:
+                job.user = None
+        return jobs
+
+
+class Aces(SlurmJson):
+    cluster = 'aces'
+    partitions = {'cpu': 0, 'gpu': 2, 'pvc': 4}
+    mapping = 'TAMU'
+
+    def account(self, rng):
+        return '%012d' % rng.randint(0, 10 ** 12 - 1)
+
+    def filenames(self, day):
+        return ['aces-' + day.strftime('%Y-%m-%d') + '.json']
+
+
+class Dgx(SlurmJson):
+    """ NVIDIA DGX Cloud, one document per grant with the grant in the filename """
+
+    cluster = 'dgx'
+    partitions = {'batch': 8}
+    grants = ['NAIRR240001', 'NAIRR240002', 'NAIRR240003']
+
+    def filenames(self, day):
+        return ['sacct.dgx.%s.%s.json' % (grant, day.strftime('%Y-%m-%d')) for grant in self.grants]
+
+    def mapping_keys(self):
+        return []
+
+
+class Delta(SlurmJson):
+    """ NCSA Delta, resource is encoded in the account suffix """
+
+    cluster = 'delta'
+    partitions = {'cpu': 0, 'gpuA100x4': 4, 'gpuA40x4': 4}
+    suffixes = ['delta-cpu', 'delta-gpu']
+    mapping = 'NCSA'
+
+    def account(self, rng):
+        return '%s-%s' % (_letters(rng, 4), rng.choice(self.suffixes))
+
+    def mapping_keys(self):
+        return sorted({account[0:4] for account in self.nairr})
+
+
+class DeltaAI(Delta):
+    cluster = 'deltaai'
+    partitions = {'ghx4': 4}
+    suffixes = ['dtai-gh']
+
+
+class Expanse(SlurmJson):
+    """ SDSC Expanse, gzipped documents per cluster """
+
+    cluster = 'expanse'
+    partitions = {'compute': 0, 'shared': 0, 'gpu': 4, 'gpu-shared': 1}
+    compress = True
+    mapping = 'SDSC'
+
+    def account(self, rng):
+        return '%s%03d' % (_letters(rng, 3), rng.randint(0, 999))
+
+    def filenames(self, day):
+        return ['sacct_json_%s_%s.json.gz' % (cluster, day.strftime('%Y-%m-%d')) for cluster in ('expanse', 'expanse_gpu')]
+
+
+GENERATORS = {
+    'tacc-lonestar6': Lonestar6,
+    'tacc-frontera': Frontera,
+    'tacc-vista': Vista,
+    'psc-bridges2': Bridges2,
+    'purdue': Anvil,
+    'psc': Neocortex,
+    'tamu': Aces,
+    'dgx': Dgx,
+    'ncsa-delta': Delta,
+    'ncsa-deltaai': DeltaAI,
+    'sdsc': Expanse
+}
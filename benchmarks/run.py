@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+Benchmark the site postprocessors on synthetic accounting data.
+
+For each selected site the matching generator from generators.py writes
+the input files and a CSV account mapping into the work directory, then
+the site's postprocess.py is run on them (with --full and a fresh state
+and output directory for every repetition). The results are printed as
+JSON: wall time, user and system CPU, peak RSS of the postprocessor
+process, the time spent in each stage as reported in the postprocessor's
+run log and the throughput in input rows and MB per second.
+
+    python3 benchmarks/run.py --rows 200000 --days 3 -s tacc-lonestar6 -s psc
+"""
+
+import argparse
+import csv
+import datetime
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import time
+
+from generators import GENERATORS
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCRIPTS = {
+    'tacc-lonestar6': 'fstree/data/tacc-lonestar6/scripts/postprocess.py',
+    'tacc-frontera': 'fstree/data/tacc-frontera/scripts/postprocess.py',
+    'tacc-vista': 'fstree/data/tacc-vista/scripts/postprocess.py',
+    'psc-bridges2': 'fstree/data/psc-bridges2/postprocess.py',
+    'purdue': 'fstree/data/purdue/postprocess.py',
+    'psc': 'fstree/data/psc/postprocess.py',
+    'tamu': 'fstree/data/tamu/postprocess.py',
+    'dgx': 'fstree/data/dgx/postprocess.py',
+    'ncsa-delta': 'fstree/data/ncsa/delta/postprocess.py',
+    'ncsa-deltaai': 'fstree/data/ncsa/deltaai/postprocess.py',
+    'sdsc': 'fstree/data/sdsc/postprocess.py'
+}
+
+
+def write_mapping(path, spec, keys):
+    """ Write a CSV account mapping with the columns the site's mapping spec expects """
+
+    with open(path, 'w', encoding='utf-8', newline='') as filep:
+        writer = csv.writer(filep)
+        writer.writerow([spec['key'], spec['value']])
+        for num, key in enumerate(keys):
+            writer.writerow([key, 'NAIRR24%04d' % num])
+
+
+def prepare(site, args, sitedir, mappings):
+    """ Generate the inputs for a site, returns (input dir, extra postprocessor args, rows, bytes) """
+
+    indir = os.path.join(sitedir, 'input')
+    generator = GENERATORS[site](args.rows, args.days, args.nairr_fraction, seed=args.seed)
+
+    if args.reuse_inputs and os.path.isdir(indir) and os.listdir(indir):
+        logging.info('Reusing the inputs in %s', indir)
+    else:
+        shutil.rmtree(indir, ignore_errors=True)
+        started = time.monotonic()
+        generator.generate(indir)
+        logging.info('Generated %s inputs in %.1fs', site, time.monotonic() - started)
+
+    extra = []
+    if generator.mapping is not None:
+        source = os.path.join(sitedir, 'mapping.csv')
+        write_mapping(source, mappings[generator.mapping], generator.mapping_keys())
+        extra = ['--mapping-source', source, '--mapping-cache', os.path.join(sitedir, 'mapping-cache.json')]
+
+    inbytes = sum(os.path.getsize(os.path.join(indir, name)) for name in os.listdir(indir))
+    return indir, extra, args.rows * args.days, inbytes
+
+
+def run_once(cmd, env):
+    """ Run a command, returns (returncode, wall seconds, rusage) """
+
+    started = time.monotonic()
+    proc = subprocess.Popen(cmd, env=env)
+    _, status, usage = os.wait4(proc.pid, 0)
+    wall = time.monotonic() - started
+    proc.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+    return proc.returncode, wall, usage
+
+
+def benchmark(site, args, env, mappings):
+    sitedir = os.path.join(args.workdir, site)
+    indir, extra, rows, inbytes = prepare(site, args, sitedir, mappings)
+    outdir = os.path.join(sitedir, 'output')
+    statedir = os.path.join(sitedir, 'state')
+    runlog = os.path.join(sitedir, 'runs.jsonl')
+
+    cmd = [sys.executable, os.path.join(args.scripts_root, SCRIPTS[site]),
+           '-i', indir, '-o', outdir, '-s', statedir, '--full', '-j', str(args.jobs),
+           '--metrics-dir', '', '--run-log', runlog] + extra
+
+    runs = []
+    for _ in range(args.repeat):
+        shutil.rmtree(outdir, ignore_errors=True)
+        shutil.rmtree(statedir, ignore_errors=True)
+
+        returncode, wall, usage = run_once(cmd, env)
+        if returncode != 0:
+            logging.error('%s exited with %d', site, returncode)
+            return {'site': site, 'error': returncode, 'command': cmd}
+
+        with open(runlog, 'r', encoding='utf-8') as filep:
+            stages = json.loads(filep.readlines()[-1])['stages']
+
+        runs.append({
+            'wall_s': round(wall, 3),
+            'user_s': round(usage.ru_utime, 3),
+            'sys_s': round(usage.ru_stime, 3),
+            'max_rss_mb': round(usage.ru_maxrss / 1024.0, 1),
+            'stages_s': stages
+        })
+
+    best = min(runs, key=lambda run: run['wall_s'])
+    outbytes = 0
+    for dirpath, _, filenames in os.walk(outdir):
+        outbytes += sum(os.path.getsize(os.path.join(dirpath, name)) for name in filenames)
+
+    return {
+        'site': site,
+        'rows': rows,
+        'input_bytes': inbytes,
+        'output_bytes': outbytes,
+        'wall_s': best['wall_s'],
+        'rows_per_s': round(rows / best['wall_s'], 1),
+        'mb_per_s': round(inbytes / 1e6 / best['wall_s'], 2),
+        'max_rss_mb': max(run['max_rss_mb'] for run in runs),
+        'runs': runs
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description='Benchmark the site postprocessors on synthetic accounting data'
+    )
+    parser.add_argument('-s', '--site', action='append', choices=sorted(GENERATORS), help='Benchmark this site (may be repeated, default all)')
+    parser.add_argument('-r', '--rows', type=int, default=100000, help='Jobs per daily input file')
+    parser.add_argument('-d', '--days', type=int, default=2, help='Number of daily input files')
+    parser.add_argument('-f', '--nairr-fraction', type=float, default=0.05, help='Fraction of jobs charged to NAIRR accounts')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='Passed to the postprocessors as --jobs')
+    parser.add_argument('-n', '--repeat', type=int, default=3, help='Runs per site, the fastest is reported')
+    parser.add_argument('-w', '--workdir', default='/tmp/nairr-benchmark', help='Directory for the generated inputs and the outputs')
+    parser.add_argument('--scripts-root', default=REPO, help='Checkout containing the postprocessors to benchmark')
+    parser.add_argument('--libdir', help='NAIRR_LIBDIR for the postprocessors, default the one in --scripts-root')
+    parser.add_argument('--reuse-inputs', action='store_true', help='Do not regenerate inputs that already exist')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-o', '--output', help='Write the JSON results to this file instead of stdout')
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s [%(levelname)s] %(message)s', datefmt='%Y-%m-%dT%H:%M:%S', level=logging.INFO)
+
+    libdir = args.libdir or os.path.join(args.scripts_root, 'fstree/usr/local/lib/nairr')
+    sys.path.insert(0, libdir)
+    from nairrpp.mapping import MAPPINGS
+
+    env = dict(os.environ, NAIRR_LIBDIR=libdir)
+
+    results = {
+        'date': datetime.datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'host': platform.node(),
+        'parameters': {'rows': args.rows, 'days': args.days, 'nairr_fraction': args.nairr_fraction,
+                       'jobs': args.jobs, 'repeat': args.repeat, 'seed': args.seed},
+        'results': []
+    }
+
+    try:
+        results['revision'] = subprocess.check_output(['git', '-C', args.scripts_root, 'rev-parse', 'HEAD'],
+                                                      stderr=subprocess.DEVNULL, universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        results['revision'] = None
+
+    for site in args.site or sorted(GENERATORS):
+        results['results'].append(benchmark(site, args, env, MAPPINGS))
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as filep:
+            json.dump(results, filep, indent=4)
+    else:
+        print(json.dumps(results, indent=4))
+
+    return 1 if any('error' in result for result in results['results']) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,20 @@
+-- Set the PI of the staged resource actions from the PI of their request,
+-- -1 for requests without a PI. Only the actions staged by this run (with
+-- their -1 placeholders) and the actions of the requests whose PI changed
+-- since the -m date are updated, rather than the whole staging table.
+UPDATE ${DESTINATION_SCHEMA}.resource_actions_staging ra
+JOIN ${DESTINATION_SCHEMA}.request_pi rpi ON rpi.request_id = ra.request_id
+SET
+    ra.pi_xras_person_id = rpi.pi_xras_person_id,
+    ra.pi_xras_organization_id = rpi.pi_xras_organization_id
+WHERE ra.last_modified >= '${LAST_MODIFIED_START_DATE}'
+    AND (ra.pi_xras_person_id <> rpi.pi_xras_person_id OR ra.pi_xras_organization_id <> rpi.pi_xras_organization_id)
+//
+UPDATE ${DESTINATION_SCHEMA}.request_pi rpi
+JOIN ${DESTINATION_SCHEMA}.resource_actions_staging ra ON ra.request_id = rpi.request_id
+SET
+    ra.pi_xras_person_id = rpi.pi_xras_person_id,
+    ra.pi_xras_organization_id = rpi.pi_xras_organization_id
+WHERE rpi.last_modified >= '${LAST_MODIFIED_START_DATE}'
+    AND (ra.pi_xras_person_id <> rpi.pi_xras_person_id OR ra.pi_xras_organization_id <> rpi.pi_xras_organization_id)
+//
@@ -2,12 +2,25 @@
 
 import os
 import logging
-import json
 import datetime
-import tempfile
-import stat
-import shutil
-import pandas as pd
+import sys
+
+sys.path.insert(0, os.environ.get('NAIRR_LIBDIR', '/usr/local/lib/nairr'))
+
+from nairrpp.cli import argument_parser, backfill, job_index, manifest_path, output_tree, run_metrics, setup_logging
+from nairrpp.jobindex import slurmjson_job
+from nairrpp.manifest import Manifest
+from nairrpp.metrics import timed
+from nairrpp.parallel import Stats, process_files
+from nairrpp.slurmjson import SlurmJsonReader, SlurmJsonWriter
+
+RESOURCE = 'NVIDIA-DGX-Cloud'
+
+def filedate(filename):
+    try:
+        return datetime.datetime.strptime(filename[-15:], '%Y-%m-%d.json')
+    except ValueError:
+        return None
 
 def fileiterator(datasource):
     filenames = [x for x in os.listdir(datasource)]
@@ -16,46 +29,71 @@ def fileiterator(datasource):
     now = datetime.datetime.now()
 
     for filename in filenames:
-        try:
-            fdate = datetime.datetime.strptime(filename[-15:], '%Y-%m-%d.json')
-            if now - fdate > datetime.timedelta(days=365):
-                logging.debug('Skip %s due to time range', filename)
-                continue
-        except ValueError:
+        fdate = filedate(filename)
+        if fdate is None:
             logging.warning('Unrecognized filename %s. Skipping', filename)
             continue
+        if now - fdate > datetime.timedelta(days=365):
+            logging.debug('Skip %s due to time range', filename)
+            continue
 
         fullpath = os.path.join(datasource, filename)
         if os.path.isfile(fullpath):
             yield (fullpath, filename)
 
-def main():
+def process_file(fullpath, filename, outputs, index):
+    stats = Stats()
 
-    srcdir = "/data/dgx/logs"
-    outdir = "/data/dgx/postprocessed"
+    with open(fullpath, "r", encoding='utf-8', errors='ignore') as filep:
 
-    logging.basicConfig(format='%(asctime)s [%(levelname)s] %(message)s', datefmt='%Y-%m-%dT%H:%M:%S', level=logging.WARNING)
-    logging.captureWarnings(True)
+        reader = SlurmJsonReader(filep)
+        fparts = filename.split(".")
 
-    for fullpath, filename in fileiterator(srcdir):
+        with index.source(fullpath) as seen, SlurmJsonWriter(outputs.open(filename), reader.header) as writer:
+            for job in timed(reader, stats.timings, 'parse'):
+                stats.counts['rows_read'] += 1
+                job['account'] = fparts[2]
+                if seen.emit(RESOURCE, slurmjson_job(job)):
+                    writer.write(job)
+            with stats.timer('write'):
+                writer.close(reader.trailer)
+            stats.output(writer.output)
+        stats.counts['rows_duplicate'] += seen.dropped
 
-        with open(fullpath, "r", encoding='utf-8', errors='ignore') as filep:
-            
-            slurm_log = json.load(filep)
-            fparts = filename.split(".")
+    stats.counts['rows_kept'] += writer.count
+    return stats
 
-            out_jobs = []
+def main():
 
-            for job in slurm_log['jobs']:
-                job['account'] = fparts[2]
-                out_jobs.append(job)
-
-            if out_jobs:
-                slurm_log['jobs'] = out_jobs
-                target = os.path.join(outdir, filename)
-                with open(target, 'w', encoding="utf=8") as outfp:
-                    json.dump(slurm_log, outfp)
-                os.chmod(target, stat.S_IRUSR | stat.S_IWUSR | stat.S_IRGRP | stat.S_IROTH)
+    parser = argument_parser(
+        'postprocess.py',
+        'Set the NAIRR project on the NVIDIA DGX Cloud Slurm JSON logs',
+        indir="/data/dgx/logs",
+        outdir="/data/dgx/postprocessed",
+        statedir="/data/dgx/state",
+        job='nvidia-dgx-cloud'
+    )
+    args = parser.parse_args()
+
+    setup_logging(args, logging.WARNING)
+
+    metrics = run_metrics(args)
+    manifest = Manifest(manifest_path(args), full=args.full)
+    index = job_index(args)
+
+    try:
+        if args.command == 'backfill':
+            stats = backfill(args, manifest).run(process_file, args.indir, filedate, index,
+                                                 jobs=args.jobs, profile=args.profile)
+        else:
+            stats = process_files(process_file, manifest.changed(fileiterator(args.indir)), output_tree(args), index,
+                                  jobs=args.jobs, done=manifest.record, profile=args.profile)
+        stats.log()
+        metrics.record(stats)
+        index.prune()
+    finally:
+        manifest.save()
+        metrics.save()
 
 if __name__ == "__main__":
     main()
@@ -4,10 +4,23 @@ import os
 import logging
 import json
 import datetime
-import tempfile
-import stat
-import shutil
-import pandas as pd
+import sys
+
+sys.path.insert(0, os.environ.get('NAIRR_LIBDIR', '/usr/local/lib/nairr'))
+
+from nairrpp.cli import argument_parser, backfill, job_index, manifest_path, output_tree, run_metrics, setup_logging
+from nairrpp.jobindex import slurmjson_job
+from nairrpp.manifest import Manifest
+from nairrpp.mapping import load_mapping
+from nairrpp.metrics import timed
+from nairrpp.parallel import Stats, process_files
+from nairrpp.slurmjson import SlurmJsonReader, SlurmJsonWriter
+
+def filedate(filename):
+    try:
+        return datetime.datetime.strptime(filename, '%Y-%m-%d.json')
+    except ValueError:
+        return None
 
 def fileiterator(datasource):
     filenames = [x for x in os.listdir(datasource)]
@@ -16,67 +29,104 @@ def fileiterator(datasource):
     now = datetime.datetime.now()
 
     for filename in filenames:
-        try:
-            fdate = datetime.datetime.strptime(filename, '%Y-%m-%d.json')
-            if now - fdate > datetime.timedelta(days=10000):
-                logging.debug('Skip %s due to time range', filename)
-                continue
-        except ValueError:
+        fdate = filedate(filename)
+        if fdate is None:
             logging.warning('Unrecognized filename %s. Skipping', filename)
             continue
+        if now - fdate > datetime.timedelta(days=10000):
+            logging.debug('Skip %s due to time range', filename)
+            continue
 
         fullpath = os.path.join(datasource, filename)
         if os.path.isfile(fullpath):
             yield (fullpath, filename)
 
-def main():
-
-    srcdir = "/projects/xdtas/ccstar/ncsa/delta/slurm_logs/"
-    outdir = "/user/jpwhite4/xdmod-nairr/fstree/data/ncsa/delta"
-
-    logging.basicConfig(format='%(asctime)s [%(levelname)s] %(message)s', datefmt='%Y-%m-%dT%H:%M:%S', level=logging.WARNING)
-    logging.captureWarnings(True)
+def process_file(fullpath, filename, outputs, mapping, index):
+    stats = Stats()
 
-    mapping_data = pd.read_excel('/user/jpwhite4/NAIRR Jan-2025 Usage.xlsx', sheet_name='NCSA')
+    with open(fullpath, "r", encoding='utf-8', errors='ignore') as filep:
 
+        outdata = {}
+        seen = index.source(fullpath)
 
-    mapping = {}
-    for row in mapping_data.iterrows():
-        mapping[row[1]['subgrantnumber']] = row[1]['nairr_grant_number'].lower()
-
-    for fullpath, filename in fileiterator(srcdir):
-
-        with open(fullpath, "r", encoding='utf-8', errors='ignore') as filep:
-            
-            try:
-                slurm_log = json.load(filep)
-            except json.decoder.JSONDecodeError:
-                logging.warning("Unable to JSON decode " + fullpath)
-                continue
-
-            outdata = {}
-
-            for job in slurm_log['jobs']:
-                charge_id = job['account'][0:4]
+        try:
+            for job in timed(SlurmJsonReader(filep), stats.timings, 'parse'):
+                stats.counts['rows_read'] += 1
+                stats.accounts.add(mapping.charge_id(job['account']))
+                grant = mapping.lookup(job['account'])
                 resource = job['account'][5:]
 
-                if charge_id in mapping:
-                    job['account'] = mapping[charge_id]
+                if grant is not None:
+                    job['account'] = grant
 
-                    if resource not in outdata:
-                        outdata[resource] = []
+                    if not seen.emit(resource, slurmjson_job(job)):
+                        continue
 
-                    outdata[resource].append(job)
+                    if resource not in outdata:
+                        outdata[resource] = SlurmJsonWriter(outputs.open(os.path.join(resource, filename)))
+
+                    outdata[resource].write(job)
+                    stats.counts['rows_kept'] += 1
+                else:
+                    stats.unmapped[mapping.charge_id(job['account'])] += 1
+        except json.decoder.JSONDecodeError:
+            logging.error("Unable to JSON decode " + fullpath)
+            for writer in outdata.values():
+                writer.abort()
+            seen.abort()
+            stats.failed = True
+            return stats
+        except BaseException:
+            for writer in outdata.values():
+                writer.abort()
+            seen.abort()
+            raise
+
+        with stats.timer('write'):
+            for writer in outdata.values():
+                writer.close()
+                stats.output(writer.output)
+        seen.close()
+        stats.counts['rows_duplicate'] += seen.dropped
+
+    return stats
 
-            for resource_name, out_jobs in outdata.items():
-                if not os.path.exists(os.path.join(outdir, resource_name)):
-                    os.mkdir(os.path.join(outdir, resource_name))
+def main():
 
-                output = { 'jobs':  out_jobs}
-                target = os.path.join(outdir, resource_name, filename)
-                with open(target, 'w', encoding="utf=8") as outfp:
-                    json.dump(output, outfp)
-                os.chmod(target, stat.S_IRUSR | stat.S_IWUSR | stat.S_IRGRP | stat.S_IROTH)
+    parser = argument_parser(
+        'postprocess.py',
+        'Extract the NAIRR jobs from the NCSA Delta Slurm JSON logs',
+        indir="/projects/xdtas/ccstar/ncsa/delta/slurm_logs/",
+        outdir="/user/jpwhite4/xdmod-nairr/fstree/data/ncsa/delta",
+        statedir="/user/jpwhite4/xdmod-nairr/state/ncsa/delta",
+        mapping='NCSA',
+        job='ncsa-delta'
+    )
+    parser.set_defaults(mapping_source='/user/jpwhite4/NAIRR Jan-2025 Usage.xlsx')
+    args = parser.parse_args()
+
+    setup_logging(args, logging.WARNING)
+
+    metrics = run_metrics(args)
+    with metrics.timer('mapping'):
+        mapping = load_mapping('NCSA', args.mapping_source, args.mapping_cache)
+
+    manifest = Manifest(manifest_path(args), mapping=mapping, full=args.full)
+    index = job_index(args)
+
+    try:
+        if args.command == 'backfill':
+            stats = backfill(args, manifest).run(process_file, args.indir, filedate, mapping, index,
+                                                 jobs=args.jobs, profile=args.profile)
+        else:
+            stats = process_files(process_file, manifest.changed(fileiterator(args.indir)), output_tree(args), mapping, index,
+                                  jobs=args.jobs, done=manifest.record, profile=args.profile)
+        stats.log()
+        metrics.record(stats)
+        index.prune()
+    finally:
+        manifest.save()
+        metrics.save()
 
 if __name__ == "__main__":
     main()
@@ -2,12 +2,22 @@
 
 import os
 import logging
-import csv
 import datetime
-import tempfile
-import stat
-import shutil
-import pandas as pd
+import sys
+
+sys.path.insert(0, os.environ.get('NAIRR_LIBDIR', '/usr/local/lib/nairr'))
+
+from nairrpp.cli import argument_parser, backfill, columnar_store, job_index, manifest_path, output_tree, run_metrics, setup_logging
+from nairrpp.manifest import Manifest
+from nairrpp.mapping import load_mapping
+from nairrpp.parallel import process_files
+from nairrpp.rewrite import PipeRewriter
+
+def filedate(filename):
+    try:
+        return datetime.datetime.strptime(filename, '%Y-%m-%d.jobs')
+    except ValueError:
+        return None
 
 def fileiterator(datasource):
     filenames = [x for x in os.listdir(datasource)]
@@ -16,80 +26,74 @@ def fileiterator(datasource):
     now = datetime.datetime.now()
 
     for filename in filenames:
-        try:
-            fdate = datetime.datetime.strptime(filename, '%Y-%m-%d.jobs')
-            if now - fdate > datetime.timedelta(days=365):
-                logging.debug('Skip %s due to time range', filename)
-                continue
-        except ValueError:
+        fdate = filedate(filename)
+        if fdate is None:
             logging.warning('Unrecognized filename %s. Processing anyway', filename)
+        elif now - fdate > datetime.timedelta(days=365):
+            logging.debug('Skip %s due to time range', filename)
+            continue
 
         fullpath = os.path.join(datasource, filename)
         if os.path.isfile(fullpath):
             yield (fullpath, filename)
 
-def main():
-
-    delimiter = "|"
-
-    srcdir = "/filetransfer/pcparchives/psc/accounting"
-    outdir = "/data/psc-bridges2/postprocessed"
-
-    logging.basicConfig(format='%(asctime)s [%(levelname)s] %(message)s', datefmt='%Y-%m-%dT%H:%M:%S', level=logging.WARNING)
-    logging.captureWarnings(True)
-
-    mapping_data = pd.read_excel('/data/mapping/NAIRR Jan-2025 Usage.xlsx', sheet_name='PSC')
-
-    queue_resmap = {
-        "RM": "PSC-Bridges-2-Regular-Memory",
-        "EM": "PSC-Bridges-2-Extreme-Memory",
-        "GPU": "PSC-Bridges-2-GPU"
-    }
-
-    mapping = {}
-    for row in mapping_data.iterrows():
-        mapping[row[1]['subgrantnumber'].lower()] = row[1]['nairr_grant_number'].lower()
+QUEUE_RESMAP = {
+    "RM": "PSC-Bridges-2-Regular-Memory",
+    "EM": "PSC-Bridges-2-Extreme-Memory",
+    "GPU": "PSC-Bridges-2-GPU"
+}
+
+# The Bridges-2 logs have no QOS or TRES fields
+REWRITER = PipeRewriter({
+    'overflow': 23,
+    'overflow_join': '!',
+    'account': 4,
+    'queue': 3,
+    'insert': {4: 'N/A', 21: ''},
+    'resources': QUEUE_RESMAP,
+    'count_unmapped': True
+})
+
+def process_file(fullpath, filename, outputs, mapping, index, store):
+    return REWRITER.process_file(fullpath, filename, outputs, mapping, index, store)
 
-    for fullpath, filename in fileiterator(srcdir):
-        tmpfiles = {}
-
-        with open(fullpath, "r", encoding='utf-8', errors='ignore') as filep:
-            reader = csv.reader(filep, delimiter=delimiter)
-
-            for line in reader:
-                if line[4] not in mapping:
-                    continue
-
-                if len(line) > 24:
-                    line[23] = "!".join(line[23:])
-
-                line.insert(4, 'N/A') # missing QOS field
-                line.insert(21, '') # missing tres
-                line[5] = mapping[line[5]]
-
-                resource = None
-                for qnam, rname in queue_resmap.items():
-                    if line[3].startswith(qnam):
-                        resource = rname
-                        break
-
-                if resource is None:
-                    logging.error(f"Unrecognized queue {line[3]}")
-                    continue
-
-                if resource not in tmpfiles:
-                    tmpfiles[resource] = tempfile.NamedTemporaryFile(mode="w", encoding="utf=8", delete=False)    
-
-                tmpfiles[resource].write('|'.join(line[0:26]) + "\n")
+def main():
 
-        for hostname, tmpfile in tmpfiles.items():
-            if not os.path.exists(os.path.join(outdir, hostname)):
-                os.mkdir(os.path.join(outdir, hostname))
-            tmpname = tmpfile.name
-            tmpfile.close()
-            target = os.path.join(outdir, hostname, filename)
-            shutil.move(tmpname, target)
-            os.chmod(target, stat.S_IRUSR | stat.S_IWUSR | stat.S_IRGRP | stat.S_IROTH)
+    parser = argument_parser(
+        'postprocess.py',
+        'Extract the NAIRR jobs from the PSC Bridges-2 accounting logs',
+        indir="/filetransfer/pcparchives/psc/accounting",
+        outdir="/data/psc-bridges2/postprocessed",
+        statedir="/data/psc-bridges2/state",
+        mapping='PSC',
+        job='psc-bridges2',
+        columnar=True
+    )
+    args = parser.parse_args()
+
+    setup_logging(args, logging.WARNING)
+
+    metrics = run_metrics(args)
+    with metrics.timer('mapping'):
+        mapping = load_mapping('PSC', args.mapping_source, args.mapping_cache)
+
+    manifest = Manifest(manifest_path(args), mapping=mapping, full=args.full)
+    index = job_index(args)
+    store = columnar_store(args)
+
+    try:
+        if args.command == 'backfill':
+            stats = backfill(args, manifest).run(process_file, args.indir, filedate, mapping, index, store,
+                                                 jobs=args.jobs, profile=args.profile)
+        else:
+            stats = process_files(process_file, manifest.changed(fileiterator(args.indir)), output_tree(args), mapping, index, store,
+                                  jobs=args.jobs, done=manifest.record, profile=args.profile)
+        stats.log()
+        metrics.record(stats)
+        index.prune()
+    finally:
+        manifest.save()
+        metrics.save()
 
 if __name__ == "__main__":
     main()
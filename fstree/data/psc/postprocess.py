@@ -2,12 +2,26 @@
 
 import os
 import logging
-import json
 import datetime
-import tempfile
-import stat
-import shutil
-import pandas as pd
+import sys
+
+sys.path.insert(0, os.environ.get('NAIRR_LIBDIR', '/usr/local/lib/nairr'))
+
+from nairrpp.cli import argument_parser, backfill, job_index, manifest_path, output_tree, run_metrics, setup_logging
+from nairrpp.jobindex import slurmjson_job
+from nairrpp.manifest import Manifest
+from nairrpp.mapping import load_mapping
+from nairrpp.metrics import timed
+from nairrpp.parallel import Stats, process_files
+from nairrpp.slurmjson import SlurmJsonReader, SlurmJsonWriter
+
+RESOURCE = 'PSC-Neocortex'
+
+def filedate(filename):
+    try:
+        return datetime.datetime.strptime(filename[-15:], '%Y-%m-%d.json')
+    except ValueError:
+        return None
 
 def fileiterator(datasource):
     filenames = [x for x in os.listdir(datasource)]
@@ -16,56 +30,81 @@ def fileiterator(datasource):
     now = datetime.datetime.now()
 
     for filename in filenames:
-        try:
-            fdate = datetime.datetime.strptime(filename[-15:], '%Y-%m-%d.json')
-            if now - fdate > datetime.timedelta(days=365):
-                logging.debug('Skip %s due to time range', filename)
-                continue
-        except ValueError:
+        fdate = filedate(filename)
+        if fdate is None:
             logging.warning('Unrecognized filename %s. Skipping', filename)
             continue
+        if now - fdate > datetime.timedelta(days=365):
+            logging.debug('Skip %s due to time range', filename)
+            continue
 
         fullpath = os.path.join(datasource, filename)
         if os.path.isfile(fullpath):
             yield (fullpath, filename)
 
-def main():
-
-    srcdir = "/data/psc/neocortex"
-    outdir = "/data/psc/postprocessed"
-
-    logging.basicConfig(format='%(asctime)s [%(levelname)s] %(message)s', datefmt='%Y-%m-%dT%H:%M:%S', level=logging.WARNING)
-    logging.captureWarnings(True)
+def process_file(fullpath, filename, outputs, mapping, index):
+    stats = Stats()
 
-    mapping_data = pd.read_excel('/data/mapping/NAIRR Jan-2025 Usage.xlsx', sheet_name='PSC')
+    with open(fullpath, "r", encoding='utf-8', errors='ignore') as filep:
 
+        reader = SlurmJsonReader(filep)
 
-    mapping = {}
-    for row in mapping_data.iterrows():
-        mapping[str(row[1]['subgrantnumber']).lower()] = row[1]['nairr_grant_number'].lower()
-
-    for fullpath, filename in fileiterator(srcdir):
-
-        with open(fullpath, "r", encoding='utf-8', errors='ignore') as filep:
-            
-            slurm_log = json.load(filep)
-
-            out_jobs = []
-
-            for job in slurm_log['jobs']:
-                charge_id = job['account']
-                if charge_id in mapping:
-                    job['account'] = mapping[charge_id]
+        with index.source(fullpath) as seen, SlurmJsonWriter(outputs.open(filename), reader.header) as writer:
+            for job in timed(reader, stats.timings, 'parse'):
+                stats.counts['rows_read'] += 1
+                stats.accounts.add(mapping.charge_id(job['account']))
+                grant = mapping.lookup(job['account'])
+                if grant is not None:
+                    job['account'] = grant
                     if job['user'] is None:
                         job['user'] = job['group']
-                    out_jobs.append(job)
-
-            if out_jobs:
-                slurm_log['jobs'] = out_jobs
-                target = os.path.join(outdir, filename)
-                with open(target, 'w', encoding="utf=8") as outfp:
-                    json.dump(slurm_log, outfp)
-                os.chmod(target, stat.S_IRUSR | stat.S_IWUSR | stat.S_IRGRP | stat.S_IROTH)
+                    if seen.emit(RESOURCE, slurmjson_job(job)):
+                        writer.write(job)
+                        stats.counts['rows_kept'] += 1
+                else:
+                    stats.unmapped[job['account']] += 1
+            with stats.timer('write'):
+                writer.close(reader.trailer)
+            stats.output(writer.output)
+        stats.counts['rows_duplicate'] += seen.dropped
+
+    return stats
+
+def main():
+
+    parser = argument_parser(
+        'postprocess.py',
+        'Extract the NAIRR jobs from the PSC Neocortex Slurm JSON logs',
+        indir="/data/psc/neocortex",
+        outdir="/data/psc/postprocessed",
+        statedir="/data/psc/state",
+        mapping='PSC',
+        job='psc-neocortex'
+    )
+    args = parser.parse_args()
+
+    setup_logging(args, logging.WARNING)
+
+    metrics = run_metrics(args)
+    with metrics.timer('mapping'):
+        mapping = load_mapping('PSC', args.mapping_source, args.mapping_cache)
+
+    manifest = Manifest(manifest_path(args), mapping=mapping, full=args.full)
+    index = job_index(args)
+
+    try:
+        if args.command == 'backfill':
+            stats = backfill(args, manifest).run(process_file, args.indir, filedate, mapping, index,
+                                                 jobs=args.jobs, profile=args.profile)
+        else:
+            stats = process_files(process_file, manifest.changed(fileiterator(args.indir)), output_tree(args), mapping, index,
+                                  jobs=args.jobs, done=manifest.record, profile=args.profile)
+        stats.log()
+        metrics.record(stats)
+        index.prune()
+    finally:
+        manifest.save()
+        metrics.save()
 
 if __name__ == "__main__":
     main()
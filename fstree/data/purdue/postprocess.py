@@ -2,12 +2,22 @@
 
 import os
 import logging
-import csv
 import datetime
-import tempfile
-import stat
-import shutil
-import pandas as pd
+import sys
+
+sys.path.insert(0, os.environ.get('NAIRR_LIBDIR', '/usr/local/lib/nairr'))
+
+from nairrpp.cli import argument_parser, backfill, columnar_store, job_index, manifest_path, output_tree, run_metrics, setup_logging
+from nairrpp.manifest import Manifest
+from nairrpp.mapping import load_mapping
+from nairrpp.parallel import process_files
+from nairrpp.rewrite import PipeRewriter
+
+def filedate(filename):
+    try:
+        return datetime.datetime.strptime(filename, '%Y%m%d')
+    except ValueError:
+        return None
 
 def fileiterator(datasource):
     filenames = [x for x in os.listdir(datasource)]
@@ -16,62 +26,66 @@ def fileiterator(datasource):
     now = datetime.datetime.now()
 
     for filename in filenames:
-        try:
-            fdate = datetime.datetime.strptime(filename, '%Y%m%d')
-            if now - fdate > datetime.timedelta(days=600):
-                logging.debug('Skip %s due to time range', filename)
-                continue
-        except ValueError:
+        fdate = filedate(filename)
+        if fdate is None:
             logging.warning('Unrecognized filename %s. Processing anyway', filename)
+        elif now - fdate > datetime.timedelta(days=600):
+            logging.debug('Skip %s due to time range', filename)
+            continue
 
         fullpath = os.path.join(datasource, filename)
         if os.path.isfile(fullpath):
             yield (fullpath, filename)
 
-def main():
-
-    delimiter = "|"
-
-    srcdir = "/filetransfer/pcparchives/purdue/anvil/sacct"
-    outdir = "/data/purdue/anvil"
-
-    logging.basicConfig(format='%(asctime)s [%(levelname)s] %(message)s', datefmt='%Y-%m-%dT%H:%M:%S', level=logging.WARNING)
-    logging.captureWarnings(True)
+REWRITER = PipeRewriter({
+    'overflow': 25,
+    'overflow_join': '!',
+    'account': 5,
+    'queue': 3,
+    'resources': {'gpu': 'Purdue-Anvil-GPU'},
+    'default_resource': 'Purdue-Anvil-CPU',
+    'ignore_case': True
+})
 
-    for fullpath, filename in fileiterator(srcdir):
-        tmpfiles = {}
+def process_file(fullpath, filename, outputs, mapping, index, store):
+    return REWRITER.process_file(fullpath, filename, outputs, mapping, index, store)
 
-        with open(fullpath, "r", encoding='utf-8', errors='ignore') as filep:
-            reader = csv.reader(filep, delimiter=delimiter)
-
-            for line in reader:
-                if not line[5].startswith('ai'):
-                    continue
-
-                queue = line[3]
-                if queue.lower().startswith('gpu'):
-                    resource = 'Purdue-Anvil-GPU'
-                else:
-                    resource = 'Purdue-Anvil-CPU'
-
-                if len(line) > 26:
-                    line[25] = "!".join(line[25:])
-
-                line[5] = 'NAIRR' + line[5][2:8]
-
-                if resource not in tmpfiles:
-                    tmpfiles[resource] = tempfile.NamedTemporaryFile(mode="w", encoding="utf=8", delete=False)    
-
-                tmpfiles[resource].write('|'.join(line[0:26]) + "\n")
+def main():
 
-        for hostname, tmpfile in tmpfiles.items():
-            if not os.path.exists(os.path.join(outdir, hostname)):
-                os.mkdir(os.path.join(outdir, hostname))
-            tmpname = tmpfile.name
-            tmpfile.close()
-            target = os.path.join(outdir, hostname, filename)
-            shutil.move(tmpname, target)
-            os.chmod(target, stat.S_IRUSR | stat.S_IWUSR | stat.S_IRGRP | stat.S_IROTH)
+    parser = argument_parser(
+        'postprocess.py',
+        'Extract the NAIRR jobs from the Purdue Anvil accounting logs',
+        indir="/filetransfer/pcparchives/purdue/anvil/sacct",
+        outdir="/data/purdue/anvil",
+        statedir="/data/purdue/state",
+        job='purdue-anvil',
+        columnar=True
+    )
+    args = parser.parse_args()
+
+    setup_logging(args, logging.WARNING)
+
+    metrics = run_metrics(args)
+    with metrics.timer('mapping'):
+        mapping = load_mapping('Purdue')
+
+    manifest = Manifest(manifest_path(args), mapping=mapping, full=args.full)
+    index = job_index(args)
+    store = columnar_store(args)
+
+    try:
+        if args.command == 'backfill':
+            stats = backfill(args, manifest).run(process_file, args.indir, filedate, mapping, index, store,
+                                                 jobs=args.jobs, profile=args.profile)
+        else:
+            stats = process_files(process_file, manifest.changed(fileiterator(args.indir)), output_tree(args), mapping, index, store,
+                                  jobs=args.jobs, done=manifest.record, profile=args.profile)
+        stats.log()
+        metrics.record(stats)
+        index.prune()
+    finally:
+        manifest.save()
+        metrics.save()
 
 if __name__ == "__main__":
     main()
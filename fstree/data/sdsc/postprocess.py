@@ -4,12 +4,28 @@ import os
 import logging
 import json
 import datetime
-import tempfile
-import stat
-import shutil
 import gzip
 import re
-import pandas as pd
+import sys
+import zlib
+
+sys.path.insert(0, os.environ.get('NAIRR_LIBDIR', '/usr/local/lib/nairr'))
+
+from nairrpp.cli import argument_parser, backfill, job_index, manifest_path, output_tree, run_metrics, setup_logging
+from nairrpp.jobindex import slurmjson_job
+from nairrpp.manifest import Manifest
+from nairrpp.mapping import load_mapping
+from nairrpp.metrics import timed
+from nairrpp.parallel import Stats, process_files
+from nairrpp.slurmjson import SlurmJsonReader, SlurmJsonWriter
+
+FILENAME = re.compile("^sacct_json_([a-z_]+)_([0-9]{4}-[0-9]{2}-[0-9]{2}).json.gz$")
+
+def filedate(filename):
+    mtch = FILENAME.match(filename)
+    if not mtch:
+        return None
+    return datetime.datetime.strptime(mtch.group(2), '%Y-%m-%d')
 
 def fileiterator(datasource):
     filenames = [x for x in os.listdir(datasource)]
@@ -17,16 +33,10 @@ def fileiterator(datasource):
 
     now = datetime.datetime.now()
 
-    exp = re.compile("^sacct_json_([a-z_]+)_([0-9]{4}-[0-9]{2}-[0-9]{2}).json.gz$")
-
     for filename in filenames:
-        mtch = exp.match(filename)
-        if not mtch:
+        fdate = filedate(filename)
+        if fdate is None:
             continue
-        #if mtch.group(1) != 'expanse_gpu':
-        #    continue
-
-        fdate = datetime.datetime.strptime(mtch.group(2), '%Y-%m-%d')
         if now - fdate > datetime.timedelta(days=30):
             logging.debug('Skip %s due to time range', filename)
             continue
@@ -35,54 +45,91 @@ def fileiterator(datasource):
         if os.path.isfile(fullpath):
             yield (fullpath, filename)
 
-def main():
-
-    srcdir = "/filetransfer/pcparchives/sdsc/accounting/"
-    outdir = "/data/sdsc/postprocessed"
-
-    logging.basicConfig(format='%(asctime)s [%(levelname)s] %(message)s', datefmt='%Y-%m-%dT%H:%M:%S', level=logging.WARNING)
-    logging.captureWarnings(True)
-
-    mapping_data = pd.read_excel('/data/mapping/NAIRR Jan-2025 Usage.xlsx', sheet_name='SDSC')
+# Cluster in the filename -> XDMoD resource. The resources are not in
+# resources.json yet: generate_resources.py adds them once XRAS lists
+# Expanse for NAIRR, and the shred stages stay disabled until then
+CLUSTER_RESMAP = {
+    'expanse': 'SDSC-Expanse',
+    'expanse_gpu': 'SDSC-Expanse-GPU'
+}
+
+def process_file(fullpath, filename, outputs, mapping, index):
+    stats = Stats()
+
+    cluster = FILENAME.match(filename).group(1)
+    resource = CLUSTER_RESMAP.get(cluster)
+    if resource is None:
+        logging.error('Unrecognized cluster %s in %s', cluster, filename)
+        stats.failed = True
+        return stats
+
+    # The dumps are decompressed and parsed incrementally, one job at a time
+    with gzip.open(fullpath, "rt", encoding='utf-8', errors='ignore') as filep:
+
+        reader = SlurmJsonReader(filep)
+        outfilename = os.path.join(resource, filename[:-len('.gz')])
+
+        try:
+            with index.source(fullpath) as seen, SlurmJsonWriter(outputs.open(outfilename), reader.header) as writer:
+                for job in timed(reader, stats.timings, 'parse'):
+                    stats.counts['rows_read'] += 1
+                    stats.accounts.add(mapping.charge_id(job['account']))
+                    grant = mapping.lookup(job['account'])
+                    if grant is not None:
+                        job['account'] = grant
+                        if seen.emit(resource, slurmjson_job(job)):
+                            writer.write(job)
+                            stats.counts['rows_kept'] += 1
+                    else:
+                        stats.unmapped[job['account']] += 1
+                with stats.timer('write'):
+                    writer.close(reader.trailer)
+                stats.output(writer.output)
+        except (json.decoder.JSONDecodeError, EOFError, zlib.error) as exc:
+            # A truncated transfer or corrupt gzip stream, retried by the next run
+            logging.error("Unable to read %s: %s", fullpath, exc)
+            stats.failed = True
+            return stats
+
+        stats.counts['rows_duplicate'] += seen.dropped
+
+    return stats
 
+def main():
 
-    mapping = {}
-    for row in mapping_data.iterrows():
-        mapping[row[1]['SDSC Local Project id'].lower()] = row[1]['NAIRR Grant'].lower()
-
-    for fullpath, filename in fileiterator(srcdir):
-
-        with gzip.open(fullpath, "r") as filep:
-            
-            try:
-                slurm_log = json.load(filep)
-            except json.decoder.JSONDecodeError:
-                logging.warning("Unable to JSON decode " + fullpath)
-                continue
-
-            outdata = {}
-
-            for job in slurm_log['jobs']:
-                charge_id = job['account']
-                resource = 'todo'
-
-                if charge_id in mapping:
-                    job['account'] = mapping[charge_id]
-
-                    if resource not in outdata:
-                        outdata[resource] = []
-
-                    outdata[resource].append(job)
-
-            for resource_name, out_jobs in outdata.items():
-                if not os.path.exists(os.path.join(outdir, resource_name)):
-                    os.mkdir(os.path.join(outdir, resource_name))
-
-                output = { 'jobs':  out_jobs}
-                target = os.path.join(outdir, resource_name, filename)
-                with open(target, 'w', encoding="utf=8") as outfp:
-                    json.dump(output, outfp)
-                os.chmod(target, stat.S_IRUSR | stat.S_IWUSR | stat.S_IRGRP | stat.S_IROTH)
+    parser = argument_parser(
+        'postprocess.py',
+        'Extract the NAIRR jobs from the SDSC Slurm JSON logs',
+        indir="/filetransfer/pcparchives/sdsc/accounting/",
+        outdir="/data/sdsc/postprocessed",
+        statedir="/data/sdsc/state",
+        mapping='SDSC',
+        job='sdsc'
+    )
+    args = parser.parse_args()
+
+    setup_logging(args, logging.WARNING)
+
+    metrics = run_metrics(args)
+    with metrics.timer('mapping'):
+        mapping = load_mapping('SDSC', args.mapping_source, args.mapping_cache)
+
+    manifest = Manifest(manifest_path(args), mapping=mapping, full=args.full)
+    index = job_index(args)
+
+    try:
+        if args.command == 'backfill':
+            stats = backfill(args, manifest).run(process_file, args.indir, filedate, mapping, index,
+                                                 jobs=args.jobs, profile=args.profile)
+        else:
+            stats = process_files(process_file, manifest.changed(fileiterator(args.indir)), output_tree(args), mapping, index,
+                                  jobs=args.jobs, done=manifest.record, profile=args.profile)
+        stats.log()
+        metrics.record(stats)
+        index.prune()
+    finally:
+        manifest.save()
+        metrics.save()
 
 if __name__ == "__main__":
     main()
@@ -16,10 +16,15 @@ ORDER BY RES.PRODUCTION_BEGIN_DATE ASC,
 	RES.RESOURCE_NAME ASC
 """
 
-import psycopg2
 import json
+import os
 import re
-import configparser
+import sys
+
+sys.path.insert(0, os.environ.get('NAIRR_LIBDIR', '/usr/local/lib/nairr'))
+
+from nairrpp.configmerge import RESOURCE_SPEC_UPDATE, RESOURCE_UPDATE, KeyedConfig
+from nairrpp.xras import connect
 
 
 rtype_map = {
@@ -41,26 +46,10 @@ def main():
 
     XDMOD_CONFIG_PATH='/etc/xdmod'
 
-    config = configparser.ConfigParser()
-    config.read(f'{XDMOD_CONFIG_PATH}/portal_settings.ini')
-
-    resources = {}
-
-    with open(f'{XDMOD_CONFIG_PATH}/resources.json', 'r') as resources_file:
-        for res in json.load(resources_file):
-            resources[res['resource']] = {'fact': res}
-
-    with open(f'{XDMOD_CONFIG_PATH}/resource_specs.json', 'r') as resourcespecs_file:
-        for res in json.load(resourcespecs_file):
-            resources[res['resource']]['specs'] = res
-
-    print(json.dumps(resources))
+    resources = KeyedConfig.load(f'{XDMOD_CONFIG_PATH}/resources.json', 'resource')
+    specs = KeyedConfig.load(f'{XDMOD_CONFIG_PATH}/resource_specs.json', 'resource')
 
-    with psycopg2.connect(database=config['tgcdbmirror']['database'].strip("'"),
-                        host=config['tgcdbmirror']['host'].strip("'"),
-                        user=config['tgcdbmirror']['user'].strip("'"),
-                        password=config['tgcdbmirror']['pass'].strip("'"),
-                        port=config['tgcdbmirror']['port'].strip("'")) as conn:
+    with connect(f'{XDMOD_CONFIG_PATH}/portal_settings.ini') as conn:
 
         with conn.cursor() as curs:
             curs.execute(sql)
@@ -68,45 +57,38 @@ def main():
 
                 resource = demangle_name(data[1])
 
-                if resource not in resources:
-                    resources[resource] = {
-                        'fact': {
-                            'resource': resource,
-                            'resource_type': rtype_map[data[3]],
-                            'name': data[1],
-                            'description': data[2],
-                            'resource_allocation_type': 'CPUNode',
-                            'timezone': 'EST',
-                            'pi_column': 'account_name'
-                        },
-                        'specs': {
-                            'resource': resource,
-                            'start_date': '1970-01-01',
-                            'cpu_node_count': 1,
-                            'cpu_processor_count': 1,
-                            'cpu_ppn': 1,
-                            'gpu_node_count': 0,
-                            'gpu_processor_count': 0,
-                            'gpu_ppn': 0
-                        }
-                    }
-                    if data[4]:
-                        resources[resource]['specs']['start_date'] = data[4].strftime('%Y-%m-%d'),
-                    if data[5]:
-                        resources[resource]['specs']['end_date'] = data[5].strftime('%Y-%m-%d')
-
-        rfact = []
-        rspec = []
-
-        for info in resources.values():
-            rfact.append(info['fact'])
-            rspec.append(info['specs'])
-
-        with open('resources.json', 'w') as filep:
-            json.dump(rfact, filep, indent=4)
-
-        with open('resource_specs.json', 'w') as filep:
-            json.dump(rspec, filep, indent=4)
+                # Resources that are already configured are kept as they
+                # are, apart from the end of production
+                resources.upsert({
+                    'resource': resource,
+                    'resource_type': rtype_map[data[3]],
+                    'name': data[1],
+                    'description': data[2],
+                    'resource_allocation_type': 'CPUNode',
+                    'timezone': 'EST',
+                    'pi_column': 'account_name'
+                }, update=RESOURCE_UPDATE)
+
+                spec = {
+                    'resource': resource,
+                    'start_date': '1970-01-01',
+                    'cpu_node_count': 1,
+                    'cpu_processor_count': 1,
+                    'cpu_ppn': 1,
+                    'gpu_node_count': 0,
+                    'gpu_processor_count': 0,
+                    'gpu_ppn': 0
+                }
+                if data[4]:
+                    spec['start_date'] = data[4].strftime('%Y-%m-%d')
+                if data[5]:
+                    spec['end_date'] = data[5].strftime('%Y-%m-%d')
+                specs.upsert(spec, update=RESOURCE_SPEC_UPDATE)
+
+    resources.write('resources.json')
+    specs.write('resource_specs.json')
+
+    print(json.dumps({'resources.json': resources.diff(), 'resource_specs.json': specs.diff()}, indent=4))
 
 if __name__ == "__main__":
     main()
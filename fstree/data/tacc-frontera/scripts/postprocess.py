@@ -3,6 +3,23 @@
 import logging
 import os
 import datetime
+import sys
+
+sys.path.insert(0, os.environ.get('NAIRR_LIBDIR', '/usr/local/lib/nairr'))
+
+from nairrpp.cli import argument_parser, backfill, columnar_store, job_index, manifest_path, output_tree, run_metrics, setup_logging
+from nairrpp.columnar import SLURM_ACCOUNT, SLURM_FIELDS, split_slurm
+from nairrpp.jobindex import slurm_job, slurm_line_job
+from nairrpp.manifest import Manifest
+from nairrpp.metrics import timed
+from nairrpp.parallel import Stats, process_files
+from nairrpp.prefilter import LineFilter
+
+def filedate(filename):
+    try:
+        return datetime.datetime.strptime(filename, '%Y-%m-%d.log')
+    except ValueError:
+        return None
 
 def fileiterator(datasource):
     filenames = [x for x in os.listdir(datasource)]
@@ -11,47 +28,123 @@ def fileiterator(datasource):
     now = datetime.datetime.now()
 
     for filename in filenames:
-        try:
-            fdate = datetime.datetime.strptime(filename, '%Y-%m-%d.log')
-            if now - fdate > datetime.timedelta(days=365):
-                logging.debug('Skip %s due to time range', filename)
-                continue
-        except ValueError:
+        fdate = filedate(filename)
+        if fdate is None:
             logging.warning('Unrecognized filename %s. Processing anyway', filename)
+        elif now - fdate > datetime.timedelta(days=365):
+            logging.debug('Skip %s due to time range', filename)
+            continue
 
         fullpath = os.path.join(datasource, filename)
         if os.path.isfile(fullpath):
             yield (fullpath, filename)
 
-def main():
+# The rtx partitions have 4 GPUs per node, which sacct does not report
+GPU_PARTITIONS = (b'rtx', b'rtx-dev')
+GPUS_PER_NODE = 4
+
+NNODES = SLURM_FIELDS.index('nnodes')
+GPU_TRES = [SLURM_FIELDS.index('reqtres'), SLURM_FIELDS.index('alloctres')]
+
+def gputres(tres, gpus):
+    """ The TRES list with its GPU count replaced by gpus """
+
+    items = [item for item in tres.split(',') if item and not item.startswith('gres/gpu')]
+    items.append('gres/gpu=%d' % gpus)
+    return ','.join(items)
+
+def process_file(fullpath, filename, outputs, index, store, delimiter="|"):
+    stats = Stats()
 
-    delimiter = "|"
+    outfiles = {}
+    seen = index.source(fullpath)
+    part = store.writer(fullpath)
+    try:
+        lines = LineFilter(fullpath, 5, b'nairr', delimiter.encode())
+        for line, tokens in timed(lines, stats.timings, 'read'):
+            # Only the GPU jobs and the columnar store need the decoded
+            # fields, the other lines are written out as read
+            fields = None
 
-    srcdir = "/filetransfer/tacc/frontera/accounting"
-    outdir = "/data/tacc-frontera/post-processed"
+            if tokens[3] in GPU_PARTITIONS:
+                res = 'TACC Frontera GPU'
+                fields = split_slurm(line.decode('utf-8', 'replace'), delimiter)
+                try:
+                    gpus = int(fields[NNODES]) * GPUS_PER_NODE
+                except ValueError:
+                    logging.warning('Job %s has no node count, GPU count not set', fields[0])
+                else:
+                    for tres in GPU_TRES:
+                        fields[tres] = gputres(fields[tres], gpus)
+                    line = (delimiter.join(fields) + '\n').encode('utf-8')
+            else:
+                res = 'TACC Frontera'
 
-    logging.basicConfig(format='%(asctime)s [%(levelname)s] %(message)s', datefmt='%Y-%m-%dT%H:%M:%S', level=logging.INFO)
-    logging.captureWarnings(True)
+            if part.enabled:
+                if fields is None:
+                    fields = split_slurm(line.decode('utf-8', 'replace'), delimiter)
+                part.add(res, fields, fields[SLURM_ACCOUNT], os.path.join(res, filename))
+
+            job = slurm_job(fields) if fields is not None else slurm_line_job(line, delimiter.encode())
+            if not seen.emit(res, job):
+                continue
+
+            if res not in outfiles:
+                outfiles[res] = outputs.open(os.path.join(res, filename))
+            outfiles[res].write(line)
+            stats.counts['rows_kept'] += 1
+    except BaseException:
+        for outf in outfiles.values():
+            outf.abort()
+        seen.abort()
+        part.abort()
+        raise
+
+    with stats.timer('write'):
+        for outf in outfiles.values():
+            outf.close()
+            stats.output(outf)
+    seen.close()
+    part.close()
+
+    stats.counts['rows_duplicate'] += seen.dropped
+
+    stats.counts['rows_read'] += lines.lines
+    return stats
+
+def main():
 
-    for fullpath, filename in fileiterator(srcdir):
-        with open(fullpath, "r", encoding='utf-8', errors='ignore') as filep:
+    parser = argument_parser(
+        'postprocess.py',
+        'Extract the NAIRR jobs from the TACC Frontera accounting logs',
+        indir="/filetransfer/tacc/frontera/accounting",
+        outdir="/data/tacc-frontera/post-processed",
+        statedir="/data/tacc-frontera/state",
+        job='tacc-frontera',
+        columnar=True
+    )
+    args = parser.parse_args()
 
-            outdata = { 'TACC Frontera': [], 'TACC Frontera GPU': [] }
+    setup_logging(args)
 
-            for line in filep:
-                tokens = line.split(delimiter)
+    metrics = run_metrics(args)
+    manifest = Manifest(manifest_path(args), full=args.full)
+    index = job_index(args)
+    store = columnar_store(args)
 
-                if tokens[5].startswith('nairr'):
-                    if tokens[3] in ['rtx', 'rtx-dev']:
-                        outdata['TACC Frontera GPU'].append(line)
-                    else:
-                        outdata['TACC Frontera'].append(line)
+    try:
+        if args.command == 'backfill':
+            stats = backfill(args, manifest).run(process_file, args.indir, filedate, index, store,
+                                                 jobs=args.jobs, profile=args.profile)
+        else:
+            stats = process_files(process_file, manifest.changed(fileiterator(args.indir)), output_tree(args), index, store,
+                                  jobs=args.jobs, done=manifest.record, profile=args.profile)
+        stats.log()
+        metrics.record(stats)
+        index.prune()
+    finally:
+        manifest.save()
+        metrics.save()
 
-            for res, data in outdata.items():
-                if len(data) > 0:
-                    with open(f"{outdir}/{res}/{filename}", "w") as outf:
-                        for record in data:
-                            outf.write(record)
-            
 if __name__ == "__main__":
     main()
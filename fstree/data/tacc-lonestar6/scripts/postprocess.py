@@ -4,9 +4,24 @@ import logging
 import os
 import datetime
 import csv
-import argparse
+import functools
+import operator
+import sys
 from collections import defaultdict
 
+sys.path.insert(0, os.environ.get('NAIRR_LIBDIR', '/usr/local/lib/nairr'))
+
+from nairrpp.cli import argument_parser, backfill, columnar_store, job_index, manifest_path, output_tree, run_metrics, setup_logging
+from nairrpp.jobindex import slurm_job
+from nairrpp.manifest import Manifest
+from nairrpp.parallel import Stats, process_files
+
+def filedate(filename):
+    try:
+        return datetime.datetime.strptime(filename, '%Y-%m-%d.txt')
+    except ValueError:
+        return None
+
 def fileiterator(datasource):
     filenames = [x for x in os.listdir(datasource)]
     filenames.sort()
@@ -14,13 +29,12 @@ def fileiterator(datasource):
     now = datetime.datetime.now()
 
     for filename in filenames:
-        try:
-            fdate = datetime.datetime.strptime(filename, '%Y-%m-%d.txt')
-            if now - fdate > datetime.timedelta(days=365):
-                logging.debug('Skip %s due to time range', filename)
-                continue
-        except ValueError:
+        fdate = filedate(filename)
+        if fdate is None:
             logging.warning('Unrecognized filename %s. Processing anyway', filename)
+        elif now - fdate > datetime.timedelta(days=365):
+            logging.debug('Skip %s due to time range', filename)
+            continue
 
         fullpath = os.path.join(datasource, filename)
         if os.path.isfile(fullpath):
@@ -57,115 +71,167 @@ MAPPING = {
     "nodelist": "NodeList"
 }
 
-def getresource(row):
-    partition = row['Partition']
-    if partition in ['development', 'normal', 'large', 'vm-small']:
-        return 'TACC-Lonestar6'
-    elif partition in ['gpu-a100', 'gpu-a100-dev', 'gpu-a100-small', 'gpu-h100']:
-        return 'TACC-Lonestar6-GPU'
-    else:
-        raise Exception("Unknown queue", partition)
-    
-def getcores(row):
-    partition = row['Partition']
-    nodes = int(row['NNodes'])
-
-    if partition in ['development', 'normal', 'large']:
-        return 128 * nodes
-    elif partition in ['gpu-a100', 'gpu-a100-dev']:
-        return 128 * nodes
-    elif partition in ['gpu-a100-small']:
-        return 32 * nodes
-    elif partition in ['vm-small']:
-        return 16 * nodes
-    elif partition in ['gpu-h100']:
-        return 96 * nodes
-    else:
-        raise Exception("Unknown queue", partition)
-
-def getgres(row):
-    partition = row['Partition']
-    nodes = int(row['NNodes'])
-
-    if partition in ['development', 'normal', 'large']:
-        return ""
-    elif partition in ['gpu-a100', 'gpu-a100-dev']:
-        return "gres/gpu=3"
-    elif partition in ['gpu-a100-small']:
-        return "gres/gpu=1"
-    elif partition in ['vm-small']:
-        return ""
-    elif partition in ['gpu-h100']:
-        return "gres/gpu=2"
-    else:
-        raise Exception("Unknown queue", partition)
-
-
-def getelapsed(row):
-    if row['Start'] == 'None':
+# partition: (resource, cores per node, gres)
+PARTITIONS = {
+    'development': ('TACC-Lonestar6', 128, ''),
+    'normal': ('TACC-Lonestar6', 128, ''),
+    'large': ('TACC-Lonestar6', 128, ''),
+    'vm-small': ('TACC-Lonestar6', 16, ''),
+    'gpu-a100': ('TACC-Lonestar6-GPU', 128, 'gres/gpu=3'),
+    'gpu-a100-dev': ('TACC-Lonestar6-GPU', 128, 'gres/gpu=3'),
+    'gpu-a100-small': ('TACC-Lonestar6-GPU', 32, 'gres/gpu=1'),
+    'gpu-h100': ('TACC-Lonestar6-GPU', 96, 'gres/gpu=2')
+}
+
+# Fields that are calculated per row, in the order they are appended to the
+# input row by process_file()
+COMPUTED = ['elapsed', 'gres', 'ncpus']
+COMPUTEDMAP = {
+    'elapsed': 'elapsed',
+    'reqtres': 'gres',
+    'alloctres': 'gres',
+    'ncpus': 'ncpus'
+}
+
+
+def compile_plan(header):
+    """ Return an itemgetter that picks the output fields out of
+        input row + CONSTMAP values + COMPUTED values """
+
+    columns = {name: idx for idx, name in enumerate(header)}
+    constbase = len(header)
+    computedbase = constbase + len(CONSTMAP)
+    constpos = {field: constbase + idx for idx, field in enumerate(CONSTMAP)}
+
+    indexes = []
+    for field in OUTFIELDS:
+        if field in MAPPING:
+            indexes.append(columns[MAPPING[field]])
+        elif field in CONSTMAP:
+            indexes.append(constpos[field])
+        elif field in COMPUTEDMAP:
+            indexes.append(computedbase + COMPUTED.index(COMPUTEDMAP[field]))
+        else:
+            raise Exception("Unknown field: " + field)
+
+    return operator.itemgetter(*indexes)
+
+
+@functools.lru_cache(maxsize=4096)
+def _daynumber(datestr):
+    return datetime.date(int(datestr[0:4]), int(datestr[5:7]), int(datestr[8:10])).toordinal()
+
+
+def timestamp(value):
+    """ Seconds since 0001-01-01 for a sacct YYYY-MM-DDTHH:MM:SS time or None if it is not one """
+
+    if len(value) != 19 or value[10] != 'T':
+        return None
+    try:
+        return _daynumber(value[:10]) * 86400 + int(value[11:13]) * 3600 + int(value[14:16]) * 60 + int(value[17:19])
+    except ValueError:
+        return None
+
+
+def getelapsed(start, end):
+    """ Wall time of a job as minutes:seconds, empty if it did not start or end """
+
+    start = timestamp(start)
+    end = timestamp(end)
+    if start is None or end is None or end < start:
         return ''
-    
-    start = datetime.datetime.strptime(row['Start'], "%Y-%m-%dT%H:%M:%S")
-    end = datetime.datetime.strptime(row['End'], "%Y-%m-%dT%H:%M:%S")
-    duration = (end - start).seconds
-    minutes = duration // 60
-    seconds = duration % 60
-    return f'{minutes}:{seconds}'
-              
-def main():
 
-    parser = argparse.ArgumentParser(
-                    prog='ProgramName',
-                    description='What the program does',
-                    epilog='Text at the bottom of help')
+    duration = end - start
+    return f'{duration // 60}:{duration % 60}'
+
+
+def process_file(fullpath, filename, outputs, index, store, delimiter="|"):
+    stats = Stats()
+
+    with stats.timer('read'), open(fullpath, "r", encoding='utf-8', errors='ignore') as filep:
+        acct = csv.reader(filep, delimiter=delimiter)
+        header = next(acct, None)
+        if header is None:
+            return stats
+
+        width = len(header)
+        account, partition, nnodes, start, end = [header.index(col) for col in ('Account', 'Partition', 'NNodes', 'Start', 'End')]
+        pick = compile_plan(header)
+
+        rows = []
+        nrows = 0
+        for row in acct:
+            nrows += 1
+            if len(row) > account and row[account].startswith('nairr'):
+                if len(row) < width:
+                    row.extend([''] * (width - len(row)))
+                rows.append(row)
+
+    # The time calculation is done for the whole file in one pass
+    with stats.timer('parse'):
+        elapsed = [getelapsed(row[start], row[end]) for row in rows]
+
+    constants = list(CONSTMAP.values())
+    outfilename = filename[:-3] + "log"
+    outdata = defaultdict(list)
+    with index.source(fullpath) as seen, store.writer(fullpath) as part:
+        with stats.timer('map'):
+            for row, walltime in zip(rows, elapsed):
+                try:
+                    resource, corespernode, gres = PARTITIONS[row[partition]]
+                except KeyError:
+                    raise Exception("Unknown queue", row[partition]) from None
+                outrow = pick(row + constants + [walltime, gres, corespernode * int(row[nnodes])])
+                part.add(resource, outrow, row[account], os.path.join(resource, outfilename))
+                if seen.emit(resource, slurm_job(outrow)):
+                    outdata[resource].append(outrow)
+
+        for resource, logdata in outdata.items():
+            with stats.timer('write'), outputs.open(os.path.join(resource, outfilename)) as outf:
+                outwriter = csv.writer(outf, delimiter=delimiter, quoting=csv.QUOTE_MINIMAL)
+                outwriter.writerows(logdata)
+            stats.output(outf)
+            stats.counts['rows_kept'] += len(logdata)
+
+    stats.counts['rows_read'] += nrows
+    stats.counts['rows_duplicate'] += seen.dropped
+
+    return stats
 
-    parser.add_argument('-i', '--indir', default="/filetransfer/tacc/ls6/accounting")
-    parser.add_argument('-o', '--outdir', default="/data/tacc-lonestar6/post-processed")
-    parser.add_argument('-v', '--verbose', action='store_true')
-    parser.add_argument('-q', '--quiet', action='store_true')
 
+def main():
+
+    parser = argument_parser(
+        'postprocess.py',
+        'Extract the NAIRR jobs from the TACC Lonestar6 accounting logs',
+        indir="/filetransfer/tacc/ls6/accounting",
+        outdir="/data/tacc-lonestar6/post-processed",
+        statedir="/data/tacc-lonestar6/state",
+        job='tacc-lonestar6',
+        columnar=True
+    )
     args = parser.parse_args()
 
-    delimiter = "|"
-
-    loglevel = logging.INFO
-    if args.verbose:
-        loglevel = logging.DEBUG
-    if args.quiet:
-        loglevel = logging.WARN
-
-    logging.basicConfig(format='%(asctime)s [%(levelname)s] %(message)s', datefmt='%Y-%m-%dT%H:%M:%S', level=logging.INFO)
-    logging.captureWarnings(True)
-
-    for fullpath, filename in fileiterator(args.indir):
-        with open(fullpath, "r", encoding='utf-8', errors='ignore') as filep:
-
-            acct = csv.DictReader(filep, delimiter=delimiter)
-            outdata = defaultdict(list)
-            for row in acct:
-                if row['Account'].startswith('nairr'):
-                    outrow = []
-                    for field in OUTFIELDS:
-                        if field in MAPPING:
-                            outrow.append(row[MAPPING[field]])
-                        elif field in CONSTMAP:
-                            outrow.append(CONSTMAP[field])
-                        elif field == 'elapsed':
-                            outrow.append(getelapsed(row))
-                        elif field in ['alloctres', 'reqtres']:
-                            outrow.append(getgres(row))
-                        elif field == 'ncpus':
-                            outrow.append(getcores(row))
-                        else:
-                            raise Exception("Unknown field: " + field)
-                    outdata[getresource(row)].append(outrow)
-
-            for resource, logdata in outdata.items():
-                outfilename = filename[:-3] + "log"
-                with open(f"{args.outdir}/{resource}/{outfilename}", "w") as outf:
-                    outwriter = csv.writer(outf, delimiter=delimiter, quoting=csv.QUOTE_MINIMAL)
-                    for record in logdata:
-                        outwriter.writerow(record)
-            
+    setup_logging(args)
+
+    metrics = run_metrics(args)
+    manifest = Manifest(manifest_path(args), full=args.full)
+    index = job_index(args)
+    store = columnar_store(args)
+
+    try:
+        if args.command == 'backfill':
+            stats = backfill(args, manifest).run(process_file, args.indir, filedate, index, store,
+                                                 jobs=args.jobs, profile=args.profile)
+        else:
+            stats = process_files(process_file, manifest.changed(fileiterator(args.indir)), output_tree(args), index, store,
+                                  jobs=args.jobs, done=manifest.record, profile=args.profile)
+        stats.log()
+        metrics.record(stats)
+        index.prune()
+    finally:
+        manifest.save()
+        metrics.save()
+
 if __name__ == "__main__":
     main()
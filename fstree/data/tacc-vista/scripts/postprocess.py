@@ -3,6 +3,25 @@
 import logging
 import os
 import datetime
+import sys
+
+sys.path.insert(0, os.environ.get('NAIRR_LIBDIR', '/usr/local/lib/nairr'))
+
+from nairrpp.cli import argument_parser, backfill, columnar_store, job_index, manifest_path, output_tree, run_metrics, setup_logging
+from nairrpp.columnar import SLURM_ACCOUNT, split_slurm
+from nairrpp.jobindex import slurm_line_job
+from nairrpp.manifest import Manifest
+from nairrpp.metrics import timed
+from nairrpp.parallel import Stats, process_files
+from nairrpp.prefilter import LineFilter
+
+RESOURCE = 'TACC-Vista'
+
+def filedate(filename):
+    try:
+        return datetime.datetime.strptime(filename, '%Y-%m-%d.txt')
+    except ValueError:
+        return None
 
 def fileiterator(datasource):
     filenames = [x for x in os.listdir(datasource)]
@@ -11,44 +30,70 @@ def fileiterator(datasource):
     now = datetime.datetime.now()
 
     for filename in filenames:
-        try:
-            fdate = datetime.datetime.strptime(filename, '%Y-%m-%d.txt')
-            if now - fdate > datetime.timedelta(days=365):
-                logging.debug('Skip %s due to time range', filename)
-                continue
-        except ValueError:
+        fdate = filedate(filename)
+        if fdate is None:
             logging.warning('Unrecognized filename %s. Skipping', filename)
             continue
+        if now - fdate > datetime.timedelta(days=365):
+            logging.debug('Skip %s due to time range', filename)
+            continue
 
         fullpath = os.path.join(datasource, filename)
         if os.path.isfile(fullpath):
             yield (fullpath, filename)
 
-def main():
+def process_file(fullpath, filename, outputs, index, store, delimiter="|"):
+    stats = Stats()
 
-    delimiter = "|"
+    with index.source(fullpath) as seen, store.writer(fullpath) as part, outputs.open(filename) as outf:
+        lines = LineFilter(fullpath, 5, b'nairr', delimiter.encode())
+        for line, _ in timed(lines, stats.timings, 'read'):
+            # Only the columnar store needs the decoded fields, the lines are written out as read
+            if part.enabled:
+                fields = split_slurm(line.decode('utf-8', 'replace'), delimiter)
+                part.add(RESOURCE, fields, fields[SLURM_ACCOUNT], filename)
+            if seen.emit(RESOURCE, slurm_line_job(line, delimiter.encode())):
+                outf.write(line)
+                stats.counts['rows_kept'] += 1
 
-    srcdir = "/filetransfer/tacc/vista/accounting"
-    outdir = "/data/tacc-vista/post-processed"
+    stats.output(outf)
+    stats.counts['rows_duplicate'] += seen.dropped
+    stats.counts['rows_read'] += lines.lines
+    return stats
 
-    logging.basicConfig(format='%(asctime)s [%(levelname)s] %(message)s', datefmt='%Y-%m-%dT%H:%M:%S', level=logging.INFO)
-    logging.captureWarnings(True)
+def main():
 
-    for fullpath, filename in fileiterator(srcdir):
-        with open(fullpath, "r", encoding='utf-8', errors='ignore') as filep:
+    parser = argument_parser(
+        'postprocess.py',
+        'Extract the NAIRR jobs from the TACC Vista accounting logs',
+        indir="/filetransfer/tacc/vista/accounting",
+        outdir="/data/tacc-vista/post-processed",
+        statedir="/data/tacc-vista/state",
+        job='tacc-vista',
+        columnar=True
+    )
+    args = parser.parse_args()
 
-            outdata = []
+    setup_logging(args)
 
-            for line in filep:
-                tokens = line.split(delimiter)
+    metrics = run_metrics(args)
+    manifest = Manifest(manifest_path(args), full=args.full)
+    index = job_index(args)
+    store = columnar_store(args)
 
-                if tokens[5].startswith('nairr'):
-                    outdata.append(line)
+    try:
+        if args.command == 'backfill':
+            stats = backfill(args, manifest).run(process_file, args.indir, filedate, index, store,
+                                                 jobs=args.jobs, profile=args.profile)
+        else:
+            stats = process_files(process_file, manifest.changed(fileiterator(args.indir)), output_tree(args), index, store,
+                                  jobs=args.jobs, done=manifest.record, profile=args.profile)
+        stats.log()
+        metrics.record(stats)
+        index.prune()
+    finally:
+        manifest.save()
+        metrics.save()
 
-            if len(outdata) > 0:
-                with open(f"{outdir}/{filename}", "w") as outf:
-                    for record in outdata:
-                        outf.write(record)
-            
 if __name__ == "__main__":
     main()
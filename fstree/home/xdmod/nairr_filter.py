@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""
+Reduce the data fetched by xdmod-cloudbank-data-retriever to the NAIRR
+projects before it is ingested with xdmod-cloudbank-ingestor.
+
+Every CSV, JSON lines (.jsonl, .ndjson) and JSON array (.json) file in the
+input directory is read one record at a time and only the records of
+NAIRR projects are written to the file of the same name in the output
+directory, which may be the input directory. The project of a record is
+the first of the --id-field columns or keys that it has; the names are
+compared ignoring case and anything but letters, so 'Fund ID' matches
+fundid. A project is a NAIRR project if its id is NAIRR<number> or, in a
+fund or project column, a bare number, which the CloudBank funds ETL maps
+to NAIRR<number>. Other columns (e.g. a generic id given with --id-field)
+need the NAIRR prefix, as a bare number there may be any other id. Files
+with none of the id fields are left as they are.
+
+The CSV and JSON lines records that are kept are copied byte for byte.
+Outputs are only replaced (atomically) if their content changed and the
+inputs that were already filtered and have not changed since are skipped.
+"""
+
+import argparse
+import csv
+import json
+import logging
+import os
+import re
+import sys
+
+sys.path.insert(0, os.environ.get('NAIRR_LIBDIR', '/usr/local/lib/nairr'))
+
+from nairrpp.manifest import Manifest
+from nairrpp.metrics import DEFAULT_METRICS_DIR, DEFAULT_RUN_LOG, RunMetrics, timed
+from nairrpp.output import OutputTree
+from nairrpp.parallel import Stats, process_files
+from nairrpp.slurmjson import JsonArrayReader
+
+DEFAULT_ID_FIELDS = ['fundid', 'fund', 'projectid', 'project', 'nairrproject']
+
+NAIRR_ID = re.compile(r'^\s*NAIRR\d+\s*$', re.IGNORECASE)
+
+# Fund and project ids may also be bare numbers
+BARE_ID = re.compile(r'^\s*(?:NAIRR)?\d+\s*$', re.IGNORECASE)
+BARE_ID_FIELDS = re.compile('fund|project')
+
+# Characters collected before they are written to the output
+BUFFER_SIZE = 1 << 18
+
+csv.field_size_limit(sys.maxsize)
+
+
+def fieldname(name):
+    return re.sub('[^a-z]', '', str(name).lower())
+
+
+def is_nairr(value, bare=False):
+    """ True for NAIRR<number> project ids and, with bare, bare number ids """
+
+    return value is not None and (BARE_ID if bare else NAIRR_ID).match(str(value)) is not None
+
+
+class BufferedOutput:
+    """ Collect the text written to an OutputFile and write it in blocks """
+
+    def __init__(self, output):
+        self.output = output
+        self._buf = []
+        self._buffered = 0
+
+    def write(self, data):
+        self._buf.append(data)
+        self._buffered += len(data)
+        if self._buffered >= BUFFER_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self._buf:
+            self.output.write(''.join(self._buf))
+            self._buf = []
+            self._buffered = 0
+
+
+class RawLines:
+    """ Iterate over the lines of a file, keeping the lines read since the last take() """
+
+    def __init__(self, filep):
+        self.filep = filep
+        self.lines = []
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        line = next(self.filep)
+        self.lines.append(line)
+        return line
+
+    def take(self):
+        lines, self.lines = self.lines, []
+        return ''.join(lines)
+
+
+class Filter:
+    """ The record filter for one input file """
+
+    def __init__(self, id_fields):
+        self.id_fields = id_fields
+        self.bare = False
+
+    def idkey(self, names):
+        """ The name among names that holds the project id, or None """
+
+        normalized = {fieldname(name): name for name in names}
+        for field in self.id_fields:
+            if field in normalized:
+                self.bare = BARE_ID_FIELDS.search(field) is not None
+                return normalized[field]
+        return None
+
+    def csv(self, filep, out, stats):
+        lines = RawLines(filep)
+        reader = csv.reader(lines)
+
+        header = next(reader, None)
+        if header is None:
+            return False
+        column = self.idkey(header)
+        if column is None:
+            return False
+        column = header.index(column)
+        out.write(lines.take())
+
+        for row in timed(reader, stats.timings, 'parse'):
+            stats.counts['rows_read'] += 1
+            record = lines.take()
+            if len(row) > column and is_nairr(row[column], self.bare):
+                out.write(record)
+                stats.counts['rows_kept'] += 1
+        return True
+
+    def jsonlines(self, filep, out, stats):
+        key = None
+        for line in timed(filep, stats.timings, 'parse'):
+            if not line.strip():
+                continue
+            stats.counts['rows_read'] += 1
+            record = json.loads(line)
+            if key is None:
+                key = self.idkey(record)
+                if key is None:
+                    return False
+            if is_nairr(record.get(key), self.bare):
+                out.write(line)
+                stats.counts['rows_kept'] += 1
+        return True
+
+    def jsonarray(self, filep, out, stats):
+        key = None
+        out.write('[')
+        for record in timed(JsonArrayReader(filep), stats.timings, 'parse'):
+            stats.counts['rows_read'] += 1
+            if key is None:
+                key = self.idkey(record) if isinstance(record, dict) else None
+                if key is None:
+                    return False
+            if is_nairr(record.get(key), self.bare):
+                out.write((', ' if stats.counts['rows_kept'] else '') + json.dumps(record))
+                stats.counts['rows_kept'] += 1
+        out.write(']')
+        return True
+
+
+FORMATS = {
+    '.csv': Filter.csv,
+    '.jsonl': Filter.jsonlines,
+    '.ndjson': Filter.jsonlines,
+    '.json': Filter.jsonarray
+}
+
+
+def fileiterator(datasource):
+    for filename in sorted(os.listdir(datasource)):
+        fullpath = os.path.join(datasource, filename)
+        if filename.startswith('.') or not os.path.isfile(fullpath):
+            continue
+        if os.path.splitext(filename)[1].lower() not in FORMATS:
+            logging.debug('Leave %s as it is not a CSV or JSON file', filename)
+            continue
+        yield (fullpath, filename)
+
+
+def process_file(fullpath, filename, outputs, id_fields):
+    stats = Stats()
+    method = FORMATS[os.path.splitext(filename)[1].lower()]
+
+    outfile = outputs.open(filename)
+    out = BufferedOutput(outfile)
+    try:
+        with open(fullpath, 'r', encoding='utf-8', newline='') as filep:
+            filtered = method(Filter(id_fields), filep, out, stats)
+        if not filtered:
+            logging.info('%s has no project id field, left as it is', filename)
+            outfile.abort()
+            return stats
+        with stats.timer('write'):
+            out.flush()
+            outfile.close()
+        stats.output(outfile)
+    except ValueError as exc:
+        # Includes JSON decode errors
+        logging.error('Unable to parse %s: %s', fullpath, exc)
+        outfile.abort()
+        raise
+    except BaseException:
+        outfile.abort()
+        raise
+
+    return stats
+
+
+def log_summary(stats):
+    logging.info('Filtered %d files: %d rows read, %d rows kept',
+                 stats.counts['files'], stats.counts['rows_read'], stats.counts['rows_kept'])
+    logging.info('Wrote %d output files, %d unchanged', stats.counts['outputs_changed'], stats.counts['outputs_unchanged'])
+    for stage, seconds in sorted(stats.timings.items()):
+        logging.debug('Spent %.1fs in %s', seconds, stage)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog='nairr_filter.py',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description='Keep only the NAIRR projects in the data retrieved from CloudBank'
+    )
+    parser.add_argument('-i', '--indir', required=True, help='Directory with the files retrieved from CloudBank')
+    parser.add_argument('-o', '--outdir', required=True, help='Directory to write the filtered files to, may be the input directory')
+    parser.add_argument('-s', '--statedir', default='/data/cloudbank/state', help='Directory for the processing manifest')
+    parser.add_argument('--id-field', action='append', help='Column or key with the project id, in order of preference (may be repeated, default ' + ', '.join(DEFAULT_ID_FIELDS) + ')')
+    parser.add_argument('--full', action='store_true', help='Filter every file, not just new or changed ones')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='Number of files to filter in parallel')
+    parser.add_argument('--metrics-dir', default=DEFAULT_METRICS_DIR, help='node-exporter textfile directory to write the run metrics to, empty to disable')
+    parser.add_argument('--run-log', default=DEFAULT_RUN_LOG, help='File to append a JSON summary of the run to, empty to disable')
+    parser.add_argument('-v', '--verbose', action='store_true')
+    parser.add_argument('-q', '--quiet', action='store_true')
+    args = parser.parse_args()
+
+    loglevel = logging.INFO
+    if args.verbose:
+        loglevel = logging.DEBUG
+    if args.quiet:
+        loglevel = logging.WARN
+    logging.basicConfig(format='%(asctime)s [%(levelname)s] %(message)s', datefmt='%Y-%m-%dT%H:%M:%S', level=loglevel)
+
+    id_fields = [fieldname(name) for name in (args.id_field or DEFAULT_ID_FIELDS)]
+
+    os.makedirs(args.statedir, exist_ok=True)
+    # The id fields are part of the manifest version so that changing them refilters every file
+    manifest = Manifest(os.path.join(args.statedir, 'manifest.json'), mapping={'id_fields': id_fields}, full=args.full)
+    metrics = RunMetrics('cloudbank', 'postprocess', args.metrics_dir, args.run_log)
+
+    try:
+        stats = process_files(process_file, manifest.changed(fileiterator(args.indir)), OutputTree(args.outdir), id_fields,
+                              jobs=args.jobs, done=manifest.record)
+        log_summary(stats)
+        metrics.record(stats)
+    finally:
+        manifest.save()
+        metrics.save()
+
+
+if __name__ == '__main__':
+    main()
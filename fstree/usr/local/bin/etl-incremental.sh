@@ -0,0 +1,13 @@
+#!/bin/bash
+
+# Run an XDMoD ETL pipeline on the records modified since its last
+# successful run. The command is run with -m (--last-modified-start-date)
+# set from the watermark of NAME in /var/lib/nairr/etl-watermarks.json,
+# which is only advanced when the command succeeds. Every 7 days, or with
+# --full, the pipeline is run in full.
+#
+#   etl-incremental.sh [--full] NAME etl_overseer.php -p PIPELINE [other overseer options]
+
+export PYTHONPATH=/usr/local/lib/nairr${PYTHONPATH:+:$PYTHONPATH}
+
+exec python3 -m nairrpp.watermark "$@"
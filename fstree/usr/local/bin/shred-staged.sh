@@ -0,0 +1,12 @@
+#!/bin/bash
+
+# Run xdmod-shredder on the postprocessed files that changed since the last
+# successful shred. The postprocessors link every output they rewrite into
+# <statedir>/staging/<resource>; the staged links are removed once the
+# shredder has succeeded.
+#
+#   shred-staged.sh STAGINGDIR -r RESOURCE -f FORMAT [other shredder options]
+
+export PYTHONPATH=/usr/local/lib/nairr${PYTHONPATH:+:$PYTHONPATH}
+
+exec python3 -m nairrpp.output "$@"
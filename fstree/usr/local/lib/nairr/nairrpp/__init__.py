@@ -0,0 +1,7 @@
+"""
+Shared helpers for the NAIRR accounting postprocessors.
+
+The site specific ``postprocess.py`` scripts under ``/data`` add
+``/usr/local/lib/nairr`` (or ``$NAIRR_LIBDIR``) to ``sys.path`` and import
+the modules in this package.
+"""
@@ -0,0 +1,272 @@
+"""
+Reprocess every raw accounting file in a date range.
+
+The nightly runs only look at the last year (or whatever window the site
+uses) of inputs. ``postprocess.py backfill --since YYYY-MM-DD [--until
+YYYY-MM-DD]`` instead processes every input whose file date is in the
+range, regardless of the window and of the processing manifest.
+
+The range is split into calendar months. Each month is processed by one
+worker process (with --jobs workers), its inputs in date order. When a
+month completes, its inputs are recorded in the processing manifest and
+the month is checkpointed in
+
+    <statedir>/backfill/<since>/checkpoint.json
+
+Running the backfill from the same day again resumes with the months that
+did not complete, over the range in the checkpoint unless --until is
+given, so an interrupted backfill can be resumed on a later day. A
+different --until and --full start over. The checkpoint also records the
+version of the account mapping and a backfill with a different mapping
+starts over.
+
+Changed outputs are written to the output directory as usual but staged
+under <statedir>/backfill/<since>/staging rather than the nightly
+staging directory. Once every month has completed, shred.json next to
+the checkpoint lists the staged directories with the number of files in
+each, ready to be passed to shred-staged.sh.
+"""
+
+import datetime
+import json
+import logging
+import os
+import tempfile
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from nairrpp.output import OutputTree
+from nairrpp.parallel import Stats, _run
+
+CHECKPOINT_FORMAT = 1
+
+
+class BackfillError(Exception):
+    pass
+
+
+def parse_day(value):
+    """ datetime.date of a YYYY-MM-DD string """
+
+    return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+
+
+def month_chunks(since, until):
+    """ (YYYY-MM, first day, last day) of every month that overlaps since..until """
+
+    chunks = []
+    first = since
+    while first <= until:
+        if first.month == 12:
+            following = datetime.date(first.year + 1, 1, 1)
+        else:
+            following = datetime.date(first.year, first.month + 1, 1)
+        last = min(until, following - datetime.timedelta(days=1))
+        chunks.append((first.strftime('%Y-%m'), first, last))
+        first = following
+    return chunks
+
+
+def _atomic_json(path, data):
+    dirname = os.path.dirname(os.path.abspath(path))
+    fd, tmpname = tempfile.mkstemp(dir=dirname, prefix='.' + os.path.basename(path) + '.')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as filep:
+            json.dump(data, filep, indent=1, sort_keys=True)
+        os.replace(tmpname, path)
+    except BaseException:
+        os.unlink(tmpname)
+        raise
+
+
+def _run_chunk(func, profile, files, *args):
+    """ Process the inputs of one month in order, returns [(fullpath, Stats)] """
+
+    return [(fullpath, _run(func, profile, fullpath, filename, *args)) for fullpath, filename in files]
+
+
+class Backfill:
+    """ A resumable backfill of one postprocessor over since..until
+
+    With until None, a checkpointed backfill from since is resumed over its
+    range and a new one ends today.
+    """
+
+    def __init__(self, statedir, outdir, since, until, manifest, restart=False):
+        self.since = since
+        self.until = None
+        self.manifest = manifest
+        self.path = os.path.join(statedir, 'backfill', since.isoformat())
+        self.checkpoint_path = os.path.join(self.path, 'checkpoint.json')
+        self.staging = os.path.join(self.path, 'staging')
+        self.outputs = OutputTree(outdir, self.staging)
+        self.completed = {}
+
+        os.makedirs(self.path, exist_ok=True)
+        if not restart:
+            self.load(until)
+        if self.until is None:
+            self.until = until or datetime.date.today()
+        # Recorded before any month runs, so that a resume keeps the range
+        self.save()
+
+    def load(self, until):
+        try:
+            with open(self.checkpoint_path, 'r', encoding='utf-8') as filep:
+                data = json.load(filep)
+        except FileNotFoundError:
+            return
+        except ValueError:
+            logging.warning('Unable to read backfill checkpoint %s. Starting over', self.checkpoint_path)
+            return
+
+        if data.get('format') != CHECKPOINT_FORMAT:
+            logging.warning('Backfill checkpoint %s has an unsupported format. Starting over', self.checkpoint_path)
+            return
+        checkpointed = parse_day(data['until'])
+        if until is not None and until != checkpointed:
+            logging.warning('The backfill from %s was checkpointed until %s. Starting over until %s', self.since, checkpointed, until)
+            return
+        self.until = checkpointed
+        if data.get('mapping') != self.manifest.mapping_version:
+            logging.warning('The account mapping changed since the backfill was checkpointed. Starting over')
+            return
+
+        self.completed = data['months']
+        logging.info('Resuming backfill, %d months already completed', len(self.completed))
+
+    def checkpoint(self, month, stats):
+        """ Record a completed month, after its inputs are saved in the processing manifest """
+
+        self.manifest.save()
+        self.completed[month] = {
+            'files': stats.counts['files'],
+            'rows_kept': stats.counts['rows_kept'],
+            'outputs_changed': stats.counts['outputs_changed'],
+            'completed': datetime.datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
+        }
+        self.save()
+        logging.info('Backfill of %s completed: %d files', month, stats.counts['files'])
+
+    def save(self):
+        _atomic_json(self.checkpoint_path, {
+            'format': CHECKPOINT_FORMAT,
+            'since': self.since.isoformat(),
+            'until': self.until.isoformat(),
+            'mapping': self.manifest.mapping_version,
+            'months': self.completed
+        })
+
+    def pending(self, datasource, filedate):
+        """ {month: [(fullpath, filename)]} of the inputs in the months that have not completed """
+
+        months = OrderedDict((month, []) for month, _, _ in month_chunks(self.since, self.until) if month not in self.completed)
+
+        for filename in sorted(os.listdir(datasource)):
+            fullpath = os.path.join(datasource, filename)
+            if not os.path.isfile(fullpath):
+                continue
+            fdate = filedate(filename)
+            if fdate is None:
+                logging.warning('Unrecognized filename %s. Skipping', filename)
+                continue
+            fdate = fdate.date()
+            month = fdate.strftime('%Y-%m')
+            if self.since <= fdate <= self.until and month in months:
+                months[month].append((fullpath, filename))
+
+        return months
+
+    def shred_manifest(self):
+        """ Write shred.json, the staged directories and the number of files in each """
+
+        directories = []
+        for dirpath, dirnames, filenames in os.walk(self.staging):
+            dirnames.sort()
+            staged = [name for name in filenames if not name.startswith('.')]
+            if staged:
+                directories.append({'directory': dirpath, 'files': len(staged)})
+
+        path = os.path.join(self.path, 'shred.json')
+        _atomic_json(path, {
+            'since': self.since.isoformat(),
+            'until': self.until.isoformat(),
+            'directories': directories
+        })
+        logging.info('Staged %d directories for the shredder, see %s', len(directories), path)
+        return path
+
+    def run(self, func, datasource, filedate, *args, jobs=1, profile=False):
+        """ Call func(fullpath, filename, outputs, *args) for every input of the pending months.
+
+        filedate(filename) returns the datetime of an input, or None if the
+        name is not recognized. Months run in up to jobs worker processes.
+        Returns the merged Stats, raises BackfillError if any month failed.
+        """
+
+        totals = Stats()
+        pending = self.pending(datasource, filedate)
+        if not pending:
+            logging.info('Every month of the backfill has already completed')
+            self.shred_manifest()
+            return totals
+
+        logging.info('Backfilling %d months from %s to %s', len(pending), self.since, self.until)
+        args = (self.outputs,) + args
+        failed = []
+
+        def complete(month, results):
+            chunk = Stats()
+            for fullpath, result in results:
+                chunk.update(result)
+                chunk.counts['files'] += 1
+                if result.failed:
+                    chunk.counts['files_failed'] += 1
+                else:
+                    self.manifest.record(fullpath, result)
+            totals.update(chunk)
+            if chunk.counts['files_failed']:
+                # Not checkpointed, so that a resume retries the month
+                self.manifest.save()
+                logging.error('Backfill of %s was unable to read %d files', month, chunk.counts['files_failed'])
+                failed.append(month)
+                return
+            self.checkpoint(month, chunk)
+
+        if jobs <= 1:
+            for month, files in pending.items():
+                try:
+                    results = _run_chunk(func, profile, files, *args)
+                except Exception:
+                    logging.exception('Backfill of %s failed', month)
+                    failed.append(month)
+                    continue
+                complete(month, results)
+        else:
+            pool = ProcessPoolExecutor(max_workers=jobs)
+            try:
+                futures = {}
+                for month, files in pending.items():
+                    futures[pool.submit(_run_chunk, func, profile, files, *args)] = month
+
+                for future in as_completed(futures):
+                    month = futures[future]
+                    try:
+                        results = future.result()
+                    except Exception:
+                        logging.exception('Backfill of %s failed', month)
+                        failed.append(month)
+                        continue
+                    complete(month, results)
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                pool.shutdown(wait=True)
+                raise
+            pool.shutdown(wait=True)
+
+        if failed:
+            raise BackfillError(f'Backfill failed for {", ".join(sorted(failed))}, run it again to retry them')
+
+        self.shred_manifest()
+        return totals
@@ -0,0 +1,110 @@
+"""
+Command line handling that is common to all of the site postprocessors.
+"""
+
+import argparse
+import logging
+import os
+
+from nairrpp.backfill import Backfill, parse_day
+from nairrpp.columnar import JobStore
+from nairrpp.jobindex import JobIndex
+from nairrpp.mapping import DEFAULT_CACHE, MAPPINGS
+from nairrpp.metrics import DEFAULT_METRICS_DIR, DEFAULT_RUN_LOG, RunMetrics
+from nairrpp.output import OutputTree
+
+
+def argument_parser(prog, description, indir, outdir, statedir, mapping=None, job=None, columnar=False):
+    """ Return an argument parser with the options every postprocessor supports.
+
+    Postprocessors that translate local accounts pass the name of their
+    site in ``mapping`` to get the options that locate the account mapping.
+    ``job`` is the name the run's metrics are reported under. Postprocessors
+    that can save their records in a columnar store pass ``columnar=True``.
+
+    ``postprocess.py backfill --since YYYY-MM-DD`` selects the backfill
+    mode, see nairrpp.backfill.
+    """
+
+    parser = argparse.ArgumentParser(
+        prog=prog,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description=description
+    )
+    parser.add_argument('command', nargs='?', choices=['run', 'backfill'], default='run',
+                        help='run processes the new and changed inputs in the time window, backfill every input from --since to --until')
+    parser.add_argument('-i', '--indir', default=indir, help='Directory containing the raw accounting files')
+    parser.add_argument('-o', '--outdir', default=outdir, help='Directory to write the postprocessed files to')
+    parser.add_argument('-s', '--statedir', default=statedir, help='Directory for the processing manifest, job index and the staging area for the shredder')
+    parser.add_argument('--full', action='store_true', help='Reprocess every input file in the time window, not just new or changed ones. A backfill starts over instead of resuming')
+    parser.add_argument('--since', type=parse_day, help='First day of the backfill, YYYY-MM-DD')
+    parser.add_argument('--until', type=parse_day, help='Last day of the backfill, YYYY-MM-DD, default the one of the checkpointed backfill from --since or today')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='Number of input files to process in parallel')
+    if mapping is not None and 'source' in MAPPINGS[mapping]:
+        parser.add_argument('--mapping-source', default=MAPPINGS[mapping]['source'], help='Spreadsheet with the account mapping')
+        parser.add_argument('--mapping-cache', default=DEFAULT_CACHE, help='Compiled account mapping store')
+    if columnar:
+        parser.add_argument('--columnar-store', help='Also save the normalized job records in this Parquet dataset (needs pyarrow)')
+    parser.add_argument('--metrics-job', default=job, help='Job label of the exported metrics')
+    parser.add_argument('--metrics-dir', default=DEFAULT_METRICS_DIR, help='node-exporter textfile directory to write the run metrics to, empty to disable')
+    parser.add_argument('--run-log', default=DEFAULT_RUN_LOG, help='File to append a JSON summary of the run to, empty to disable')
+    parser.add_argument('--profile', action='store_true', help='Profile every input file and save the profile of the slowest one in the state directory')
+    parser.add_argument('-v', '--verbose', action='store_true')
+    parser.add_argument('-q', '--quiet', action='store_true')
+
+    return parser
+
+
+def setup_logging(args, default=logging.INFO):
+    """ Configure logging the same way for every postprocessor """
+
+    loglevel = default
+    if args.verbose:
+        loglevel = logging.DEBUG
+    if args.quiet:
+        loglevel = logging.WARN
+
+    logging.basicConfig(format='%(asctime)s [%(levelname)s] %(message)s', datefmt='%Y-%m-%dT%H:%M:%S', level=loglevel)
+    logging.captureWarnings(True)
+
+
+def manifest_path(args):
+    """ Path of the manifest file for this run, creating the state directory if needed """
+
+    os.makedirs(args.statedir, exist_ok=True)
+    return os.path.join(args.statedir, 'manifest.json')
+
+
+def output_tree(args):
+    """ The output directory with changed files staged under statedir/staging """
+
+    return OutputTree(args.outdir, os.path.join(args.statedir, 'staging'))
+
+
+def job_index(args):
+    """ The index of the jobs this postprocessor has already written out """
+
+    return JobIndex(os.path.join(args.statedir, 'jobindex.sqlite'))
+
+
+def run_metrics(args):
+    """ The metrics for this postprocessor run """
+
+    profile_path = os.path.join(args.statedir, 'slowest-file.pstats') if args.profile else None
+    return RunMetrics(args.metrics_job, 'postprocess', args.metrics_dir, args.run_log, profile_path)
+
+
+def columnar_store(args):
+    """ The columnar job store, disabled unless --columnar-store was given """
+
+    return JobStore(getattr(args, 'columnar_store', None))
+
+
+def backfill(args, manifest):
+    """ The Backfill for the --since and --until of a backfill run """
+
+    if args.since is None:
+        raise SystemExit('backfill needs --since')
+    if args.until is not None and args.until < args.since:
+        raise SystemExit('--until is before --since')
+    return Backfill(args.statedir, args.outdir, args.since, args.until, manifest, restart=args.full)
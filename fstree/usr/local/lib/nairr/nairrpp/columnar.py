@@ -0,0 +1,316 @@
+"""
+Columnar store of the normalized job records of the pipe format sites.
+
+The postprocessors that write the pipe delimited Slurm format can also
+save every record they normalize in a Parquet dataset, partitioned as
+``<root>/resource=<resource>/day=<YYYY-MM-DD>/<input file>.parquet``
+where the day is the date the job ended (or was submitted, if it has not
+ended). Each input file owns its own part files, which are replaced when
+the input is reprocessed, so the store grows incrementally with the
+nightly runs. Besides the 26 Slurm fields every record keeps the local
+account it was read with, the input file it came from, the output file
+(relative to the output directory) the postprocessor writes it to and its
+position in the input. The account field is empty for jobs whose account
+was not mapped to a NAIRR grant.
+
+The shredder inputs can then be regenerated from the store, with the same
+file names as the postprocessor writes, without re-parsing the raw
+accounting, optionally re-mapping the local accounts with the current
+account mapping:
+
+    python3 -m nairrpp.columnar STORE emit OUTDIR [--mapping-site PSC] [--since 2025-01-01]
+
+The dataset can be queried directly with pyarrow.dataset, pandas or any
+other Parquet reader. pyarrow is only imported when the store is used.
+
+Only the pipe format sites (Bridges-2, Purdue, Frontera, Lonestar6 and
+Vista) save their records. The slurmjson sites (PSC, TAMU, DGX, Delta,
+DeltaAI and SDSC) do not: their jobs are nested sacct --json records, and
+emit would have to write them back as slurmjson rather than as pipe
+delimited lines. They would need a store of their own.
+"""
+
+import argparse
+import glob
+import logging
+import operator
+import os
+import re
+import sys
+import tempfile
+from collections import defaultdict
+
+from nairrpp.jobindex import SLURM_END, SLURM_SUBMIT, slurm_job
+from nairrpp.mapping import DEFAULT_CACHE, MAPPINGS, load_mapping
+from nairrpp.output import OUTPUT_MODE, OutputTree
+
+# The fields of the pipe delimited Slurm format read by xdmod-shredder -f slurm
+SLURM_FIELDS = ["jobid", "jobidraw", "cluster", "partition", "qos", "account", "group", "gid", "user", "uid",
+                "submit", "eligible", "start", "end", "elapsed", "exitcode", "state", "nnodes", "ncpus",
+                "reqcpus", "reqmem", "reqtres", "alloctres", "timelimit", "nodelist", "jobname"]
+SLURM_ACCOUNT = SLURM_FIELDS.index('account')
+
+COLUMNS = SLURM_FIELDS + ['raw_account', 'source', 'output', 'record']
+RAW_ACCOUNT = len(SLURM_FIELDS)
+SOURCE = RAW_ACCOUNT + 1
+OUTPUT = SOURCE + 1
+RECORD = OUTPUT + 1
+
+_DAY = re.compile(r'^\d{4}-\d{2}-\d{2}')
+
+
+def _pyarrow():
+    import pyarrow
+    import pyarrow.parquet
+    return pyarrow, pyarrow.parquet
+
+
+def split_slurm(line, delimiter='|'):
+    """ The 26 fields of a pipe delimited Slurm record, the job name may contain the delimiter """
+
+    fields = line.rstrip('\r\n').split(delimiter, len(SLURM_FIELDS) - 1)
+    if len(fields) < len(SLURM_FIELDS):
+        fields.extend([''] * (len(SLURM_FIELDS) - len(fields)))
+    return fields
+
+
+def jobday(fields):
+    """ The partition day of a job: the day it ended or, if it has not ended, was submitted """
+
+    for field in (SLURM_END, SLURM_SUBMIT):
+        if _DAY.match(fields[field]):
+            return fields[field][:10]
+    return 'unknown'
+
+
+class StoreWriter:
+    """ Collect the normalized records read from one input file.
+
+    close() replaces the part files that the input owns in the store. Use
+    as a context manager to leave the store unchanged if processing fails.
+    """
+
+    enabled = True
+
+    def __init__(self, root, source):
+        self.root = root
+        self.source = source
+        self.partname = os.path.basename(source) + '.parquet'
+        self.rows = defaultdict(list)
+        self.count = 0
+
+    def add(self, resource, fields, raw_account, output):
+        """ Add a job record; fields are the 26 Slurm fields with the mapped account, or '' if unmapped.
+
+        output is the path of the file, relative to the output directory,
+        that the postprocessor writes the record to if it is kept.
+        """
+
+        row = [str(field) for field in fields[:len(SLURM_FIELDS)]]
+        if len(row) < len(SLURM_FIELDS):
+            row.extend([''] * (len(SLURM_FIELDS) - len(row)))
+        self.rows[(resource, jobday(row))].append(row + [raw_account, self.source, output, str(self.count)])
+        self.count += 1
+
+    def _write(self, path, rows):
+        pyarrow, parquet = _pyarrow()
+        table = pyarrow.Table.from_arrays([pyarrow.array(column, pyarrow.string()) for column in zip(*rows)], names=COLUMNS)
+
+        dirname = os.path.dirname(path)
+        os.makedirs(dirname, exist_ok=True)
+        fd, tmpname = tempfile.mkstemp(dir=dirname, prefix='.' + self.partname + '.')
+        os.close(fd)
+        try:
+            parquet.write_table(table, tmpname, compression='zstd')
+            os.chmod(tmpname, OUTPUT_MODE)
+            os.replace(tmpname, path)
+        except BaseException:
+            os.unlink(tmpname)
+            raise
+
+    def close(self):
+        written = set()
+        for (resource, day), rows in self.rows.items():
+            path = os.path.join(self.root, 'resource=' + resource, 'day=' + day, self.partname)
+            self._write(path, rows)
+            written.add(path)
+
+        # The input no longer has records in the partitions it is not in
+        for path in glob.glob(os.path.join(glob.escape(self.root), '*', '*', glob.escape(self.partname))):
+            if path not in written:
+                os.unlink(path)
+
+        self.rows = defaultdict(list)
+
+    def abort(self):
+        self.rows = defaultdict(list)
+        self.count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+
+class _NullWriter:
+    """ StoreWriter for when the store is disabled """
+
+    enabled = False
+
+    def add(self, resource, fields, raw_account, output):
+        pass
+
+    def close(self):
+        pass
+
+    def abort(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+class JobStore:
+    """ The columnar store of a postprocessor, disabled if root is None """
+
+    def __init__(self, root=None):
+        self.root = root
+        if root is not None:
+            # Fail before any input is processed if pyarrow is missing
+            _pyarrow()
+
+    def writer(self, source):
+        """ StoreWriter for the records read from one input file """
+
+        if self.root is None:
+            return _NullWriter()
+        return StoreWriter(self.root, source)
+
+    def partitions(self, resource=None, since=None, until=None):
+        """ Yield (resource, day, [part files]) for the selected partitions in order """
+
+        for resdir in sorted(glob.glob(os.path.join(glob.escape(self.root), 'resource=*'))):
+            res = os.path.basename(resdir)[len('resource='):]
+            if resource is not None and res not in resource:
+                continue
+            for daydir in sorted(glob.glob(os.path.join(glob.escape(resdir), 'day=*'))):
+                day = os.path.basename(daydir)[len('day='):]
+                if (since is not None and day < since) or (until is not None and day > until):
+                    continue
+                parts = sorted(glob.glob(os.path.join(glob.escape(daydir), '*.parquet')))
+                if parts:
+                    yield res, day, parts
+
+    def scan(self, resource=None, since=None, until=None):
+        """ Yield (resource, day, row) for every record in the selected partitions """
+
+        _, parquet = _pyarrow()
+        for res, day, parts in self.partitions(resource, since, until):
+            for part in parts:
+                columns = parquet.read_table(part, columns=COLUMNS).to_pydict()
+                for row in zip(*(columns[name] for name in COLUMNS)):
+                    yield res, day, row
+
+
+def emit(store, outputs, resource=None, since=None, until=None, mapping=None):
+    """ Write the Slurm records in the store to the files the postprocessor wrote them to.
+
+    The records are replayed in the order the postprocessor reads them, by
+    input file name and then position in the file. As with the job index,
+    a job is left out if it was already written with the same state and end
+    time. With an AccountMap the accounts are mapped again from the local
+    accounts, otherwise the stored mapped accounts are used. Jobs without a
+    mapped account are skipped.
+
+    Every output file is written whole, so the whole store (of the selected
+    resources) is read; since and until only select the output files that
+    have a record in a partition between these days. Returns (jobs, files
+    changed).
+    """
+
+    records = []
+    selected = set()
+    for res, day, row in store.scan(resource):
+        fields = list(row[:RAW_ACCOUNT])
+        if mapping is not None:
+            fields[SLURM_ACCOUNT] = mapping.lookup(row[RAW_ACCOUNT]) or ''
+        if not fields[SLURM_ACCOUNT]:
+            continue
+        records.append((row[SOURCE], int(row[RECORD]), res, row[OUTPUT], fields))
+        if (since is None or day >= since) and (until is None or day <= until):
+            selected.add(row[OUTPUT])
+
+    records.sort(key=operator.itemgetter(0, 1))
+
+    written = {}
+    files = defaultdict(list)
+    for _, _, res, output, fields in records:
+        cluster, jobidraw, submit, fingerprint = slurm_job(fields)
+        key = (res, cluster, jobidraw, submit)
+        if written.get(key) == fingerprint:
+            continue
+        written[key] = fingerprint
+        files[output].append(fields)
+
+    jobs = 0
+    changed = 0
+    for output in sorted(selected.intersection(files)):
+        with outputs.open(output) as outf:
+            for fields in files[output]:
+                outf.write('|'.join(fields) + '\n')
+        jobs += len(files[output])
+        changed += bool(outf.changed)
+
+    return jobs, changed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog='python3 -m nairrpp.columnar',
+        description='Regenerate the shredder inputs of a postprocessor from its columnar job store'
+    )
+    parser.add_argument('store', help='Columnar store of the postprocessor (its --columnar-store)')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    emitparser = subparsers.add_parser('emit', help='Write the pipe delimited Slurm files for xdmod-shredder -f slurm')
+    emitparser.add_argument('outdir', help='Output directory of the postprocessor to write the files to')
+    emitparser.add_argument('--staging', help='Also link the changed files into this directory for shred-staged.sh')
+    emitparser.add_argument('-r', '--resource', action='append', help='Only emit this resource (may be repeated)')
+    emitparser.add_argument('--since', help='Only emit the files with jobs on or after this day, YYYY-MM-DD')
+    emitparser.add_argument('--until', help='Only emit the files with jobs on or before this day, YYYY-MM-DD')
+    emitparser.add_argument('--mapping-site', choices=sorted(MAPPINGS), help='Map the local accounts again with this site\'s account mapping')
+    emitparser.add_argument('--mapping-source', help='Spreadsheet with the account mapping, default the site\'s')
+    emitparser.add_argument('--mapping-cache', default=DEFAULT_CACHE, help='Compiled account mapping store')
+
+    subparsers.add_parser('partitions', help='List the partitions in the store')
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s [%(levelname)s] %(message)s', datefmt='%Y-%m-%dT%H:%M:%S', level=logging.INFO)
+
+    store = JobStore(args.store)
+
+    if args.command == 'partitions':
+        for res, day, parts in store.partitions():
+            print(f'{res}\t{day}\t{len(parts)}')
+        return 0
+
+    mapping = None
+    if args.mapping_site is not None:
+        mapping = load_mapping(args.mapping_site, args.mapping_source, args.mapping_cache)
+
+    jobs, changed = emit(store, OutputTree(args.outdir, args.staging), args.resource, args.since, args.until, mapping)
+    logging.info('Emitted %d jobs, %d files changed', jobs, changed)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
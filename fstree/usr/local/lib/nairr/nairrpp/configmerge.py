@@ -0,0 +1,95 @@
+"""
+Merge of the XRAS data into the XDMoD JSON configuration files.
+
+organization.json, resources.json and resource_specs.json are lists of
+entries that are partly maintained by hand and partly generated from XRAS.
+A KeyedConfig indexes the entries of one file by their natural key (the
+organization name, the resource code) so that each row from XRAS is merged
+in constant time. The merged file is written sorted by key, atomically and
+only if its content changed, and diff() reports what the merge added and
+updated so that the XDMoD ETL only needs to be rerun when it did.
+"""
+
+import json
+import logging
+
+from nairrpp.output import OutputFile
+
+# The fields of an already configured resource, resource spec and
+# organization that are updated from XRAS (the upsert update), the others
+# are kept as configured
+RESOURCE_UPDATE = ()
+RESOURCE_SPEC_UPDATE = ('end_date',)
+ORGANIZATION_UPDATE = ()
+
+
+class KeyedConfig:
+    """ The entries of an XDMoD JSON configuration file indexed by the key field """
+
+    def __init__(self, entries, key):
+        self.key = key
+        self.entries = {}
+        self.added = []
+        self.updated = {}
+
+        for entry in entries:
+            if entry[key] in self.entries:
+                logging.warning('Duplicate %s %s in the configuration, keeping the last entry', key, entry[key])
+            self.entries[entry[key]] = entry
+
+    @classmethod
+    def load(cls, path, key):
+        with open(path, 'r', encoding='utf-8') as filep:
+            return cls(json.load(filep), key)
+
+    def __contains__(self, value):
+        return value in self.entries
+
+    def __getitem__(self, value):
+        return self.entries[value]
+
+    def __len__(self):
+        return len(self.entries)
+
+    def upsert(self, entry, update=None):
+        """ Add entry if its key is new, otherwise set its fields on the existing entry.
+
+        With update only the named fields of an existing entry are set
+        from entry, so update=() only adds new entries.
+        """
+
+        value = entry[self.key]
+        existing = self.entries.get(value)
+        if existing is None:
+            self.entries[value] = dict(entry)
+            self.added.append(value)
+            return
+
+        for field in (entry if update is None else update):
+            if field not in entry or existing.get(field) == entry[field]:
+                continue
+            if value not in self.added:
+                self.updated.setdefault(value, {})[field] = [existing.get(field), entry[field]]
+            existing[field] = entry[field]
+
+    def sorted(self):
+        return [self.entries[value] for value in sorted(self.entries)]
+
+    def diff(self):
+        """ {'added': [keys], 'updated': {key: {field: [old, new]}}} of the merge """
+
+        return {
+            'added': sorted(self.added),
+            'updated': {value: self.updated[value] for value in sorted(self.updated)}
+        }
+
+    @property
+    def changed(self):
+        return bool(self.added or self.updated)
+
+    def write(self, path):
+        """ Write the entries sorted by key, returns True if the file was replaced """
+
+        with OutputFile(path) as out:
+            out.write(json.dumps(self.sorted(), indent=4))
+        return bool(out.changed)
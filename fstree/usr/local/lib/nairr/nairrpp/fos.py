@@ -0,0 +1,99 @@
+"""
+The XRAS field of science (FOS) tree.
+
+XRAS only records the parent of each FOS. FosTree builds the whole tree
+in memory from (fos_type_id, fos_name, fos_type_parent_id) rows and
+validates it:
+
+    orphans      a parent that is not in the tree, the FOS is made a root
+    duplicates   a name used by more than one FOS; XDMoD identifies FOS by
+                 name so only the one with the lowest id is kept
+    cycles       FOS whose ancestry never reaches a root, they are left out
+
+From the tree it derives the ancestor/descendant closure (every FOS is
+its own ancestor at distance 0) and, for the FOS of a project, the top
+level, mid level and leaf FOS of its path from the root. A FOS at the
+first or second level stands in for the levels below it that it does not
+have, and below the third level the mid level is the second one.
+"""
+
+import logging
+
+
+class FosTree:
+    """ The validated FOS tree """
+
+    def __init__(self, rows):
+        self.names = {}
+        self.ids = {}
+        self.parents = {}
+        self.orphans = []
+        self.duplicates = []
+        self.cycles = []
+
+        for fos_id, name, parent_id in sorted(rows, key=lambda row: row[0]):
+            if name in self.ids:
+                self.duplicates.append(name)
+                logging.warning('FOS %s (%s) has the same name as FOS %s, it is ignored', fos_id, name, self.ids[name])
+                continue
+            self.ids[name] = fos_id
+            self.names[fos_id] = name
+            self.parents[fos_id] = parent_id
+
+        for fos_id, parent_id in self.parents.items():
+            if parent_id is not None and parent_id not in self.names:
+                self.orphans.append(fos_id)
+                logging.warning('The parent %s of FOS %s (%s) is not a NAIRR FOS, it is made a top level FOS',
+                                parent_id, fos_id, self.names[fos_id])
+                self.parents[fos_id] = None
+
+        self.paths = {}
+        for fos_id in self.names:
+            self._path(fos_id)
+
+    def _path(self, fos_id):
+        """ The ids from the root to fos_id, None if its ancestry has a cycle """
+
+        if fos_id in self.paths:
+            return self.paths[fos_id]
+
+        chain = []
+        seen = set()
+        node = fos_id
+        while node is not None and node not in self.paths:
+            if node in seen:
+                cycle = chain[chain.index(node):]
+                self.cycles.append(cycle)
+                logging.error('The FOS %s form a cycle, they and the FOS below them are left out',
+                              ', '.join(self.names[member] for member in cycle))
+                for member in chain:
+                    self.paths[member] = None
+                return None
+            seen.add(node)
+            chain.append(node)
+            node = self.parents[node]
+
+        path = [] if node is None else self.paths[node]
+        for member in reversed(chain):
+            path = None if path is None else path + [member]
+            self.paths[member] = path
+        return self.paths[fos_id]
+
+    def closure(self):
+        """ Yield (ancestor name, descendant name, distance) for every FOS in the tree """
+
+        for fos_id in sorted(self.names):
+            path = self.paths[fos_id]
+            if path is None:
+                continue
+            for distance, ancestor in enumerate(reversed(path)):
+                yield self.names[ancestor], self.names[fos_id], distance
+
+    def levels(self, name):
+        """ (top level, mid level, leaf) names of a FOS, None if it is not in the tree """
+
+        path = self.paths.get(self.ids.get(name))
+        if not path:
+            return None
+        return self.names[path[0]], self.names[path[1 if len(path) > 1 else 0]], self.names[path[-1]]
+
@@ -0,0 +1,164 @@
+"""
+Index of the job records that a postprocessor has already passed on.
+
+The sites deliver overlapping accounting windows: the daily dumps list jobs
+that are still running or were requeued again, and some exports overlap
+the day boundaries. Every copy used to be written out and de-duplicated by
+the shredder and the database.
+
+Each site keeps a SQLite index in its state directory keyed by (resource,
+cluster, jobidraw, submit time) that stores a fingerprint of the job's
+state and end time and the input file it was last emitted from. A record
+is dropped if the same job with the same fingerprint was already emitted
+from a different input file, so only new jobs and jobs whose state changed
+are written out. Records are always kept when an input file is reprocessed
+so that its output still contains the jobs it owns.
+"""
+
+import json
+import logging
+import sqlite3
+import time
+
+# Jobs that have not been seen for this long are removed from the index.
+# The postprocessors only read the last year of input files.
+RETENTION_DAYS = 400
+
+# Fields of the pipe delimited Slurm format read by xdmod-shredder -f slurm
+SLURM_JOBIDRAW = 1
+SLURM_CLUSTER = 2
+SLURM_SUBMIT = 10
+SLURM_END = 13
+SLURM_STATE = 16
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    resource TEXT NOT NULL,
+    cluster TEXT NOT NULL,
+    jobidraw TEXT NOT NULL,
+    submit TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    source TEXT NOT NULL,
+    seen INTEGER NOT NULL,
+    PRIMARY KEY (resource, cluster, jobidraw, submit)
+)
+"""
+
+
+def slurm_job(fields):
+    """ (cluster, jobidraw, submit, fingerprint) for a pipe delimited Slurm record """
+
+    return (fields[SLURM_CLUSTER], fields[SLURM_JOBIDRAW], fields[SLURM_SUBMIT],
+            fields[SLURM_STATE] + '|' + fields[SLURM_END])
+
+
+def slurm_line_job(line, delimiter=b'|'):
+    """ slurm_job() of a raw pipe delimited Slurm record as bytes, only the fields up to the state are decoded """
+
+    fields = line.split(delimiter, SLURM_STATE + 1)
+    if len(fields) > SLURM_STATE + 1:
+        del fields[SLURM_STATE + 1:]
+    else:
+        # A short record, the last field has the line end
+        fields[-1] = fields[-1].rstrip(b'\r\n')
+        fields.extend([b''] * (SLURM_STATE + 1 - len(fields)))
+    return slurm_job([field.decode('utf-8', 'replace') for field in fields])
+
+
+def slurmjson_job(job):
+    """ (cluster, jobidraw, submit, fingerprint) for a job from a Slurm JSON document """
+
+    times = job.get('time') or {}
+    fingerprint = json.dumps([job.get('state'), times.get('end')], sort_keys=True)
+    return job.get('cluster'), job.get('job_id'), times.get('submission'), fingerprint
+
+
+class JobIndex:
+    """ Persistent per-site index of emitted jobs.
+
+    The database is opened on first use so that the index can be passed to
+    worker processes; each process opens its own connection.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._db = None
+
+    def __getstate__(self):
+        return {'path': self.path, '_db': None}
+
+    def _connect(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, timeout=600)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute(SCHEMA)
+            self._db.commit()
+        return self._db
+
+    def source(self, source):
+        """ Filter for the jobs read from one input file """
+
+        return SourceFilter(self._connect(), source)
+
+    def prune(self, days=RETENTION_DAYS):
+        """ Forget jobs that have not been emitted in the given number of days """
+
+        db = self._connect()
+        with db:
+            count = db.execute('DELETE FROM jobs WHERE seen < ?', (int(time.time()) - days * 86400,)).rowcount
+        if count:
+            logging.info('Removed %d jobs older than %d days from the job index', count, days)
+
+
+class SourceFilter:
+    """ Decide which of the jobs read from one input file are written out.
+
+    The index is only updated by close() once the whole file has been
+    processed. Use as a context manager to discard the updates if
+    processing fails.
+    """
+
+    def __init__(self, db, source):
+        self.db = db
+        self.source = source
+        self.updates = {}
+        self.dropped = 0
+
+    def emit(self, resource, job):
+        """ True if the job (cluster, jobidraw, submit, fingerprint) has to be written out """
+
+        cluster, jobidraw, submit, fingerprint = job
+        key = (resource, str(cluster), str(jobidraw), str(submit))
+
+        if key in self.updates:
+            if self.updates[key] == fingerprint:
+                self.dropped += 1
+                return False
+        else:
+            row = self.db.execute('SELECT fingerprint, source FROM jobs WHERE resource = ? AND cluster = ? AND jobidraw = ? AND submit = ?', key).fetchone()
+            if row is not None and row[0] == fingerprint and row[1] != self.source:
+                self.dropped += 1
+                return False
+
+        self.updates[key] = fingerprint
+        return True
+
+    def close(self):
+        now = int(time.time())
+        with self.db:
+            self.db.executemany('INSERT OR REPLACE INTO jobs (resource, cluster, jobidraw, submit, fingerprint, source, seen) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                (key + (fingerprint, self.source, now) for key, fingerprint in self.updates.items()))
+        self.updates = {}
+
+    def abort(self):
+        self.updates = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
@@ -0,0 +1,166 @@
+"""
+Record of the input files that a postprocessor has already handled.
+
+Each site keeps a JSON manifest keyed by the full path of the input file.
+An entry stores the size, mtime and sha256 of the file together with the
+version of the account mapping that was used to process it. On the next
+run only inputs that are new, have different content or were processed with
+a different mapping are handed back to the postprocessor.
+
+For table based account mappings the entry also lists the local charge ids
+that occur in the file, and the manifest keeps the mapping it was last
+saved with. When only the lookup table changed, only the inputs that
+contain a charge id whose grant changed are reprocessed; the other entries
+are moved to the new mapping version as they are.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+
+MANIFEST_FORMAT = 1
+
+
+def filehash(path, blocksize=1 << 20):
+    """ sha256 hex digest of the contents of a file """
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as filep:
+        for block in iter(lambda: filep.read(blocksize), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def mapping_version(mapping):
+    """ Short, stable identifier for the contents of an account mapping """
+
+    if mapping is None:
+        return None
+
+    if hasattr(mapping, 'version'):
+        return mapping.version
+
+    data = json.dumps(mapping, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()[:16]
+
+
+class Manifest:
+    """ Persistent index of processed input files for one site """
+
+    def __init__(self, path, mapping=None, full=False):
+        self.path = path
+        self.mapping = mapping
+        self.mapping_version = mapping_version(mapping)
+        self.full = full
+        self.entries = {}
+        self.dirty = False
+        # Version of the previous mapping and the charge ids it maps differently
+        self.previous_mapping = None
+        self.changed_accounts = None
+
+        if not full:
+            self.load()
+
+    def load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as filep:
+                data = json.load(filep)
+        except FileNotFoundError:
+            return
+        except ValueError:
+            logging.warning('Unable to read manifest %s. All inputs will be reprocessed', self.path)
+            return
+
+        if data.get('format') != MANIFEST_FORMAT:
+            logging.warning('Manifest %s has an unsupported format. All inputs will be reprocessed', self.path)
+            return
+
+        self.entries = data['files']
+
+        previous = data.get('mapping')
+        if previous is not None and previous['version'] != self.mapping_version and hasattr(self.mapping, 'changed_keys'):
+            self.changed_accounts = self.mapping.changed_keys(previous['rules'])
+            if self.changed_accounts is not None:
+                self.previous_mapping = previous['version']
+                logging.info('The account mapping changed for %d charge ids', len(self.changed_accounts))
+
+    def needs_processing(self, fullpath):
+        """ True if the input is new, has changed or was processed with a different mapping """
+
+        if self.full:
+            return True
+
+        entry = self.entries.get(fullpath)
+        if entry is None:
+            return True
+
+        if entry['mapping'] != self.mapping_version:
+            if entry['mapping'] != self.previous_mapping or 'accounts' not in entry:
+                return True
+            if not self.changed_accounts.isdisjoint(entry['accounts']):
+                return True
+            entry['mapping'] = self.mapping_version
+            self.dirty = True
+
+        fstat = os.stat(fullpath)
+        if entry['size'] == fstat.st_size and entry['mtime_ns'] == fstat.st_mtime_ns:
+            return False
+
+        # The file was touched (or rewritten by rsync) check the content
+        # before deciding to reprocess it.
+        if entry['size'] != fstat.st_size or filehash(fullpath) != entry['sha256']:
+            return True
+
+        entry['mtime_ns'] = fstat.st_mtime_ns
+        self.dirty = True
+        return False
+
+    def changed(self, files):
+        """ Filter an iterable of (fullpath, filename) down to the inputs that need processing """
+
+        for fullpath, filename in files:
+            if self.needs_processing(fullpath):
+                yield (fullpath, filename)
+            else:
+                logging.debug('Skip %s as it is unchanged since the last run', filename)
+
+    def record(self, fullpath, stats=None):
+        """ Mark an input as successfully processed with the current mapping.
+
+        stats.accounts are the charge ids that were looked up in the mapping.
+        """
+
+        fstat = os.stat(fullpath)
+        self.entries[fullpath] = {
+            'size': fstat.st_size,
+            'mtime_ns': fstat.st_mtime_ns,
+            'sha256': filehash(fullpath),
+            'mapping': self.mapping_version
+        }
+        if stats is not None and getattr(self.mapping, 'table', None) is not None:
+            self.entries[fullpath]['accounts'] = sorted(str(account) for account in stats.accounts)
+        self.dirty = True
+
+    def save(self):
+        """ Atomically write the manifest back to disk if anything changed """
+
+        if not self.dirty:
+            return
+
+        data = {'format': MANIFEST_FORMAT, 'files': self.entries}
+        if getattr(self.mapping, 'rules', None) is not None:
+            data['mapping'] = {'version': self.mapping_version, 'rules': self.mapping.rules}
+
+        dirname = os.path.dirname(os.path.abspath(self.path))
+        fd, tmpname = tempfile.mkstemp(dir=dirname, prefix='.manifest.')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as filep:
+                json.dump(data, filep, indent=1, sort_keys=True)
+            os.replace(tmpname, self.path)
+        except BaseException:
+            os.unlink(tmpname)
+            raise
+
+        self.dirty = False
@@ -0,0 +1,253 @@
+"""
+Compiled local charge account to NAIRR grant number mappings.
+
+The mappings are maintained by the NAIRR team as spreadsheets with one sheet
+per site. Reading them with pandas takes seconds and hundreds of MB, so each
+(site, source) pair is compiled once into a small JSON store and only
+recompiled when the source spreadsheet changes (size and mtime first, then
+sha256 of the content). Loading a compiled mapping does not import pandas.
+
+Run ``python3 -m nairrpp.mapping`` to compile every site's mapping ahead of
+the nightly run or to inspect a compiled table.
+"""
+
+import argparse
+import csv
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import tempfile
+
+from nairrpp.manifest import filehash
+
+DEFAULT_CACHE = os.environ.get('NAIRR_MAPPING_CACHE', '/data/mapping/.nairr-mappings.json')
+
+CACHE_FORMAT = 1
+
+JAN2025_USAGE = '/data/mapping/NAIRR Jan-2025 Usage.xlsx'
+
+# How the spreadsheet for each site is turned into a lookup table and how a
+# local account is reduced to the key that is looked up.
+#   source, sheet, key, value: where the table comes from
+#   lower_key: lowercase the key column
+#   key_slice: [start, end] slice applied to the account before lookup
+#   prefix, replace: rule based mapping, accounts starting with prefix are
+#                    mapped to replace + account[key_slice]
+MAPPINGS = {
+    'PSC': {
+        'source': JAN2025_USAGE,
+        'sheet': 'PSC',
+        'key': 'subgrantnumber',
+        'value': 'nairr_grant_number',
+        'lower_key': True
+    },
+    'NCSA': {
+        'source': JAN2025_USAGE,
+        'sheet': 'NCSA',
+        'key': 'subgrantnumber',
+        'value': 'nairr_grant_number',
+        'key_slice': [0, 4]
+    },
+    'TAMU': {
+        'source': '/data/mapping/NAIRR usage reported as of 12-09-2024.xlsx',
+        'sheet': 'TAMU',
+        'key': 'ACES slurm account',
+        'value': 'NAIRR_grant_number'
+    },
+    'SDSC': {
+        'source': JAN2025_USAGE,
+        'sheet': 'SDSC',
+        'key': 'SDSC Local Project id',
+        'value': 'NAIRR Grant',
+        'lower_key': True
+    },
+    'Purdue': {
+        'prefix': 'ai',
+        'replace': 'NAIRR',
+        'key_slice': [2, 8]
+    }
+}
+
+
+class AccountMap:
+    """ Map local charge accounts to NAIRR grant numbers for one site """
+
+    def __init__(self, site, table=None, key_slice=None, prefix=None, replace=None):
+        self.site = site
+        self.table = table
+        self.key_slice = slice(*key_slice) if key_slice else None
+        self.prefix = prefix
+        self.replace = replace
+
+        self.rules = {'table': table, 'key_slice': key_slice, 'prefix': prefix, 'replace': replace}
+        data = json.dumps(self.rules, sort_keys=True, separators=(',', ':'))
+        self.version = hashlib.sha256(data.encode('utf-8')).hexdigest()[:16]
+
+    def charge_id(self, account):
+        """ The part of the local account that identifies the allocation """
+
+        if self.key_slice is not None:
+            return account[self.key_slice]
+        return account
+
+    def lookup(self, account):
+        """ NAIRR grant number for a local account or None if it is not a NAIRR account """
+
+        if account is None:
+            return None
+
+        if self.prefix is not None:
+            if account.startswith(self.prefix):
+                return self.replace + self.charge_id(account)
+            return None
+
+        return self.table.get(self.charge_id(account))
+
+    def changed_keys(self, old_rules):
+        """ The charge ids that map to a different grant than with the old rules,
+            or None if anything other than the lookup table changed """
+
+        if old_rules is None or self.table is None or old_rules.get('table') is None:
+            return None
+
+        for rule in ('key_slice', 'prefix', 'replace'):
+            if old_rules.get(rule) != self.rules[rule]:
+                return None
+
+        old = old_rules['table']
+        return {key for key in old.keys() | self.table.keys() if old.get(key) != self.table.get(key)}
+
+    def __len__(self):
+        return len(self.table) if self.table is not None else 0
+
+
+def _missing(value):
+    return value is None or value != value or str(value).strip() == ''
+
+
+def _read_rows(source, sheet):
+    """ Yield the rows of a mapping spreadsheet (or CSV export of one sheet) as dicts """
+
+    if source.lower().endswith('.csv'):
+        with open(source, 'r', encoding='utf-8', newline='') as filep:
+            yield from csv.DictReader(filep)
+        return
+
+    # pandas is only needed when a spreadsheet has changed
+    import pandas as pd
+
+    for _, row in pd.read_excel(source, sheet_name=sheet).iterrows():
+        yield row
+
+
+def compile_table(spec, source):
+    """ Build the key to grant number lookup table from the source spreadsheet """
+
+    table = {}
+    for row in _read_rows(source, spec['sheet']):
+        key, value = row[spec['key']], row[spec['value']]
+        if _missing(key) or _missing(value):
+            continue
+        key = str(key)
+        if spec.get('lower_key'):
+            key = key.lower()
+        table[key] = str(value).lower()
+    return table
+
+
+def _load_cache(cache):
+    try:
+        with open(cache, 'r', encoding='utf-8') as filep:
+            data = json.load(filep)
+    except FileNotFoundError:
+        return {}
+    except ValueError:
+        logging.warning('Ignoring unreadable mapping cache %s', cache)
+        return {}
+
+    if data.get('format') != CACHE_FORMAT:
+        return {}
+    return data['mappings']
+
+
+def _save_cache(cache, entries):
+    fd, tmpname = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(cache)), prefix='.mappings.')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as filep:
+            json.dump({'format': CACHE_FORMAT, 'mappings': entries}, filep, sort_keys=True)
+        os.chmod(tmpname, 0o644)
+        os.replace(tmpname, cache)
+    except BaseException:
+        os.unlink(tmpname)
+        raise
+
+
+def load_mapping(site, source=None, cache=DEFAULT_CACHE):
+    """ Return the AccountMap for a site, recompiling the cached table if its source changed """
+
+    spec = MAPPINGS[site]
+
+    if 'prefix' in spec:
+        return AccountMap(site, key_slice=spec.get('key_slice'), prefix=spec['prefix'], replace=spec['replace'])
+
+    source = source or spec['source']
+    cachekey = f'{site}|{source}'
+
+    with open(cache + '.lock', 'a') as lockfp:
+        fcntl.flock(lockfp, fcntl.LOCK_EX)
+
+        entries = _load_cache(cache)
+        entry = entries.get(cachekey)
+        fstat = os.stat(source)
+        dirty = False
+
+        if entry is not None and (entry['size'] != fstat.st_size or entry['mtime_ns'] != fstat.st_mtime_ns):
+            if entry['sha256'] == filehash(source):
+                entry['size'], entry['mtime_ns'] = fstat.st_size, fstat.st_mtime_ns
+                dirty = True
+            else:
+                entry = None
+
+        if entry is None:
+            logging.info('Compiling %s account mapping from %s', site, source)
+            entry = {
+                'size': fstat.st_size,
+                'mtime_ns': fstat.st_mtime_ns,
+                'sha256': filehash(source),
+                'table': compile_table(spec, source)
+            }
+            entries[cachekey] = entry
+            dirty = True
+
+        if dirty:
+            _save_cache(cache, entries)
+
+    return AccountMap(site, table=entry['table'], key_slice=spec.get('key_slice'))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog='python3 -m nairrpp.mapping',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description='Compile the NAIRR account mapping spreadsheets into the mapping cache'
+    )
+    parser.add_argument('-c', '--cache', default=DEFAULT_CACHE, help='Path to the compiled mapping store')
+    parser.add_argument('-s', '--site', action='append', choices=sorted(MAPPINGS), help='Only compile this site (may be repeated)')
+    parser.add_argument('--show', action='store_true', help='Print the compiled tables as JSON')
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s [%(levelname)s] %(message)s', datefmt='%Y-%m-%dT%H:%M:%S', level=logging.INFO)
+
+    compiled = {}
+    for site in args.site or sorted(MAPPINGS):
+        mapping = load_mapping(site, cache=args.cache)
+        compiled[site] = {'version': mapping.version, 'entries': len(mapping), 'table': mapping.table}
+
+    if args.show:
+        print(json.dumps(compiled, indent=4, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,204 @@
+"""
+Run metrics for the nightly pipeline.
+
+Each postprocessor and XRAS extraction run records how long it took,
+how long it spent in each stage, how many rows it read, kept and dropped,
+how many bytes it read and wrote and its peak RSS. At the end of the run
+the metrics are written as a node-exporter textfile
+(``<metrics dir>/nairr_<kind>_<job>.prom``), so that they can be scraped and
+alerted on, and appended as one JSON line to the run log.
+
+Stage timings are accumulated with ``timer()``; the postprocessors time
+the stages of each file in their Stats and these are merged in by
+``record()``.
+"""
+
+import cProfile
+import datetime
+import json
+import logging
+import marshal
+import os
+import resource
+import tempfile
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+DEFAULT_METRICS_DIR = os.environ.get('NAIRR_METRICS_DIR', '/var/lib/node_exporter/textfile_collector')
+DEFAULT_RUN_LOG = os.environ.get('NAIRR_RUN_LOG', '/var/log/nairr/runs.jsonl')
+
+
+def peak_rss():
+    """ Peak resident set size in bytes of this process or any of its waited for children """
+
+    usage = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return usage * 1024
+
+
+@contextmanager
+def stopwatch(timings, name):
+    """ Add the time spent in the with block to timings[name] """
+
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] += time.perf_counter() - started
+
+
+def timed(iterable, timings, name):
+    """ Iterate over iterable adding the time spent producing each item to timings[name] """
+
+    iterator = iter(iterable)
+    clock = time.perf_counter
+    while True:
+        started = clock()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            timings[name] += clock() - started
+            return
+        timings[name] += clock() - started
+        yield item
+
+
+class Profile:
+    """ cProfile of a single call that can be sent back from a worker process """
+
+    def __init__(self, seconds, name, stats):
+        self.seconds = seconds
+        self.name = name
+        self.stats = stats
+
+    @classmethod
+    def call(cls, name, func, *args):
+        """ Run func(*args) under cProfile, returns (result, Profile) """
+
+        profiler = cProfile.Profile()
+        started = time.perf_counter()
+        result = profiler.runcall(func, *args)
+        seconds = time.perf_counter() - started
+        profiler.create_stats()
+        return result, cls(seconds, name, marshal.dumps(profiler.stats))
+
+    def dump(self, path):
+        """ Write the stats in the format read by pstats.Stats(path) """
+
+        with open(path, 'wb') as filep:
+            filep.write(self.stats)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+class RunMetrics:
+    """ Metrics for one run of a pipeline job """
+
+    def __init__(self, job, kind, metrics_dir=DEFAULT_METRICS_DIR, run_log=DEFAULT_RUN_LOG, profile_path=None):
+        self.job = job
+        self.kind = kind
+        self.metrics_dir = metrics_dir
+        self.run_log = run_log
+        self.profile_path = profile_path
+        self.started = time.time()
+        self.timings = Counter()
+        self.counts = Counter()
+        self.values = {}
+        self.files = []
+        self.success = False
+
+    def timer(self, stage):
+        return stopwatch(self.timings, stage)
+
+    def set(self, name, value, **labels):
+        """ Record a gauge; the metric is named nairr_<kind>_<name> """
+
+        self.values[(name, tuple(sorted(labels.items())))] = value
+
+    def record(self, stats):
+        """ Merge the Stats of a postprocessor run and mark the run successful """
+
+        self.counts.update(stats.counts)
+        self.timings.update(stats.timings)
+        self.counts['unmapped_rows'] += sum(stats.unmapped.values())
+        self.counts['unmapped_accounts'] += len(stats.unmapped)
+        self.files.extend(stats.files)
+
+        if stats.profile is not None and self.profile_path is not None:
+            stats.profile.dump(self.profile_path)
+            logging.info('Wrote the profile of the slowest file %s (%.1fs) to %s', stats.profile.name,
+                         stats.profile.seconds, self.profile_path)
+
+        self.success = True
+
+    def _samples(self, duration):
+        prefix = 'nairr_' + self.kind + '_'
+        job = ('job', self.job)
+
+        yield prefix + 'success', (job,), int(self.success)
+        yield prefix + 'last_run_timestamp_seconds', (job,), round(self.started, 3)
+        yield prefix + 'duration_seconds', (job,), round(duration, 3)
+        yield prefix + 'max_rss_bytes', (job,), peak_rss()
+        for stage, seconds in sorted(self.timings.items()):
+            yield prefix + 'stage_seconds', (job, ('stage', stage)), round(seconds, 3)
+        for name, value in sorted(self.counts.items()):
+            yield prefix + name, (job,), value
+        if self.files:
+            yield prefix + 'slowest_file_seconds', (job,), round(max(f['seconds'] for f in self.files), 3)
+        for (name, labels), value in sorted(self.values.items()):
+            yield prefix + name, (job,) + labels, value
+
+    def _write_textfile(self, duration):
+        lines = []
+        for name, labels, value in self._samples(duration):
+            labelstr = ','.join(f'{key}="{_escape(val)}"' for key, val in labels)
+            lines.append(f'{name}{{{labelstr}}} {value}\n')
+
+        # node-exporter may read the directory at any time so write atomically
+        target = os.path.join(self.metrics_dir, f'nairr_{self.kind}_{self.job}.prom')
+        fd, tmpname = tempfile.mkstemp(dir=self.metrics_dir, prefix='.nairr_')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as filep:
+                filep.writelines(lines)
+            os.chmod(tmpname, 0o644)
+            os.replace(tmpname, target)
+        except BaseException:
+            os.unlink(tmpname)
+            raise
+
+    def _write_run_log(self, duration):
+        entry = {
+            'job': self.job,
+            'kind': self.kind,
+            'started': datetime.datetime.fromtimestamp(self.started).isoformat(),
+            'duration': round(duration, 3),
+            'success': self.success,
+            'max_rss_bytes': peak_rss(),
+            'stages': {stage: round(seconds, 3) for stage, seconds in self.timings.items()},
+            'counts': dict(self.counts),
+            'values': [{'name': name, 'labels': dict(labels), 'value': value} for (name, labels), value in self.values.items()],
+            'files': sorted(self.files, key=lambda f: f['seconds'], reverse=True)
+        }
+        os.makedirs(os.path.dirname(self.run_log), exist_ok=True)
+        with open(self.run_log, 'a', encoding='utf-8') as filep:
+            filep.write(json.dumps(entry, sort_keys=True) + '\n')
+
+    def save(self):
+        """ Write the textfile and append to the run log. Failures are logged, not raised """
+
+        duration = time.time() - self.started
+
+        if self.metrics_dir:
+            try:
+                self._write_textfile(duration)
+            except OSError as exc:
+                logging.warning('Unable to write metrics to %s: %s', self.metrics_dir, exc)
+
+        if self.run_log:
+            try:
+                self._write_run_log(duration)
+            except OSError as exc:
+                logging.warning('Unable to append to run log %s: %s', self.run_log, exc)
@@ -0,0 +1,291 @@
+"""
+Run the nightly NAIRR ingest as a graph of stages instead of a serial script.
+
+The pipeline is described in a JSON file (see /etc/nairr/ingest-pipeline.json)
+as a list of stages. Each stage has a name, a type, the command to run and
+the names of the stages it depends on. The only real ordering is per
+resource sync -> postprocess -> shred followed by the final ingest, so
+stages whose dependencies have completed run concurrently, limited by a
+per type concurrency limit (syncs are I/O bound, postprocessing CPU bound
+and shredding DB bound).
+
+Every stage has a timeout. A stage that fails or times out blocks only the
+stages downstream of it. The status of each stage is saved as the run
+progresses so that ``--resume`` can rerun just the stages that did not
+complete last time. ``--dry-run`` prints the plan without running anything.
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import os
+import shlex
+import signal
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+DEFAULT_CONFIG = '/etc/nairr/ingest-pipeline.json'
+DEFAULT_STATE = '/var/lib/nairr/ingest-state.json'
+
+STAGE_TYPES = ['sync', 'postprocess', 'shred', 'ingest']
+
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+TIMEOUT = 'timeout'
+BLOCKED = 'blocked'
+
+# Seconds to wait after SIGTERM before a timed out stage is killed
+KILL_GRACE = 30
+
+
+class PipelineError(Exception):
+    pass
+
+
+class Stage:
+    def __init__(self, config, defaults):
+        self.name = config['name']
+        self.type = config['type']
+        self.command = config['command']
+        self.depends = config.get('depends', [])
+        self.timeout = config.get('timeout', defaults.get(self.type))
+        self.enabled = config.get('enabled', True)
+
+        if self.type not in STAGE_TYPES:
+            raise PipelineError(f'Stage {self.name} has unknown type {self.type}')
+
+    def cmdline(self):
+        return ' '.join(shlex.quote(arg) for arg in self.command)
+
+
+class Pipeline:
+    """ The stage graph loaded from the pipeline configuration file """
+
+    def __init__(self, config):
+        self.limits = config['limits']
+        self.stages = {}
+
+        for stagecfg in config['stages']:
+            stage = Stage(stagecfg, config.get('timeouts', {}))
+            if stage.name in self.stages:
+                raise PipelineError(f'Duplicate stage {stage.name}')
+            if stage.enabled:
+                self.stages[stage.name] = stage
+
+        for stage in self.stages.values():
+            for dep in stage.depends:
+                if dep not in self.stages:
+                    raise PipelineError(f'Stage {stage.name} depends on unknown or disabled stage {dep}')
+
+        self.levels = self._levels()
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r', encoding='utf-8') as filep:
+            return cls(json.load(filep))
+
+    def _levels(self):
+        """ Group the stages into levels where each level only depends on earlier ones """
+
+        levels = []
+        placed = set()
+        remaining = list(self.stages.values())
+
+        while remaining:
+            level = [s for s in remaining if all(dep in placed for dep in s.depends)]
+            if not level:
+                raise PipelineError('Dependency cycle between stages: ' + ', '.join(s.name for s in remaining))
+            levels.append(level)
+            placed.update(s.name for s in level)
+            remaining = [s for s in remaining if s.name not in placed]
+
+        return levels
+
+    def downstream(self, name):
+        """ Names of all stages that (indirectly) depend on the named stage """
+
+        found = set()
+        pending = [name]
+        while pending:
+            current = pending.pop()
+            for stage in self.stages.values():
+                if current in stage.depends and stage.name not in found:
+                    found.add(stage.name)
+                    pending.append(stage.name)
+        return found
+
+
+class RunState:
+    """ Persistent per-stage status of the current (or last) run """
+
+    def __init__(self, path, resume=False):
+        self.path = path
+        self.stages = {}
+        self.lock = threading.Lock()
+
+        if resume:
+            try:
+                with open(path, 'r', encoding='utf-8') as filep:
+                    self.stages = json.load(filep)['stages']
+            except FileNotFoundError:
+                logging.warning('No previous run state in %s, running every stage', path)
+
+    def succeeded(self, name):
+        return self.stages.get(name, {}).get('status') == SUCCEEDED
+
+    def update(self, name, **info):
+        with self.lock:
+            self.stages[name] = info
+            self.save()
+
+    def save(self):
+        dirname = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(dirname, exist_ok=True)
+        fd, tmpname = tempfile.mkstemp(dir=dirname, prefix='.ingest-state.')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as filep:
+                json.dump({'updated': datetime.datetime.now().isoformat(), 'stages': self.stages}, filep, indent=4, sort_keys=True)
+            os.replace(tmpname, self.path)
+        except BaseException:
+            os.unlink(tmpname)
+            raise
+
+
+def run_stage(stage):
+    """ Run one stage, returns (status, returncode, output) """
+
+    proc = subprocess.Popen(stage.command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                            start_new_session=True, universal_newlines=True, errors='replace')
+    try:
+        output, _ = proc.communicate(timeout=stage.timeout)
+    except subprocess.TimeoutExpired:
+        os.killpg(proc.pid, signal.SIGTERM)
+        try:
+            output, _ = proc.communicate(timeout=KILL_GRACE)
+        except subprocess.TimeoutExpired:
+            os.killpg(proc.pid, signal.SIGKILL)
+            output, _ = proc.communicate()
+        return TIMEOUT, proc.returncode, output
+
+    return (SUCCEEDED if proc.returncode == 0 else FAILED), proc.returncode, output
+
+
+def execute(pipeline, state):
+    """ Run every stage in dependency order, returns True if all of them succeeded """
+
+    pending = {}
+    done = set()
+    blocked = set()
+
+    for name, stage in pipeline.stages.items():
+        if state.succeeded(name):
+            logging.info('Skip %s: completed in the previous run', name)
+            done.add(name)
+        else:
+            pending[name] = stage
+
+    active = {stype: 0 for stype in STAGE_TYPES}
+    running = {}
+    ok = True
+
+    with ThreadPoolExecutor(max_workers=max(1, sum(pipeline.limits.values()))) as pool:
+        while pending or running:
+            for name, stage in list(pending.items()):
+                if name in blocked:
+                    del pending[name]
+                    continue
+                if active[stage.type] >= pipeline.limits.get(stage.type, 1):
+                    continue
+                if not all(dep in done for dep in stage.depends):
+                    continue
+
+                logging.info('Start %s: %s', name, stage.cmdline())
+                active[stage.type] += 1
+                running[pool.submit(run_stage, stage)] = (stage, time.monotonic())
+                del pending[name]
+
+            if not running:
+                break
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                stage, started = running.pop(future)
+                active[stage.type] -= 1
+                duration = time.monotonic() - started
+
+                try:
+                    status, returncode, output = future.result()
+                except OSError as exc:
+                    status, returncode, output = FAILED, None, str(exc)
+
+                for line in (output or '').splitlines():
+                    logging.info('[%s] %s', stage.name, line)
+
+                state.update(stage.name, status=status, returncode=returncode, duration=round(duration, 1))
+
+                if status == SUCCEEDED:
+                    logging.info('Finished %s in %.0fs', stage.name, duration)
+                    done.add(stage.name)
+                else:
+                    ok = False
+                    downstream = pipeline.downstream(stage.name)
+                    logging.error('Stage %s %s (exit code %s) after %.0fs, blocking: %s', stage.name, status,
+                                  returncode, duration, ', '.join(sorted(downstream)) or 'nothing')
+                    blocked.update(downstream)
+                    for name in downstream:
+                        state.update(name, status=BLOCKED, blocked_by=stage.name)
+
+    return ok
+
+
+def print_plan(pipeline, state):
+    print('Concurrency limits: ' + ', '.join(f'{stype}={pipeline.limits.get(stype, 1)}' for stype in STAGE_TYPES))
+    for levelnum, level in enumerate(pipeline.levels):
+        print(f'Level {levelnum}:')
+        for stage in level:
+            note = ' (completed, skipped on resume)' if state.succeeded(stage.name) else ''
+            print(f'  [{stage.type}] {stage.name} timeout={stage.timeout}s{note}')
+            if stage.depends:
+                print(f'      after: {", ".join(stage.depends)}')
+            print(f'      {stage.cmdline()}')
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog='ingest-jobs',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description='Sync, postprocess, shred and ingest the NAIRR job data'
+    )
+    parser.add_argument('-c', '--config', default=DEFAULT_CONFIG, help='Pipeline definition')
+    parser.add_argument('--state', default=DEFAULT_STATE, help='File that records the status of each stage')
+    parser.add_argument('--resume', action='store_true', help='Only run the stages that did not succeed in the previous run')
+    parser.add_argument('-n', '--dry-run', action='store_true', help='Print the execution plan and exit')
+    parser.add_argument('-v', '--verbose', action='store_true')
+    parser.add_argument('-q', '--quiet', action='store_true')
+    args = parser.parse_args()
+
+    loglevel = logging.INFO
+    if args.verbose:
+        loglevel = logging.DEBUG
+    if args.quiet:
+        loglevel = logging.WARN
+
+    logging.basicConfig(format='%(asctime)s [%(levelname)s] %(message)s', datefmt='%Y-%m-%dT%H:%M:%S', level=loglevel)
+    logging.captureWarnings(True)
+
+    pipeline = Pipeline.load(args.config)
+    state = RunState(args.state, resume=args.resume)
+
+    if args.dry_run:
+        print_plan(pipeline, state)
+        return 0
+
+    return 0 if execute(pipeline, state) else 1
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
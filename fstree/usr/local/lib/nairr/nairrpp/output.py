@@ -0,0 +1,200 @@
+"""
+Postprocessed output files that are only replaced when their content changes.
+
+Each output is written to a temporary file next to the target while the
+sha256 of the content is computed. When the output is closed the digest is
+compared with the existing file and the new file is only renamed into place
+if they differ, so unchanged days keep their mtime and inode.
+
+Every output that did change is also linked into a staging directory that
+mirrors the output directory. The shredder is pointed at the staging
+directory so that it only reads the days that changed since the last
+successful shred. Run ``python3 -m nairrpp.output STAGINGDIR SHREDDER-ARGS``
+to shred the staged files and clear the ones that were shredded.
+"""
+
+import argparse
+import errno
+import hashlib
+import logging
+import os
+import shutil
+import stat
+import subprocess
+import sys
+import tempfile
+
+from nairrpp.manifest import filehash
+
+OUTPUT_MODE = stat.S_IRUSR | stat.S_IWUSR | stat.S_IRGRP | stat.S_IROTH
+
+
+def stage(path, staged):
+    """ Atomically make staged a link to (or copy of) path """
+
+    dirname = os.path.dirname(staged)
+    os.makedirs(dirname, exist_ok=True)
+    tmpname = os.path.join(dirname, '.' + os.path.basename(staged) + '.' + str(os.getpid()))
+
+    try:
+        os.link(path, tmpname)
+    except FileExistsError:
+        os.unlink(tmpname)
+        os.link(path, tmpname)
+    except OSError as exc:
+        if exc.errno not in (errno.EXDEV, errno.EPERM):
+            raise
+        shutil.copy2(path, tmpname)
+
+    os.replace(tmpname, staged)
+
+
+class OutputFile:
+    """ A file-like output that is installed by close() only if its content changed.
+
+    The temporary file is created on the first write so that nothing is
+    written for an output that receives no data. Text is written as UTF-8.
+    """
+
+    def __init__(self, target, staged=None):
+        self.target = target
+        self.staged = staged
+        self.changed = None
+        self._fp = None
+        self._tmpname = None
+        self._digest = None
+        self.size = 0
+
+    def _open(self):
+        dirname = os.path.dirname(self.target) or '.'
+        os.makedirs(dirname, exist_ok=True)
+        fd, self._tmpname = tempfile.mkstemp(dir=dirname, prefix='.' + os.path.basename(self.target) + '.')
+        self._fp = os.fdopen(fd, 'wb')
+        self._digest = hashlib.sha256()
+
+    def write(self, data):
+        if self._fp is None:
+            self._open()
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        self._digest.update(data)
+        self.size += len(data)
+        self._fp.write(data)
+
+    def _unchanged(self):
+        try:
+            if os.path.getsize(self.target) != self.size:
+                return False
+        except FileNotFoundError:
+            return False
+        return filehash(self.target) == self._digest.hexdigest()
+
+    def close(self):
+        """ Install the output if it differs from the existing file.
+
+        Returns True if the target was replaced, False if it was unchanged
+        and None if nothing was written.
+        """
+
+        if self._fp is None:
+            return self.changed
+
+        self._fp.close()
+        self._fp = None
+
+        if self._unchanged():
+            os.unlink(self._tmpname)
+            self.changed = False
+            return False
+
+        os.chmod(self._tmpname, OUTPUT_MODE)
+        os.replace(self._tmpname, self.target)
+        if self.staged is not None:
+            stage(self.target, self.staged)
+
+        logging.debug('Updated %s', self.target)
+        self.changed = True
+        return True
+
+    def abort(self):
+        """ Throw away any partially written output """
+
+        if self._fp is None:
+            return
+
+        self._fp.close()
+        self._fp = None
+        os.unlink(self._tmpname)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+
+class OutputTree:
+    """ The output directory of a postprocessor and its staging directory """
+
+    def __init__(self, outdir, staging=None):
+        self.outdir = outdir
+        self.staging = staging
+
+    def open(self, relpath):
+        """ OutputFile for a path relative to the output directory """
+
+        staged = os.path.join(self.staging, relpath) if self.staging is not None else None
+        return OutputFile(os.path.join(self.outdir, relpath), staged)
+
+
+def shred_staged(staging, shredder_args, shredder='xdmod-shredder'):
+    """ Run the shredder on a staging directory and remove the files it shredded """
+
+    try:
+        staged = {}
+        for entry in os.scandir(staging):
+            if entry.is_file() and not entry.name.startswith('.'):
+                staged[entry.path] = entry.stat().st_ino
+    except FileNotFoundError:
+        staged = {}
+
+    if not staged:
+        logging.info('Nothing staged in %s', staging)
+        return 0
+
+    logging.info('Shredding %d changed files from %s', len(staged), staging)
+    returncode = subprocess.call([shredder] + shredder_args + ['-d', staging])
+    if returncode != 0:
+        return returncode
+
+    for path, inode in staged.items():
+        # A file that was restaged while the shredder ran has to stay
+        try:
+            if os.stat(path).st_ino == inode:
+                os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog='python3 -m nairrpp.output',
+        description='Run xdmod-shredder on the staged postprocessor outputs and clear them once shredded'
+    )
+    parser.add_argument('staging', help='Staging directory that is passed to the shredder with -d')
+    parser.add_argument('shredder_args', nargs=argparse.REMAINDER, help='Other arguments for xdmod-shredder')
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s [%(levelname)s] %(message)s', datefmt='%Y-%m-%dT%H:%M:%S', level=logging.INFO)
+
+    return shred_staged(args.staging, args.shredder_args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,142 @@
+"""
+Run a postprocessor's per-file function over its inputs, optionally in a
+pool of worker processes.
+
+Each day file is independent and produces its own output files, so the
+inputs can be fanned out to a ProcessPoolExecutor. The per-file function
+returns a Stats object which is merged in the parent process. It sets
+failed on the Stats of an input that it could not read (e.g. a truncated
+transfer), which is then not recorded as processed and is retried by the
+next run.
+
+The wall time and size of every input file is added to its Stats, and
+with profile=True each file is run under cProfile and the profile of the
+slowest one is kept.
+"""
+
+import logging
+import os
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from nairrpp.metrics import Profile, stopwatch
+
+
+class Stats:
+    """ Counters accumulated while processing input files """
+
+    def __init__(self):
+        self.counts = Counter()
+        self.unmapped = Counter()
+        # Charge ids looked up in the account mapping, only kept per input file
+        self.accounts = set()
+        self.timings = Counter()
+        self.files = []
+        self.profile = None
+        # Set when the input could not be read, so that it is not recorded as processed
+        self.failed = False
+
+    def update(self, other):
+        if other is None:
+            return
+        self.counts.update(other.counts)
+        self.unmapped.update(other.unmapped)
+        self.timings.update(other.timings)
+        self.files.extend(other.files)
+        if other.profile is not None and (self.profile is None or other.profile.seconds > self.profile.seconds):
+            self.profile = other.profile
+
+    def timer(self, stage):
+        """ Context manager that adds the time spent in it to the stage's timing """
+
+        return stopwatch(self.timings, stage)
+
+    def output(self, outfile):
+        """ Count an OutputFile (or the output of a SlurmJsonWriter) once it is closed """
+
+        if outfile.changed is not None:
+            self.counts['outputs_changed' if outfile.changed else 'outputs_unchanged'] += 1
+            self.counts['bytes_written'] += outfile.size
+
+    def log(self, level=logging.INFO):
+        logging.log(level, 'Processed %d files: %d rows read, %d rows kept, %d rows with %d unmapped accounts',
+                    self.counts['files'], self.counts['rows_read'], self.counts['rows_kept'],
+                    sum(self.unmapped.values()), len(self.unmapped))
+        logging.log(level, 'Dropped %d rows that were already written from other files', self.counts['rows_duplicate'])
+        logging.log(level, 'Wrote %d output files, %d unchanged', self.counts['outputs_changed'], self.counts['outputs_unchanged'])
+        if self.counts['files_failed']:
+            logging.warning('Unable to read %d files, they will be retried', self.counts['files_failed'])
+        for account, count in sorted(self.unmapped.items()):
+            logging.debug('Unmapped account %s: %d rows', account, count)
+        for stage, seconds in sorted(self.timings.items()):
+            logging.debug('Spent %.1fs in %s', seconds, stage)
+
+
+def _run(func, profile, fullpath, filename, *args):
+    """ Call func and add the timing and size of the input to its Stats """
+
+    started = time.perf_counter()
+    if profile:
+        stats, prof = Profile.call(filename, func, fullpath, filename, *args)
+    else:
+        stats, prof = func(fullpath, filename, *args), None
+    seconds = time.perf_counter() - started
+
+    if stats is None:
+        stats = Stats()
+    stats.profile = prof
+    stats.counts['bytes_read'] += os.path.getsize(fullpath)
+    stats.files.append({
+        'file': filename,
+        'seconds': round(seconds, 3),
+        'stages': {stage: round(value, 3) for stage, value in stats.timings.items()},
+        'rows_read': stats.counts['rows_read'],
+        'rows_kept': stats.counts['rows_kept'],
+        'bytes_read': stats.counts['bytes_read'],
+        'bytes_written': stats.counts['bytes_written']
+    })
+    return stats
+
+
+def process_files(func, files, *args, jobs=1, done=None, profile=False):
+    """ Call func(fullpath, filename, *args) for every (fullpath, filename) in files.
+
+    With jobs > 1 the calls run in that many worker processes, so func and
+    its arguments must be picklable. done(fullpath, stats) is called in this
+    process as each input completes successfully with the Stats of the input,
+    but not for the inputs whose Stats are marked failed. Returns the merged Stats.
+    With profile=True the Stats also carry the cProfile of the slowest file.
+    """
+
+    totals = Stats()
+
+    def complete(fullpath, result):
+        totals.update(result)
+        totals.counts['files'] += 1
+        if result.failed:
+            totals.counts['files_failed'] += 1
+        elif done is not None:
+            done(fullpath, result)
+
+    if jobs <= 1:
+        for fullpath, filename in files:
+            complete(fullpath, _run(func, profile, fullpath, filename, *args))
+        return totals
+
+    pool = ProcessPoolExecutor(max_workers=jobs)
+    try:
+        futures = {}
+        for fullpath, filename in files:
+            futures[pool.submit(_run, func, profile, fullpath, filename, *args)] = fullpath
+
+        for future in as_completed(futures):
+            complete(futures[future], future.result())
+    except BaseException:
+        for future in futures:
+            future.cancel()
+        pool.shutdown(wait=True)
+        raise
+
+    pool.shutdown(wait=True)
+    return totals
@@ -0,0 +1,69 @@
+"""
+Fast selection of the NAIRR records from delimited accounting logs.
+
+The full-system logs from the large TACC machines contain every job on the
+system and only a small fraction of them belong to NAIRR allocations.
+Rather than decoding and splitting every line, the file is memory-mapped
+and searched for the account prefix. Only the lines that contain it are
+split, and only up to the field that has to be checked. Matching lines are
+returned as the raw bytes from the input so that they can be written out
+unchanged.
+"""
+
+import mmap
+import os
+
+# Size of the blocks used to count the lines that are skipped over
+COUNT_BLOCK = 1 << 26
+
+
+class LineFilter:
+    """ Iterate over the lines of a file whose given field starts with prefix.
+
+    Yields (line, fields) where line is the complete line including its
+    newline and fields is the list of the first ``field + 1`` fields as
+    bytes. After the iteration ``lines`` is the number of lines in the file.
+    """
+
+    def __init__(self, path, field, prefix, delimiter=b'|'):
+        self.path = path
+        self.field = field
+        self.prefix = prefix
+        self.delimiter = delimiter
+        self.lines = 0
+
+    def _count(self, mm, start, end):
+        for offset in range(start, end, COUNT_BLOCK):
+            self.lines += mm[offset:min(offset + COUNT_BLOCK, end)].count(b'\n')
+
+    def __iter__(self):
+        self.lines = 0
+
+        with open(self.path, 'rb') as filep:
+            if os.fstat(filep.fileno()).st_size == 0:
+                return
+
+            with mmap.mmap(filep.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                size = len(mm)
+                pos = 0
+
+                while pos < size:
+                    hit = mm.find(self.prefix, pos)
+                    if hit == -1:
+                        break
+
+                    linestart = mm.rfind(b'\n', pos, hit) + 1 or pos
+                    lineend = mm.find(b'\n', hit)
+                    lineend = size if lineend == -1 else lineend + 1
+
+                    self._count(mm, pos, lineend)
+                    pos = lineend
+
+                    line = mm[linestart:lineend]
+                    fields = line.split(self.delimiter, self.field + 1)
+                    if len(fields) > self.field and fields[self.field].startswith(self.prefix):
+                        yield line, fields[:self.field + 1]
+
+                self._count(mm, pos, size)
+                if mm[size - 1:size] != b'\n':
+                    self.lines += 1
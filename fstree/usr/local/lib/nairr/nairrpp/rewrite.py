@@ -0,0 +1,179 @@
+"""
+Rewrite site sacct pipe delimited logs into the Slurm format read by
+xdmod-shredder -f slurm.
+
+Each site declares the layout of its raw records in a dict:
+
+    overflow: index of the last raw field (the job name). A job name that
+              contains the delimiter spills into extra fields; they are
+              joined back together with overflow_join
+    overflow_join: string that replaces the delimiter in the job name
+    account: index of the local charge account in the raw record
+    queue: index of the partition in the raw record
+    insert: {output index: constant} for fields that the site does not
+            report. The raw fields fill the other output fields in order
+            and the account field is replaced by the NAIRR grant
+    resources: ordered {partition prefix: resource} table
+    default_resource: resource for partitions that match no prefix, if
+                      None those records are logged and skipped
+    ignore_case: match the partition prefixes case insensitively
+    count_unmapped: report the accounts that are not mapped to a grant
+
+The layout is compiled once into an itemgetter (as Lonestar6 does for its
+rows). Only the account is split off most lines; the records of mapped
+accounts are split once and rearranged in one step. Output lines are
+buffered per resource.
+"""
+
+import logging
+import operator
+import os
+
+from nairrpp.columnar import SLURM_FIELDS
+from nairrpp.jobindex import slurm_job
+from nairrpp.parallel import Stats
+
+# Lines buffered per resource before they are written to the output
+BUFFER_LINES = 4096
+
+
+class PipeRewriter:
+    """ Compiled rewrite rules for one site's raw sacct layout """
+
+    def __init__(self, layout, delimiter='|'):
+        self.delimiter = delimiter
+        self.overflow = layout['overflow']
+        self.overflow_join = layout.get('overflow_join', delimiter)
+        self.account = layout['account']
+        self.queue = layout['queue']
+        self.resources = list(layout['resources'].items())
+        self.default_resource = layout.get('default_resource')
+        self.ignore_case = layout.get('ignore_case', False)
+        self.count_unmapped = layout.get('count_unmapped', False)
+        self._resource_cache = {}
+
+        insert = layout.get('insert', {})
+        # Raw fields with the grant and the constants appended
+        grantpos = self.overflow + 1
+        constbase = grantpos + 1
+        self.constants = list(insert.values())
+        constpos = {pos: constbase + idx for idx, pos in enumerate(insert)}
+
+        indexes = []
+        raw = 0
+        for pos in range(len(SLURM_FIELDS)):
+            if pos in constpos:
+                indexes.append(constpos[pos])
+            else:
+                if raw > self.overflow:
+                    raise ValueError(f'Raw layout has too few fields for output field {SLURM_FIELDS[pos]}')
+                indexes.append(grantpos if raw == self.account else raw)
+                raw += 1
+
+        self.pick = operator.itemgetter(*indexes)
+
+    def resource(self, queue):
+        """ Resource for a partition name, None if it matches no prefix and there is no default """
+
+        try:
+            return self._resource_cache[queue]
+        except KeyError:
+            pass
+
+        name = queue.lower() if self.ignore_case else queue
+        resource = self.default_resource
+        for prefix, rname in self.resources:
+            if name.startswith(prefix.lower() if self.ignore_case else prefix):
+                resource = rname
+                break
+
+        self._resource_cache[queue] = resource
+        return resource
+
+    def process_file(self, fullpath, filename, outputs, mapping, index, store):
+        """ Rewrite one raw log into <resource>/<filename> outputs, returns the Stats """
+
+        stats = Stats()
+        delimiter = self.delimiter
+        maxsplit = self.overflow
+        nfields = self.overflow + 1
+        accountpos = self.account
+        track = mapping.table is not None
+
+        outfiles = {}
+        buffers = {}
+        seen = index.source(fullpath)
+        part = store.writer(fullpath)
+
+        try:
+            with open(fullpath, "r", encoding='utf-8', errors='ignore') as filep:
+                for line in filep:
+                    stats.counts['rows_read'] += 1
+
+                    # Most jobs are not NAIRR jobs, only split off the account to check
+                    head = line.split(delimiter, accountpos + 1)
+                    if len(head) <= accountpos:
+                        stats.counts['rows_malformed'] += 1
+                        continue
+
+                    account = head[accountpos]
+                    if track:
+                        stats.accounts.add(mapping.charge_id(account))
+                    grant = mapping.lookup(account)
+                    if grant is None:
+                        if self.count_unmapped:
+                            stats.unmapped[account] += 1
+                        # The columnar store keeps every job so that it can be mapped again later
+                        if not part.enabled:
+                            continue
+
+                    fields = line.rstrip('\r\n').split(delimiter, maxsplit)
+                    if len(fields) < nfields:
+                        stats.counts['rows_malformed'] += 1
+                        continue
+
+                    resource = self.resource(fields[self.queue])
+                    if resource is None:
+                        if grant is not None:
+                            logging.error(f"Unrecognized queue {fields[self.queue]}")
+                        continue
+
+                    fields[maxsplit] = fields[maxsplit].replace(delimiter, self.overflow_join)
+                    fields.append(grant or '')
+                    fields.extend(self.constants)
+                    record = self.pick(fields)
+
+                    part.add(resource, record, account, os.path.join(resource, filename))
+                    if grant is None or not seen.emit(resource, slurm_job(record)):
+                        continue
+
+                    if resource not in outfiles:
+                        outfiles[resource] = outputs.open(os.path.join(resource, filename))
+                        buffers[resource] = []
+                    buf = buffers[resource]
+                    buf.append(delimiter.join(record) + "\n")
+                    if len(buf) >= BUFFER_LINES:
+                        outfiles[resource].write(''.join(buf))
+                        del buf[:]
+                    stats.counts['rows_kept'] += 1
+
+            with stats.timer('write'):
+                for resource, outf in outfiles.items():
+                    outf.write(''.join(buffers[resource]))
+                    outf.close()
+                    stats.output(outf)
+        except BaseException:
+            for outf in outfiles.values():
+                outf.abort()
+            seen.abort()
+            part.abort()
+            raise
+
+        seen.close()
+        part.close()
+
+        if stats.counts['rows_malformed']:
+            logging.warning('Skipped %d malformed lines in %s', stats.counts['rows_malformed'], fullpath)
+        stats.counts['rows_duplicate'] += seen.dropped
+
+        return stats
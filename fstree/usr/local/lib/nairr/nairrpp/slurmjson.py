@@ -0,0 +1,236 @@
+"""
+Streaming reader and writer for ``sacct --json`` documents.
+
+The daily dumps from the large GPU systems are hundreds of MB, so rather
+than ``json.load()`` the whole document the reader walks the top level
+object incrementally and yields the entries of the ``jobs`` array one at a
+time. The writer produces the same bytes as ``json.dump()`` of the filtered
+document, so the output is unchanged for ``xdmod-shredder -f slurmjson``.
+The writer collects the encoded jobs in a buffer of at most BUFFER_SIZE
+characters before passing them to the output. Memory use is bounded by
+the size of the largest single job and the write buffer.
+"""
+
+import json
+
+from nairrpp.output import OutputFile
+
+_decoder = json.JSONDecoder()
+
+_WHITESPACE = ' \t\n\r'
+
+_NUMBER = '0123456789+-.eE'
+
+# Characters of encoded jobs collected before they are written to the output
+BUFFER_SIZE = 1 << 18
+
+
+class SlurmJsonReader:
+    """ Iterate over the jobs in a Slurm JSON document read from a text file object.
+
+    Top level members other than ``jobs`` are small (meta, errors, warnings)
+    and are kept in ``header`` (members before the jobs array) and
+    ``trailer`` (members after it) so they can be written back out.
+    """
+
+    def __init__(self, filep, chunksize=1 << 16):
+        self.filep = filep
+        self.chunksize = chunksize
+        self.header = {}
+        self.trailer = {}
+        self._buf = ''
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self):
+        """ Read more data, returns False at end of file """
+
+        if self._eof:
+            return False
+
+        data = self.filep.read(max(self.chunksize, len(self._buf) - self._pos))
+        if not data:
+            self._eof = True
+            return False
+
+        self._buf = self._buf[self._pos:] + data
+        self._pos = 0
+        return True
+
+    def _error(self, msg):
+        return json.JSONDecodeError(msg, self._buf, self._pos)
+
+    def _peek(self):
+        """ Skip whitespace and return the next character ('' at end of file) """
+
+        while True:
+            while self._pos < len(self._buf) and self._buf[self._pos] in _WHITESPACE:
+                self._pos += 1
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill():
+                return ''
+
+    def _expect(self, char):
+        if self._peek() != char:
+            raise self._error(f"Expecting '{char}'")
+        self._pos += 1
+
+    def _value(self):
+        """ Decode the next complete JSON value from the stream """
+
+        self._peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self._buf, self._pos)
+            except json.JSONDecodeError:
+                if self._fill():
+                    continue
+                raise
+
+            # A number that runs to the end of the buffer, or that is
+            # followed by more of a number (1. of 1.5), may be truncated
+            if end == len(self._buf) or (type(value) in (int, float) and self._buf[end] in _NUMBER):
+                if self._fill():
+                    continue
+
+            self._pos = end
+            return value
+
+    def __iter__(self):
+        self._expect('{')
+
+        members = self.header
+        if self._peek() == '}':
+            self._pos += 1
+            return
+
+        while True:
+            key = self._value()
+            if not isinstance(key, str):
+                raise self._error('Expecting property name')
+            self._expect(':')
+
+            if key == 'jobs':
+                yield from self._jobs()
+                members = self.trailer
+            else:
+                members[key] = self._value()
+
+            char = self._peek()
+            self._pos += 1
+            if char == '}':
+                return
+            if char != ',':
+                raise self._error("Expecting ',' delimiter")
+
+    def _jobs(self):
+        self._expect('[')
+
+        if self._peek() == ']':
+            self._pos += 1
+            return
+
+        while True:
+            yield self._value()
+
+            char = self._peek()
+            self._pos += 1
+            if char == ']':
+                return
+            if char != ',':
+                raise self._error("Expecting ',' delimiter")
+
+
+class JsonArrayReader(SlurmJsonReader):
+    """ Iterate over the elements of a JSON document that is a top level array """
+
+    def __iter__(self):
+        yield from self._jobs()
+        if self._peek() != '':
+            raise self._error('Extra data')
+
+
+def iterjobs(filep):
+    """ Yield the jobs from a Slurm JSON document one at a time """
+
+    return iter(SlurmJsonReader(filep))
+
+
+class SlurmJsonWriter:
+    """ Incrementally write a Slurm JSON document with a ``jobs`` array.
+
+    The document is written to an OutputFile (or a path), which only
+    replaces the target if the content changed. Nothing is written if no
+    jobs were added. Use as a context manager to discard the partial output
+    if processing fails.
+    """
+
+    def __init__(self, output, header=None, buffersize=BUFFER_SIZE):
+        if isinstance(output, str):
+            output = OutputFile(output)
+        self.output = output
+        self.header = header if header is not None else {}
+        self.buffersize = buffersize
+        self.count = 0
+        self._started = False
+        self._buf = []
+        self._buffered = 0
+
+    def _start(self):
+        self._started = True
+        self.output.write('{')
+        for key, value in self.header.items():
+            self.output.write(json.dumps(key) + ': ' + json.dumps(value) + ', ')
+        self.output.write('"jobs": [')
+
+    def _flush(self):
+        if self._buf:
+            self.output.write(''.join(self._buf))
+            self._buf = []
+            self._buffered = 0
+
+    def write(self, job):
+        if not self._started:
+            self._start()
+            data = json.dumps(job)
+        else:
+            data = ', ' + json.dumps(job)
+        self._buf.append(data)
+        self._buffered += len(data)
+        if self._buffered >= self.buffersize:
+            self._flush()
+        self.count += 1
+
+    def close(self, trailer=None):
+        """ Finish the document and install it, returns OutputFile.close() """
+
+        if not self._started:
+            return None
+        self._started = False
+
+        self._flush()
+        self.output.write(']')
+        for key, value in (trailer or {}).items():
+            self.output.write(', ' + json.dumps(key) + ': ' + json.dumps(value))
+        self.output.write('}')
+
+        return self.output.close()
+
+    def abort(self):
+        """ Throw away any partially written output """
+
+        self._started = False
+        self._buf = []
+        self._buffered = 0
+        self.output.abort()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
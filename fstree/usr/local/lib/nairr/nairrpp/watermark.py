@@ -0,0 +1,134 @@
+"""
+Incremental runs of an XDMoD ETL pipeline.
+
+``etl_overseer.php -m DATE`` (--last-modified-start-date) restricts every
+action that declares a last_modified_start_date overseer restriction to
+the records modified since DATE. The resource actions staging ingest then
+only pulls the XRAS action resources whose action, request or action
+resource was modified since, the people dimension only the people that
+were, and the aggregators only re-aggregate the days (and months,
+quarters and years) of the staged rows that changed. The other dimension
+ingestors read small XRAS tables without a modification time that can be
+relied on (or a change that does not move the one of the table read), so
+they reload every row on each run.
+
+    python3 -m nairrpp.watermark NAME COMMAND...
+
+runs COMMAND with ``-m <watermark>`` appended. The watermark of NAME is
+the start of its last successful run less --overlap seconds, which covers
+clock skew between XRAS and this host and transactions that were still
+open when the last run started. The start of the run is recorded once
+COMMAND succeeds; a failed run leaves the watermark where it was.
+
+The first run, a run with --full and the first run after --full-every days
+without a full one use FULL_START instead. Full runs pick up anything that
+the modification times do not show, like a row that moved to another day
+and left a stale aggregate behind on the old one.
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import subprocess
+import sys
+
+from nairrpp.backfill import _atomic_json
+
+DEFAULT_STATE = '/var/lib/nairr/etl-watermarks.json'
+
+STATE_FORMAT = 1
+
+FULL_START = '2000-01-01 00:00:00'
+
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+class Watermarks:
+    """ The persistent watermarks of the incremental pipelines """
+
+    def __init__(self, path):
+        self.path = path
+        self.pipelines = {}
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as filep:
+                data = json.load(filep)
+        except FileNotFoundError:
+            return
+        except ValueError:
+            logging.warning('Unable to read the watermarks %s. Every pipeline will run in full', self.path)
+            return
+
+        if data.get('format') != STATE_FORMAT:
+            logging.warning('Watermarks %s have an unsupported format. Every pipeline will run in full', self.path)
+            return
+
+        self.pipelines = data['pipelines']
+
+    def save(self):
+        _atomic_json(self.path, {
+            'format': STATE_FORMAT,
+            'pipelines': self.pipelines
+        })
+
+    def start(self, name, now, overlap, full=False, full_every=None):
+        """ The -m value for a run of name that starts at now, and whether it is a full run """
+
+        entry = self.pipelines.get(name)
+        if full or entry is None:
+            return FULL_START, True
+
+        last_full = datetime.datetime.strptime(entry['last_full'], TIME_FORMAT)
+        if full_every is not None and now - last_full >= datetime.timedelta(days=full_every):
+            logging.info('No full run of %s since %s', name, entry['last_full'])
+            return FULL_START, True
+
+        started = datetime.datetime.strptime(entry['started'], TIME_FORMAT)
+        return (started - datetime.timedelta(seconds=overlap)).strftime(TIME_FORMAT), False
+
+    def succeeded(self, name, started, full):
+        entry = self.pipelines.setdefault(name, {})
+        entry['started'] = started.strftime(TIME_FORMAT)
+        if full or 'last_full' not in entry:
+            entry['last_full'] = entry['started']
+        self.save()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog='python3 -m nairrpp.watermark',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description='Run an XDMoD ETL pipeline on the records modified since its last successful run'
+    )
+    parser.add_argument('-s', '--state', default=DEFAULT_STATE, help='File with the watermark of each pipeline')
+    parser.add_argument('--overlap', type=int, default=3600, help='Seconds before the start of the last run to restart from')
+    parser.add_argument('--full', action='store_true', help=f'Run from {FULL_START}')
+    parser.add_argument('--full-every', type=int, default=7, help='Days after which the next run is a full one, 0 never')
+    parser.add_argument('name', help='Name of the pipeline in the state file')
+    parser.add_argument('command', nargs=argparse.REMAINDER, help='etl_overseer.php command line, -m is appended')
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s [%(levelname)s] %(message)s', datefmt='%Y-%m-%dT%H:%M:%S', level=logging.INFO)
+
+    if not args.command:
+        parser.error('the command to run is required')
+
+    watermarks = Watermarks(args.state)
+    now = datetime.datetime.now().replace(microsecond=0)
+    start, full = watermarks.start(args.name, now, args.overlap, args.full, args.full_every or None)
+
+    logging.info('%s run of %s from %s', 'Full' if full else 'Incremental', args.name, start)
+    returncode = subprocess.call(args.command + ['-m', start])
+    if returncode != 0:
+        logging.error('%s failed with exit status %d, the next run starts from %s again', args.name, returncode, start)
+        return returncode
+
+    watermarks.succeeded(args.name, now, full)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,178 @@
+"""
+Extraction of the XDMoD configuration data from the XRAS mirror.
+
+The XRAS scripts (csv_json_builder.py, build_hierarchy.py and
+generate_resources.py) read the ``tgcdbmirror`` section of the XDMoD
+portal settings to connect to the mirror. Query results that are written
+out as they are get streamed by the server with ``COPY (...) TO STDOUT
+WITH (FORMAT csv)`` straight into the output file. Results that need to
+be processed in Python are read from a named (server side) cursor
+``ITERSIZE`` rows at a time. Either way memory use does not depend on
+the size of the result.
+
+The mirror is remote, so the independent queries of a script run
+concurrently, each on its own connection from a Snapshot. The first
+connection of a Snapshot opens a REPEATABLE READ transaction and exports
+its snapshot with pg_export_snapshot(); every other connection imports it
+with SET TRANSACTION SNAPSHOT, so all the queries see the mirror in the
+same state even if it is refreshed while they run.
+
+The scripts write their outputs with nairrpp.output.OutputFile, so a file
+is replaced atomically and only if its content changed.
+"""
+
+import configparser
+import csv
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg2
+
+from nairrpp.metrics import stopwatch
+
+# Rows fetched per round trip from a named cursor
+ITERSIZE = 5000
+
+# Connections per Snapshot, enough for every query of csv_json_builder.py to run at once
+POOL_SIZE = 6
+
+
+def connection_params(settings, section='tgcdbmirror'):
+    """ psycopg2.connect() arguments from a portal settings ini file """
+
+    config = configparser.ConfigParser()
+    config.read(settings)
+
+    return {
+        'database': config[section]['database'].strip("'"),
+        'host': config[section]['host'].strip("'"),
+        'user': config[section]['user'].strip("'"),
+        'password': config[section]['pass'].strip("'"),
+        'port': config[section]['port'].strip("'")
+    }
+
+
+def connect(settings, section='tgcdbmirror'):
+    return psycopg2.connect(**connection_params(settings, section))
+
+
+class Snapshot:
+    """ A pool of up to size connections that all read one exported snapshot """
+
+    def __init__(self, settings, section='tgcdbmirror', size=POOL_SIZE):
+        self.params = connection_params(settings, section)
+        self.size = size
+        self.connections = []
+        self._idle = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(size)
+
+        leader = self._open()
+        with leader.cursor() as cur:
+            cur.execute('SELECT pg_export_snapshot()')
+            self.snapshot_id = cur.fetchone()[0]
+        self._idle.append(leader)
+        logging.debug('Exported XRAS snapshot %s', self.snapshot_id)
+
+    def _open(self, snapshot_id=None):
+        conn = psycopg2.connect(**self.params)
+        with self._lock:
+            self.connections.append(conn)
+        conn.set_session(isolation_level='REPEATABLE READ', readonly=True)
+        if snapshot_id is not None:
+            # Must be the first statement of the transaction
+            with conn.cursor() as cur:
+                cur.execute('SET TRANSACTION SNAPSHOT %s', (snapshot_id,))
+        return conn
+
+    def acquire(self):
+        """ An idle connection, opening a new one if there is none. Blocks while size are in use """
+
+        self._slots.acquire()
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        try:
+            return self._open(self.snapshot_id)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def release(self, conn):
+        with self._lock:
+            self._idle.append(conn)
+        self._slots.release()
+
+    def _call(self, func, timings, name):
+        conn = self.acquire()
+        try:
+            if timings is None:
+                return func(conn)
+            with stopwatch(timings, name):
+                return func(conn)
+        finally:
+            self.release(conn)
+
+    def run(self, queries, metrics=None):
+        """ Call every func(conn) of {name: func} concurrently, returns {name: result}.
+
+        Each call has a connection to itself for its duration. With metrics
+        the time of each call is added to the stage of its name. If any call
+        fails the others still run to completion and the first error is raised.
+        """
+
+        timings = metrics.timings if metrics is not None else None
+        with ThreadPoolExecutor(max_workers=self.size) as pool:
+            futures = {name: pool.submit(self._call, func, timings, name) for name, func in queries.items()}
+        return {name: future.result() for name, future in futures.items()}
+
+    def close(self):
+        """ Close the connections, which ends their (read only) transactions """
+
+        for conn in self.connections:
+            conn.close()
+        self.connections = []
+        self._idle = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+
+def copy_csv(conn, query, output, force_quote=False):
+    """ Write the result of query to output as CSV with COPY, returns the number of rows.
+
+    With force_quote every non NULL value is quoted (as csv.QUOTE_ALL).
+    """
+
+    options = 'FORMAT csv'
+    if force_quote:
+        options += ', FORCE_QUOTE *'
+
+    with conn.cursor() as cur:
+        cur.copy_expert(f'COPY ({query.strip().rstrip(";")}) TO STDOUT WITH ({options})', output)
+        return cur.rowcount
+
+
+def stream(conn, query, name, itersize=ITERSIZE):
+    """ Yield the rows of query from a named server side cursor """
+
+    with conn.cursor(name=name) as cur:
+        cur.itersize = itersize
+        cur.execute(query)
+        yield from cur
+
+
+def write_csv(output, rows, quoting=csv.QUOTE_MINIMAL):
+    """ Write rows to output as CSV in the same dialect as copy_csv(), returns the number of rows """
+
+    writer = csv.writer(output, quoting=quoting, lineterminator='\n')
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+    return count
@@ -0,0 +1,203 @@
+"""
+Change detection for the CSV artifacts extracted from XRAS.
+
+csv_json_builder.py keeps the state of its extractions in a directory
+(``--statedir``):
+
+    state.json       per artifact, the sha256 of the last extract and of
+                     the last imported extract
+    extracted/NAME   the complete last extract of each artifact
+    imported/NAME    the complete extract that was last imported
+
+Every artifact is extracted on each run. The queries are cheap, while the
+XRAS tables they read have no reliable modification times: several have
+none, and deleted rows move none. The file that is handed to
+xdmod-import-csv only has the records of the extract that are not in the
+imported copy (the artifacts whose records can also go away are written
+whole), and an import is needed only if the two differ. The FOS data
+files that the nairr.fos ETL pipeline loads are only recorded (see
+ExtractState.record), as that pipeline always replaces its tables. Once an artifact
+has been imported, record it with
+
+    python3 -m nairrpp.xrasstate -s STATEDIR imported NAME...
+
+and ``python3 -m nairrpp.xrasstate -s STATEDIR pending [NAME...]`` lists
+the artifacts that still need to be imported (exit status 1 if none do).
+This only applies to refreshing a database that has the imported
+extracts: an empty one (a fresh install, see scripts/bootstrap.sh) needs
+the complete extracts in extracted/, which are then recorded as imported.
+"""
+
+import argparse
+import csv
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+
+from nairrpp.backfill import _atomic_json
+from nairrpp.manifest import filehash
+from nairrpp.output import OutputFile
+
+STATE_FORMAT = 1
+
+def csv_records(filep):
+    """ Yield the text of each CSV record of filep, including quoted line breaks """
+
+    lines = []
+
+    def source():
+        for line in filep:
+            lines.append(line)
+            yield line
+
+    for _ in csv.reader(source()):
+        yield ''.join(lines)
+        del lines[:]
+
+
+class ExtractState:
+    """ The persistent extraction state of the XRAS artifacts """
+
+    def __init__(self, statedir):
+        self.statedir = statedir
+        self.path = os.path.join(statedir, 'state.json')
+        self.artifacts = {}
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as filep:
+                data = json.load(filep)
+        except FileNotFoundError:
+            return
+        except ValueError:
+            logging.warning('Unable to read XRAS extraction state %s. Everything will be extracted', self.path)
+            return
+
+        if data.get('format') != STATE_FORMAT:
+            logging.warning('XRAS extraction state %s has an unsupported format. Everything will be extracted', self.path)
+            return
+
+        self.artifacts = data['artifacts']
+
+    def save(self):
+        os.makedirs(self.statedir, exist_ok=True)
+        _atomic_json(self.path, {
+            'format': STATE_FORMAT,
+            'artifacts': self.artifacts
+        })
+
+    def extracted(self, name):
+        return os.path.join(self.statedir, 'extracted', name)
+
+    def imported_copy(self, name):
+        return os.path.join(self.statedir, 'imported', name)
+
+    def forget(self, name):
+        """ Forget the last import of an artifact, so that all of it is imported again """
+
+        self.artifacts.pop(name, None)
+        try:
+            os.unlink(self.imported_copy(name))
+        except FileNotFoundError:
+            pass
+
+    def update(self, name, target, changes_only=True):
+        """ Record the extract of an artifact and write the records that are not imported yet to target.
+
+        Without changes_only every record is written, for the artifacts
+        that have to be replaced as a whole. Returns (number of records
+        that are not imported yet, whether an import is needed).
+        """
+
+        self.record(name)
+        entry = self.artifacts[name]
+
+        imported = set()
+        try:
+            with open(self.imported_copy(name), 'r', encoding='utf-8', newline='') as filep:
+                imported.update(csv_records(filep))
+        except FileNotFoundError:
+            pass
+
+        count = 0
+        rows = 0
+        with OutputFile(target) as out, open(self.extracted(name), 'r', encoding='utf-8', newline='') as filep:
+            # An empty change set still replaces the changes of an earlier run
+            out.write('')
+            for record in csv_records(filep):
+                rows += 1
+                if record not in imported:
+                    count += 1
+                elif changes_only:
+                    continue
+                out.write(record)
+
+        entry['rows'] = rows
+        entry['changed_rows'] = count
+        return count, self.pending(name)
+
+    def record(self, name):
+        """ Record the extract of an artifact that is imported whole, returns whether an import is needed """
+
+        self.artifacts.setdefault(name, {})['fingerprint'] = filehash(self.extracted(name))
+        return self.pending(name)
+
+    def pending(self, name):
+        """ True if the last extract of an artifact differs from the one that was imported """
+
+        entry = self.artifacts.get(name)
+        return entry is not None and entry.get('fingerprint') != entry.get('imported')
+
+    def mark_imported(self, name):
+        """ Record that the last extract of an artifact was imported """
+
+        entry = self.artifacts.get(name)
+        if entry is None:
+            raise KeyError(f'{name} has not been extracted')
+
+        target = self.imported_copy(name)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        fd, tmpname = tempfile.mkstemp(dir=os.path.dirname(target), prefix='.' + name + '.')
+        try:
+            with os.fdopen(fd, 'wb') as dst, open(self.extracted(name), 'rb') as src:
+                shutil.copyfileobj(src, dst)
+            os.replace(tmpname, target)
+        except BaseException:
+            os.unlink(tmpname)
+            raise
+
+        entry['imported'] = entry['fingerprint']
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog='python3 -m nairrpp.xrasstate',
+        description='List the XRAS artifacts that need to be imported or record that they were'
+    )
+    parser.add_argument('-s', '--statedir', required=True, help='State directory of csv_json_builder.py')
+    parser.add_argument('command', choices=['pending', 'imported'])
+    parser.add_argument('artifacts', nargs='*', help='Artifact names, e.g. names.csv (default every artifact for pending)')
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s [%(levelname)s] %(message)s', datefmt='%Y-%m-%dT%H:%M:%S', level=logging.INFO)
+
+    state = ExtractState(args.statedir)
+
+    if args.command == 'pending':
+        pending = [name for name in (args.artifacts or sorted(state.artifacts)) if state.pending(name)]
+        for name in pending:
+            print(name)
+        return 0 if pending else 1
+
+    for name in args.artifacts:
+        state.mark_imported(name)
+    state.save()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
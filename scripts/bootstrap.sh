@@ -11,6 +11,9 @@ REPODIR=$(realpath $XDMOD_SRC_DIR)
 REF_DIR=/var/tmp/nairr
 BUILD_DIR=$(realpath $XDMOD_SRC_DIR/open_xdmod/build)
 PREFIX="/opt/xdmod"
+# State directory of csv_json_builder.py when the CSVs in $REF_DIR were
+# extracted by it. Set, the complete extracts kept there are imported
+XRAS_STATEDIR=${XRAS_STATEDIR:-}
 
 function copy_template_httpd_conf {
   cp /opt/xdmod/share/templates/apache.conf /etc/httpd/conf.d/xdmod.conf
@@ -31,6 +34,38 @@ function move_info_etc_xdmod {
   cp $REF_SOURCE/hierarchy.json /opt/xdmod/etc/
 }
 
+function xras_state {
+  PYTHONPATH=/usr/local/lib/nairr${PYTHONPATH:+:$PYTHONPATH} python3 -m nairrpp.xrasstate -s "$XRAS_STATEDIR" "$@"
+}
+
+# xras_extract ARTIFACT
+#
+# The complete extract of an XRAS artifact. The file csv_json_builder.py
+# writes to $REF_DIR may only have the records that changed since the last
+# import, so the complete copy in its state directory is used if there is one.
+function xras_extract {
+  if [ -n "$XRAS_STATEDIR" ]; then
+    echo "$XRAS_STATEDIR/extracted/$1"
+  else
+    echo "$REF_DIR/$1"
+  fi
+}
+
+# import_xras_csv ARTIFACT COMMAND...
+#
+# Run the import COMMAND for the complete extract of an XRAS CSV, which is
+# appended as -i FILE. A fresh install starts from an empty database, so the
+# extract is always imported whatever the extraction state says, and then
+# recorded as imported so that a later refresh only imports what changed.
+function import_xras_csv {
+  local artifact=$1
+  shift
+  "$@" -i "$(xras_extract "$artifact")" || exit $?
+  if [ -n "$XRAS_STATEDIR" ]; then
+    xras_state imported "$artifact" || exit $?
+  fi
+}
+
 function copy_reports {
   mkdir /opt/xdmod/reports
   cp -r /root/reports/* /opt/xdmod/reports/
@@ -164,8 +199,8 @@ if [ "$XDMOD_TEST_MODE" = "fresh_install" ]; then
   chown apache:xdmod /opt/xdmod/logs/query.log
 
   /opt/xdmod/share/tools/etl/etl_overseer.php -a xdmod.hpcdb-ingest-common.unknown_organization
-  xdmod-import-csv -t hierarchy -i $REF_DIR/hierarchy.csv
-  xdmod-import-csv -t group-to-hierarchy -i $REF_DIR/group-to-hierarchy.csv
+  import_xras_csv hierarchy.csv xdmod-import-csv -t hierarchy
+  import_xras_csv group-to-hierarchy.csv xdmod-import-csv -t group-to-hierarchy
 
   last_modified_start_date=$(date +'%F %T')
 
@@ -186,6 +221,13 @@ if [ "$XDMOD_TEST_MODE" = "fresh_install" ]; then
   echo "Nairr Bootstraping Complete"
   sudo -u xdmod /opt/xdmod/share/tools/etl/etl_overseer.php -p nairr.resource-actions-bootstrap
   sudo -u xdmod /opt/xdmod/share/tools/etl/etl_overseer.php -p nairr.resource-actions -m 2000-01-01
+  # The FOS closure and project levels written by csv_json_builder.py
+  if [ -n "$XRAS_STATEDIR" ]; then
+    mkdir -p /opt/xdmod/etc/etl/etl_data.d/nairr
+    cp $XRAS_STATEDIR/extracted/fos-closure.json $XRAS_STATEDIR/extracted/project-fos.json /opt/xdmod/etc/etl/etl_data.d/nairr/
+    sudo -u xdmod /opt/xdmod/share/tools/etl/etl_overseer.php -p nairr.fos || exit $?
+    xras_state imported fos-closure.json project-fos.json || exit $?
+  fi
   sudo -u xdmod /opt/xdmod/bin/xdmod-build-filter-lists --realm ResourceActions --quiet
 
   echo "Nairr Bootstraping Complete"
@@ -195,14 +237,13 @@ if [ "$XDMOD_TEST_MODE" = "fresh_install" ]; then
   echo "XDMoD Ingestor Completed"
 
   echo "Loading CLoud TO PI Data"
-  sudo -u xdmod /opt/xdmod/bin/xdmod-import-csv -t cloud-project-to-pi -i $REF_DIR/cloud-project-to-pi.csv
+  import_xras_csv cloud-project-to-pi.csv sudo -u xdmod /opt/xdmod/bin/xdmod-import-csv -t cloud-project-to-pi
 
   sudo -u xdmod /opt/xdmod/bin/xdmod-ingestor --datatype openstack
   sudo -u xdmod /opt/xdmod/bin/xdmod-ingestor --aggregate=cloud --last-modified-start-date "$last_modified_start_date"
 
   echo "Creating XDMoD Users"
-  sudo -u xdmod /opt/xdmod/bin/xdmod-import-csv -t names -i $REF_DIR/names.csv
-
+  import_xras_csv names.csv sudo -u xdmod /opt/xdmod/bin/xdmod-import-csv -t names
   sudo -u xdmod /opt/xdmod/bin/xdmod-ingestor
 
   echo "Creating XDMOD additional users"
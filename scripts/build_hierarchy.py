@@ -1,11 +1,15 @@
 #!/usr/bin/env python3
 import json
+import os
 import re
 import argparse
-import configparser
 import csv
+import sys
 
-import psycopg2
+sys.path.insert(0, os.environ.get('NAIRR_LIBDIR', '/usr/local/lib/nairr'))
+
+from nairrpp.metrics import DEFAULT_METRICS_DIR, DEFAULT_RUN_LOG, RunMetrics
+from nairrpp.xras import connect
 
 project_pinames_query = """
 SELECT LOWER(RM.REQUEST_NUMBER),
@@ -35,18 +39,22 @@ def main():
     )
     parser.add_argument('--xdmod_config_path', help='Path to the XDMoD configuration directory.', default='/etc/xdmod')
     parser.add_argument('--allocs_process', help='Allocations process from XRAS', default='NAIRR')
+    parser.add_argument('--metrics-dir', default=DEFAULT_METRICS_DIR, help='node-exporter textfile directory to write the run metrics to, empty to disable')
+    parser.add_argument('--run-log', default=DEFAULT_RUN_LOG, help='File to append a JSON summary of the run to, empty to disable')
     args = parser.parse_args()
-    
-    config = configparser.ConfigParser()
-    config.read(f'{args.xdmod_config_path}/portal_settings.ini')
 
-    with psycopg2.connect(database=config['tgcdbmirror']['database'].strip("'"),
-                        host=config['tgcdbmirror']['host'].strip("'"),
-                        user=config['tgcdbmirror']['user'].strip("'"),
-                        password=config['tgcdbmirror']['pass'].strip("'"),
-                        port=config['tgcdbmirror']['port'].strip("'")) as conn:
+    metrics = RunMetrics('build-hierarchy', 'xras', args.metrics_dir, args.run_log)
+    try:
+        build(args, metrics)
+        metrics.success = True
+    finally:
+        metrics.save()
+
+def build(args, metrics):
 
-        with conn.cursor() as curs:
+    with connect(f'{args.xdmod_config_path}/portal_settings.ini') as conn:
+
+        with conn.cursor() as curs, metrics.timer('names'):
             curs.execute(project_pinames_query.format(args.allocs_process))
 
             with open("names.csv", "w") as namesfp:
@@ -54,5 +62,7 @@ def main():
                 for data in curs:
                     writer.writerow(data)
 
+            metrics.set('rows', curs.rowcount, artifact='names.csv')
+
 if __name__ == "__main__":
     main()
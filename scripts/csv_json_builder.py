@@ -13,7 +13,9 @@ Specifically, this script:
     - Field of Science hierarchies (hierarchy.csv)
     - Group-to-hierarchy mapping (group-to-hierarchy.csv)
     - Cloud project to PI mapping (cloud-project-to-pi.csv)
+    - The FOS tree, which is validated (see nairrpp.fos) and written as an ancestor/descendant closure table (fos-closure.json: ancestor, descendant, distance) and the top level, mid level and leaf FOS of each project (project-fos.json), so that hierarchy filters need no recursive lookups. These are XDMoD ETL data files that the nairr.fos pipeline loads into the fos_closure and project_fos tables
 - Writes these outputs in the expected format for XDMoD ingestion and configuration.
+- Writes only the CSV records that changed since the artifact was last imported and flags the artifacts that need an import (see nairrpp.xrasstate).
 
 This script is intended for use in the XDMoD NAIRR deployment workflow as part of automated configuration and data refreshes.
 """
@@ -39,7 +41,6 @@ names_sql = """
 SELECT
   username AS orcid,
   first_name,
-  middle_name,
   last_name,
   TRIM(
     COALESCE(o.organization_abbr, o.organization_name)
@@ -90,7 +91,10 @@ WITH
       AND rm.request_number IS NOT NULL
   )
 SELECT
-  *
+  nairr_project_name,
+  first_name,
+  last_name,
+  organization_name
 FROM
   RankedRequests
 WHERE
@@ -102,22 +106,20 @@ ORDER BY
 hierarchy_sql = """
 select
   ft1.fos_name,
-  ft1.fos_type_parent_id,
-  parent_ft.fos_name as parent_name
+  ft1.fos_name,
+  COALESCE(parent_ft.fos_name, '') as parent_name
 from
   xras.fos_types ft1
   LEFT JOIN xras.fos_types parent_ft ON parent_ft.fos_type_id = ft1.fos_type_parent_id
 WHERE
   ft1.allocations_process_id = 108
 ORDER By
-  parent_name DESC;
+  parent_ft.fos_name DESC;
 """
 
 groups_sql = """
 SELECT
   rm.request_number AS "nairr_project_name",
-  r.request_id,
-  rft.fos_type_id,
   ft.fos_name
 FROM
   xras.requests r
@@ -131,6 +133,17 @@ ORDER BY
   rm.request_number ASC;
 """
 
+fos_tree_sql = """
+SELECT
+  ft.fos_type_id,
+  ft.fos_name,
+  ft.fos_type_parent_id
+FROM
+  xras.fos_types ft
+WHERE
+  ft.allocations_process_id = 108;
+"""
+
 cloud_sql = """
 select distinct
   res.resource_name as resource_name,
@@ -147,31 +160,38 @@ where
   and rm.request_number is not null
   and resource_name in ('Indiana Jetstream2 GPU')
 """
-import configparser
+import argparse
 import csv
 import json
-import psycopg2
+import logging
+import os
 import re
+import shutil
+import sys
+import tempfile
 
-XDMOD_CONFIG_PATH = "/data/www/xdmod/etc"
-
-
-def save_json(filename, data):
-    with open(f"{XDMOD_CONFIG_PATH}/{filename}", "w") as filep:
-        json.dump(data, filep, indent=4)
+sys.path.insert(0, os.environ.get('NAIRR_LIBDIR', '/usr/local/lib/nairr'))
 
+from nairrpp.configmerge import ORGANIZATION_UPDATE, KeyedConfig
+from nairrpp.fos import FosTree
+from nairrpp.metrics import RunMetrics
+from nairrpp.output import OutputFile
+from nairrpp.xras import Snapshot, copy_csv, stream, write_csv
+from nairrpp.xrasstate import ExtractState
 
-def save_csv(filename, data, quoting=csv.QUOTE_MINIMAL):
-    with open(filename, "w") as f:
-        write = csv.writer(f, quoting=quoting)
-        write.writerows(data)
+XDMOD_CONFIG_PATH = "/data/www/xdmod/etc"
 
+# The CSV artifacts extracted from XRAS
+ARTIFACTS = (
+    "names.csv",
+    "group-to-hierarchy.csv",
+    "hierarchy.csv",
+    "cloud-project-to-pi.csv",
+)
 
-def fetch_and_append(cur, query, process_row_func, target_list):
-    cur.execute(query)
-    for row in cur:
-        processed_row = process_row_func(row)
-        target_list.append(processed_row)
+# Artifacts that are replaced as a whole rather than imported by changed
+# rows, as a FOS or the FOS of a project can also be removed in XRAS
+WHOLE_ARTIFACTS = ("hierarchy.csv", "group-to-hierarchy.csv")
 
 
 def demangle_name(inname):
@@ -185,89 +205,157 @@ def demangle_name(inname):
     return re.sub(r"[^\w]", "-", name)
 
 
-def fetch_and_append_cloud(cur, query, process_row_func, target_list):
-    cur.execute(query)
-    for row in cur:
-        processed_row = process_row_func(row)
-        processed_row[2] = demangle_name(processed_row[2])
-        target_list.append(processed_row)
+def cloud_rows(rows):
+    for resource_name, request_number in rows:
+        yield [request_number, request_number, demangle_name(resource_name)]
 
 
-def org_builder(cur, query, org_list):
-    cur.execute(query)
-    for data in cur:
-        org = {
+def org_builder(rows, orgs):
+    for data in rows:
+        orgs.upsert({
             "name": data[0],
             "abbrev": data[1],
-        }
-        if org not in org_list:
-            org_list.append(org)
+        }, update=ORGANIZATION_UPDATE)
+
+
+def project_levels(tree, rows):
+    seen = set()
+    for project, fos_name in rows:
+        levels = tree.levels(fos_name)
+        if levels is None:
+            logging.warning("FOS %s of %s is not in the FOS tree", fos_name, project)
+            continue
+        # A project has the FOS of each of its requests
+        if (project, fos_name) in seen:
+            continue
+        seen.add((project, fos_name))
+        yield (project,) + levels
+
+
+def write_records(output, header, rows):
+    """ Write rows as an XDMoD ETL data file, a JSON array of records that starts with the header """
+
+    output.write("[\n    " + json.dumps(header))
+    count = 0
+    for row in rows:
+        output.write(",\n    " + json.dumps(row))
+        count += 1
+    output.write("\n]\n")
+    return count
+
+
+def write_fos(tree, state, metrics, full=False):
+    """ Write the FOS closure table and the top, mid and leaf FOS of each project """
+
+    with OutputFile(state.extracted("fos-closure.json")) as closure:
+        rows = write_records(closure, ["ancestor", "descendant", "distance"], tree.closure())
+    metrics.set("rows", rows, artifact="fos-closure.json")
+
+    # From the complete group-to-hierarchy.csv extract, which has the FOS of the projects
+    with open(state.extracted("group-to-hierarchy.csv"), "r", newline="") as groups, \
+            OutputFile(state.extracted("project-fos.json")) as levels:
+        rows = write_records(levels, ["project", "top_level", "mid_level", "leaf"], project_levels(tree, csv.reader(groups)))
+    metrics.set("rows", rows, artifact="project-fos.json")
+
+    # The data files of the nairr.fos ETL pipeline, which replaces the tables as a whole
+    for name in ("fos-closure.json", "project-fos.json"):
+        if full:
+            state.forget(name)
+        import_needed = state.record(name)
+        with open(state.extracted(name), "r", encoding="utf-8") as src, OutputFile(f"{XDMOD_CONFIG_PATH}/etl/etl_data.d/nairr/{name}") as dst:
+            shutil.copyfileobj(src, dst)
+        logging.info("%s: import %s", name, "needed" if import_needed else "not needed")
+        metrics.set("import_needed", int(import_needed), artifact=name)
+
+    metrics.set("fos_orphans", len(tree.orphans))
+    metrics.set("fos_duplicates", len(tree.duplicates))
+    metrics.set("fos_cycles", len(tree.cycles))
 
 
 def main():
 
-    config = configparser.ConfigParser()
-    config.read(f"{XDMOD_CONFIG_PATH}/portal_settings.d/nairr.ini")
-
-    orgs = []
-    names = []
-    fos_list = []
-    groups = []
-    cloud_to_pi = []
-
-    db_config = {
-        "database": config["tgcdbmirror"]["database"].strip("'"),
-        "host": config["tgcdbmirror"]["host"].strip("'"),
-        "user": config["tgcdbmirror"]["user"].strip("'"),
-        "password": config["tgcdbmirror"]["pass"].strip("'"),
-        "port": config["tgcdbmirror"]["port"].strip("'"),
-    }
-
-    with open(f"{XDMOD_CONFIG_PATH}/organization.json", "r") as org_file:
-        for org in json.load(org_file):
-            orgs.append(org)
-    with psycopg2.connect(**db_config) as conn:
-
-        with conn.cursor() as cur:
-            # Organization.json
-            org_builder(cur, org_sql, orgs)
-
-            # users for names.csv
-            fetch_and_append(
-                cur, names_sql, lambda row: [row[0], row[1], row[3], row[4]], names
-            )
-            # nairr_projects for names.csv
-            fetch_and_append(
-                cur,
-                nairr_project_sql,
-                lambda row: [row[7], row[1], row[3], row[4]],
-                names,
-            )
-
-            # group to field of science for group-to-hiearchy.csv
-            fetch_and_append(cur, groups_sql, lambda row: [row[0], row[3]], groups)
-
-            # fos hieararchy for hierarchy.csv
-            fetch_and_append(
-                cur, hierarchy_sql, lambda row: [row[0], row[0], row[2] or ""], fos_list
-            )
-
-            fetch_and_append_cloud(
-                cur,
-                cloud_sql,
-                lambda row: [row[1], row[1], row[0]],
-                cloud_to_pi,
-            )
-
-        save_json("organization.json", orgs)
-
-        save_csv("names.csv", names)
-
-        save_csv("group-to-hierarchy.csv", groups, csv.QUOTE_ALL)
-
-        save_csv("hierarchy.csv", fos_list, csv.QUOTE_ALL)
-
-        save_csv("cloud-project-to-pi.csv", cloud_to_pi)
+    parser = argparse.ArgumentParser(
+        prog="csv_json_builder.py",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description="Extract the XDMoD organizations, names and hierarchy data from XRAS",
+    )
+    parser.add_argument("-s", "--statedir", default="/data/xras/state", help="Directory for the extraction state")
+    parser.add_argument("--full", action="store_true", help="Write every record of every artifact and flag them all for import")
+    args = parser.parse_args()
+
+    logging.basicConfig(format="%(asctime)s [%(levelname)s] %(message)s", datefmt="%Y-%m-%dT%H:%M:%S", level=logging.INFO)
+
+    metrics = RunMetrics("csv-json-builder", "xras")
+    try:
+        build(args, metrics)
+        metrics.success = True
+    finally:
+        metrics.save()
+
+
+def build(args, metrics):
+
+    state = ExtractState(args.statedir)
+    orgs = KeyedConfig.load(f"{XDMOD_CONFIG_PATH}/organization.json", "name")
+
+    # The queries are independent, so they run concurrently on one snapshot of
+    # the mirror. The outputs that need no processing in Python are streamed
+    # by the server with COPY, the others are read from named cursors
+    with Snapshot(f"{XDMOD_CONFIG_PATH}/portal_settings.d/nairr.ini") as snapshot, \
+            tempfile.TemporaryFile() as nairr_projects:
+
+        # The complete extracts are kept in the state directory
+        with OutputFile(state.extracted("names.csv")) as names, \
+                OutputFile(state.extracted("group-to-hierarchy.csv")) as groups, \
+                OutputFile(state.extracted("hierarchy.csv")) as fos_list, \
+                OutputFile(state.extracted("cloud-project-to-pi.csv")) as cloud_to_pi:
+
+            # An empty result still replaces the last extract
+            for out in (names, groups, fos_list, cloud_to_pi):
+                out.write("")
+
+            results = snapshot.run({
+                # Organization.json
+                "organizations": lambda conn: list(stream(conn, org_sql, "organizations")),
+                # users and nairr_projects for names.csv, the projects follow the users
+                "names": lambda conn: copy_csv(conn, names_sql, names),
+                "nairr_projects": lambda conn: copy_csv(conn, nairr_project_sql, nairr_projects),
+                # group to field of science for group-to-hiearchy.csv
+                "groups": lambda conn: copy_csv(conn, groups_sql, groups, force_quote=True),
+                # fos hieararchy for hierarchy.csv
+                "hierarchy": lambda conn: copy_csv(conn, hierarchy_sql, fos_list, force_quote=True),
+                "cloud": lambda conn: write_csv(cloud_to_pi, cloud_rows(stream(conn, cloud_sql, "cloud"))),
+                # The FOS tree for fos-closure.json and project-fos.json
+                "fos_tree": lambda conn: list(stream(conn, fos_tree_sql, "fos_tree")),
+            }, metrics)
+
+            nairr_projects.seek(0)
+            shutil.copyfileobj(nairr_projects, names)
+
+    with metrics.timer("fos_closure"):
+        write_fos(FosTree(results["fos_tree"]), state, metrics, args.full)
+
+    org_builder(results["organizations"], orgs)
+
+    with metrics.timer("write"):
+        replaced = orgs.write(f"{XDMOD_CONFIG_PATH}/organization.json")
+    if orgs.changed:
+        logging.info("organization.json: %s", json.dumps(orgs.diff()))
+    metrics.set("rows", len(orgs), artifact="organization.json")
+    metrics.set("import_needed", int(replaced), artifact="organization.json")
+
+    # Only the records that were not imported yet are written for xdmod-import-csv
+    with metrics.timer("changes"):
+        for name in ARTIFACTS:
+            if args.full:
+                state.forget(name)
+            changed, import_needed = state.update(name, name, changes_only=name not in WHOLE_ARTIFACTS)
+            logging.info("%s: %d changed records, import %s", name, changed, "needed" if import_needed else "not needed")
+            metrics.set("rows", state.artifacts[name]["rows"], artifact=name)
+            metrics.set("changed_rows", changed, artifact=name)
+            metrics.set("import_needed", int(import_needed), artifact=name)
+
+    state.save()
 
 
 if __name__ == "__main__":
@@ -23,10 +23,16 @@ ORDER BY
   RES.RESOURCE_NAME ASC
 """
 
-import psycopg2
 import json
+import os
 import re
-import configparser
+import sys
+
+sys.path.insert(0, os.environ.get('NAIRR_LIBDIR', '/usr/local/lib/nairr'))
+
+from nairrpp.configmerge import RESOURCE_SPEC_UPDATE, RESOURCE_UPDATE, KeyedConfig
+from nairrpp.metrics import RunMetrics
+from nairrpp.xras import connect
 
 
 rtype_map = {"Compute": "HPC", "Cloud": "Cloud", "Program": "Program"}
@@ -45,78 +51,67 @@ def demangle_name(inname):
 
 def main():
 
-    XDMOD_CONFIG_PATH = "/data/www/xdmod/etc"
-
-    config = configparser.ConfigParser()
-    config.read(f"{XDMOD_CONFIG_PATH}/portal_settings.ini")
+    metrics = RunMetrics("generate-resources", "xras")
+    try:
+        build(metrics)
+        metrics.success = True
+    finally:
+        metrics.save()
 
-    resources = {}
 
-    with open(f"{XDMOD_CONFIG_PATH}/resources.json", "r") as resources_file:
-        for res in json.load(resources_file):
-            resources[res["resource"]] = {"fact": res}
+def build(metrics):
 
-    with open(f"{XDMOD_CONFIG_PATH}/resource_specs.json", "r") as resourcespecs_file:
-        for res in json.load(resourcespecs_file):
-            resources[res["resource"]]["specs"] = res
+    XDMOD_CONFIG_PATH = "/data/www/xdmod/etc"
 
-    print(json.dumps(resources))
+    resources = KeyedConfig.load(f"{XDMOD_CONFIG_PATH}/resources.json", "resource")
+    specs = KeyedConfig.load(f"{XDMOD_CONFIG_PATH}/resource_specs.json", "resource")
 
-    with psycopg2.connect(
-        database=config["tgcdbmirror"]["database"].strip("'"),
-        host=config["tgcdbmirror"]["host"].strip("'"),
-        user=config["tgcdbmirror"]["user"].strip("'"),
-        password=config["tgcdbmirror"]["pass"].strip("'"),
-        port=config["tgcdbmirror"]["port"].strip("'"),
-    ) as conn:
+    with connect(f"{XDMOD_CONFIG_PATH}/portal_settings.ini") as conn:
 
-        with conn.cursor() as curs:
+        with conn.cursor() as curs, metrics.timer("resources"):
             curs.execute(sql)
             for data in curs:
 
                 resource = demangle_name(data[1])
 
-                if resource not in resources:
-                    resources[resource] = {
-                        "fact": {
-                            "resource": resource,
-                            "resource_type": rtype_map[data[3]],
-                            "name": data[1],
-                            "description": data[2] or "",
-                            "resource_allocation_type": "CPUNode",
-                            "timezone": "EST",
-                            "pi_column": "account_name",
-                            "organization": data[6],
-                        },
-                        "specs": {
-                            "resource": resource,
-                            "start_date": data[4].strftime("%Y-%m-%d"),
-                            "cpu_node_count": 1,
-                            "cpu_processor_count": 1,
-                            "cpu_ppn": 1,
-                            "gpu_node_count": 0,
-                            "gpu_processor_count": 0,
-                            "gpu_ppn": 0,
-                        },
-                    }
-                    if data[5]:
-                        resources[resource]["specs"]["end_date"] = data[5].strftime(
-                            "%Y-%m-%d"
-                        )
-
-        rfact = []
-        rspec = []
-
-        for info in resources.values():
-            rfact.append(info["fact"])
-            rspec.append(info["specs"])
-
-        with open(f"{XDMOD_CONFIG_PATH}/resources.json", "w") as filep:
-            json.dump(rfact, filep, indent=4)
-
-        with open(f"{XDMOD_CONFIG_PATH}/resource_specs.json", "w") as filep:
-            json.dump(rspec, filep, indent=4)
-
+                # Resources that are already configured are kept as they
+                # are, apart from the end of production
+                resources.upsert(
+                    {
+                        "resource": resource,
+                        "resource_type": rtype_map[data[3]],
+                        "name": data[1],
+                        "description": data[2] or "",
+                        "resource_allocation_type": "CPUNode",
+                        "timezone": "EST",
+                        "pi_column": "account_name",
+                        "organization": data[6],
+                    },
+                    update=RESOURCE_UPDATE,
+                )
+                spec = {
+                    "resource": resource,
+                    "start_date": data[4].strftime("%Y-%m-%d"),
+                    "cpu_node_count": 1,
+                    "cpu_processor_count": 1,
+                    "cpu_ppn": 1,
+                    "gpu_node_count": 0,
+                    "gpu_processor_count": 0,
+                    "gpu_ppn": 0,
+                }
+                if data[5]:
+                    spec["end_date"] = data[5].strftime("%Y-%m-%d")
+                specs.upsert(spec, update=RESOURCE_SPEC_UPDATE)
+
+    metrics.set("rows", len(resources), artifact="resources.json")
+
+    with metrics.timer("write"):
+        for filename, config in (("resources.json", resources), ("resource_specs.json", specs)):
+            replaced = config.write(f"{XDMOD_CONFIG_PATH}/{filename}")
+            metrics.set("import_needed", int(replaced), artifact=filename)
+
+    # The ETL for the resources only has to be rerun if this is not empty
+    print(json.dumps({"resources.json": resources.diff(), "resource_specs.json": specs.diff()}, indent=4))
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,81 @@
+import datetime
+
+import pytest
+
+from nairrpp.backfill import Backfill, BackfillError, month_chunks
+from nairrpp.manifest import Manifest
+from nairrpp.parallel import Stats
+
+SINCE = datetime.date(2024, 1, 15)
+UNTIL = datetime.date(2024, 3, 2)
+
+
+def process(fullpath, filename, outputs):
+    stats = Stats()
+    stats.counts['rows_kept'] += 1
+    return stats
+
+
+def filedate(filename):
+    return datetime.datetime.strptime(filename, '%Y-%m-%d.log')
+
+
+def inputs(tmp_path):
+    indir = tmp_path / 'in'
+    indir.mkdir()
+    for name in ('2024-01-14.log', '2024-01-20.log', '2024-02-10.log', '2024-03-01.log', '2024-03-05.log'):
+        (indir / name).write_text('x\n')
+    return str(indir)
+
+
+def test_month_chunks():
+    assert [month for month, _, _ in month_chunks(SINCE, UNTIL)] == ['2024-01', '2024-02', '2024-03']
+    assert month_chunks(SINCE, UNTIL)[-1][1:] == (datetime.date(2024, 3, 1), UNTIL)
+
+
+def test_resume_keeps_the_checkpointed_range(tmp_path):
+    indir = inputs(tmp_path)
+    statedir = str(tmp_path / 'state')
+    manifest = Manifest(str(tmp_path / 'manifest.json'))
+
+    backfill = Backfill(statedir, str(tmp_path / 'out'), SINCE, UNTIL, manifest)
+    pending = backfill.pending(indir, filedate)
+    assert [len(files) for files in pending.values()] == [1, 1, 1]
+    backfill.checkpoint('2024-01', Stats())
+
+    # Resumed on a later day without --until
+    resumed = Backfill(statedir, str(tmp_path / 'out'), SINCE, None, manifest)
+    assert resumed.until == UNTIL
+    assert list(resumed.pending(indir, filedate)) == ['2024-02', '2024-03']
+
+    # Another --until starts over
+    other = Backfill(statedir, str(tmp_path / 'out'), SINCE, datetime.date(2024, 3, 31), manifest)
+    assert other.completed == {}
+    assert [len(files) for files in other.pending(indir, filedate).values()] == [1, 1, 2]
+
+
+def test_run_checkpoints_every_month(tmp_path):
+    indir = inputs(tmp_path)
+    statedir = str(tmp_path / 'state')
+    manifest = Manifest(str(tmp_path / 'manifest.json'))
+
+    stats = Backfill(statedir, str(tmp_path / 'out'), SINCE, UNTIL, manifest).run(process, indir, filedate)
+
+    assert stats.counts['files'] == 3
+    assert Backfill(statedir, str(tmp_path / 'out'), SINCE, None, manifest).pending(indir, filedate) == {}
+
+
+def test_month_with_a_failed_input_is_retried(tmp_path):
+    indir = inputs(tmp_path)
+    statedir = str(tmp_path / 'state')
+    manifest = Manifest(str(tmp_path / 'manifest.json'))
+
+    def truncated(fullpath, filename, outputs):
+        stats = process(fullpath, filename, outputs)
+        stats.failed = filename == '2024-02-10.log'
+        return stats
+
+    with pytest.raises(BackfillError, match='2024-02'):
+        Backfill(statedir, str(tmp_path / 'out'), SINCE, UNTIL, manifest).run(truncated, indir, filedate)
+
+    assert list(Backfill(statedir, str(tmp_path / 'out'), SINCE, None, manifest).pending(indir, filedate)) == ['2024-02']
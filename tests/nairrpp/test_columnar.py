@@ -0,0 +1,61 @@
+from nairrpp.columnar import SLURM_FIELDS, emit, split_slurm
+from nairrpp.output import OutputTree
+
+
+class Store:
+    """ The rows of a columnar store without the Parquet files """
+
+    def __init__(self):
+        self.rows = []
+        self.counts = {}
+
+    def add(self, resource, source, line, raw_account, output):
+        fields = split_slurm(line)
+        record = self.counts.get(source, 0)
+        self.counts[source] = record + 1
+        self.rows.append((resource, fields[13][:10], tuple(fields) + (raw_account, source, output, str(record))))
+
+    def scan(self, resource=None, since=None, until=None):
+        for res, day, row in sorted(self.rows, key=lambda row: row[:2]):
+            if resource is None or res in resource:
+                yield res, day, row
+
+
+def line(jobid, account, state='COMPLETED', end='2024-01-01T02:00:00'):
+    fields = [''] * len(SLURM_FIELDS)
+    fields[0] = fields[1] = str(jobid)
+    fields[2], fields[5], fields[10], fields[13], fields[16] = 'ls6', account, '2024-01-01T00:00:00', end, state
+    return '|'.join(fields)
+
+
+def test_emit_writes_the_postprocessor_files(tmp_path):
+    store = Store()
+    # A running job that ends the next day is in both daily dumps
+    store.add('LS6', '/in/2024-01-01.txt', line(2, 'NAIRR1', 'RUNNING', 'Unknown'), 'nairr1', 'LS6/2024-01-01.log')
+    store.add('LS6', '/in/2024-01-01.txt', line(1, 'NAIRR1'), 'nairr1', 'LS6/2024-01-01.log')
+    store.add('LS6', '/in/2024-01-01.txt', line(3, ''), 'other', 'LS6/2024-01-01.log')
+    store.add('LS6', '/in/2024-01-02.txt', line(1, 'NAIRR1'), 'nairr1', 'LS6/2024-01-02.log')
+    store.add('LS6', '/in/2024-01-02.txt', line(2, 'NAIRR1', 'COMPLETED', '2024-01-02T01:00:00'), 'nairr1', 'LS6/2024-01-02.log')
+
+    jobs, changed = emit(store, OutputTree(str(tmp_path)))
+
+    assert (jobs, changed) == (3, 2)
+    assert (tmp_path / 'LS6' / '2024-01-01.log').read_text() == line(2, 'NAIRR1', 'RUNNING', 'Unknown') + '\n' + line(1, 'NAIRR1') + '\n'
+    assert (tmp_path / 'LS6' / '2024-01-02.log').read_text() == line(2, 'NAIRR1', 'COMPLETED', '2024-01-02T01:00:00') + '\n'
+
+
+def test_emit_with_mapping_and_window(tmp_path):
+    class Mapping:
+        def lookup(self, account):
+            return {'nairr1': 'NAIRR1', 'other': 'NAIRR9'}.get(account)
+
+    store = Store()
+    store.add('LS6', '/in/2024-01-01.txt', line(1, 'NAIRR1'), 'nairr1', 'LS6/2024-01-01.log')
+    store.add('LS6', '/in/2024-01-01.txt', line(3, ''), 'other', 'LS6/2024-01-01.log')
+    store.add('LS6', '/in/2024-01-02.txt', line(4, '', end='2024-01-02T05:00:00'), 'other', 'LS6/2024-01-02.log')
+
+    jobs, changed = emit(store, OutputTree(str(tmp_path)), until='2024-01-01', mapping=Mapping())
+
+    assert (jobs, changed) == (2, 1)
+    assert (tmp_path / 'LS6' / '2024-01-01.log').read_text() == line(1, 'NAIRR1') + '\n' + line(3, 'NAIRR9') + '\n'
+    assert not (tmp_path / 'LS6' / '2024-01-02.log').exists()
@@ -0,0 +1,87 @@
+import pickle
+
+from nairrpp.columnar import split_slurm
+from nairrpp.jobindex import JobIndex, slurm_job, slurm_line_job, slurmjson_job
+
+JOB = ('frontera', '1001', '2024-01-01T00:00:00', 'COMPLETED|2024-01-01T01:00:00')
+
+
+def test_job_seen_in_another_file_is_dropped(tmp_path):
+    index = JobIndex(str(tmp_path / 'jobs.db'))
+
+    with index.source('day1.log') as jobs:
+        assert jobs.emit('Frontera', JOB)
+    with index.source('day2.log') as jobs:
+        assert not jobs.emit('Frontera', JOB)
+        assert jobs.dropped == 1
+
+
+def test_reprocessed_file_keeps_its_jobs(tmp_path):
+    index = JobIndex(str(tmp_path / 'jobs.db'))
+
+    with index.source('day1.log') as jobs:
+        assert jobs.emit('Frontera', JOB)
+    with index.source('day1.log') as jobs:
+        assert jobs.emit('Frontera', JOB)
+
+
+def test_changed_state_is_emitted_again(tmp_path):
+    index = JobIndex(str(tmp_path / 'jobs.db'))
+    running = JOB[:3] + ('RUNNING|Unknown',)
+
+    with index.source('day1.log') as jobs:
+        assert jobs.emit('Frontera', running)
+    with index.source('day2.log') as jobs:
+        assert jobs.emit('Frontera', JOB)
+        # A duplicate within the same file
+        assert not jobs.emit('Frontera', JOB)
+    # Another resource is a different job
+    with index.source('day3.log') as jobs:
+        assert jobs.emit('Vista', JOB)
+
+
+def test_failed_file_does_not_update_the_index(tmp_path):
+    index = JobIndex(str(tmp_path / 'jobs.db'))
+
+    try:
+        with index.source('day1.log') as jobs:
+            jobs.emit('Frontera', JOB)
+            raise ValueError('failed')
+    except ValueError:
+        pass
+
+    with index.source('day2.log') as jobs:
+        assert jobs.emit('Frontera', JOB)
+
+
+def test_prune_and_pickle(tmp_path):
+    index = JobIndex(str(tmp_path / 'jobs.db'))
+    with index.source('day1.log') as jobs:
+        jobs.emit('Frontera', JOB)
+
+    index.prune(days=-1)
+    with index.source('day2.log') as jobs:
+        assert jobs.emit('Frontera', JOB)
+
+    copy = pickle.loads(pickle.dumps(index))
+    assert copy.path == index.path
+    with copy.source('day3.log') as jobs:
+        assert not jobs.emit('Frontera', JOB)
+
+
+def test_job_keys():
+    fields = [''] * 20
+    fields[1], fields[2], fields[10], fields[13], fields[16] = '7', 'ls6', 'submit', 'end', 'FAILED'
+    assert slurm_job(fields) == ('ls6', '7', 'submit', 'FAILED|end')
+
+    cluster, jobid, submit, fingerprint = slurmjson_job({'cluster': 'c', 'job_id': 7, 'time': {'submission': 5, 'end': 9}, 'state': 'X'})
+    assert (cluster, jobid, submit) == ('c', 7, 5)
+    assert fingerprint == slurmjson_job({'cluster': 'd', 'job_id': 8, 'time': {'submission': 6, 'end': 9}, 'state': 'X'})[3]
+
+
+def test_line_job_matches_split_record():
+    line = '1|1001|frontera|rtx|normal|nairr1|g|1|u|1|2024-01-01T00:00:00|e|s|2024-01-01T01:00:00|01:00:00|0:0|COMPLETED|1|56|56|1G|cpu=56|cpu=56|02:00:00|c001|a|b|name\n'
+    assert slurm_line_job(line.encode()) == slurm_job(split_slurm(line))
+
+    short = '1|1001|frontera|rtx|normal|nairr1|g|1|u|1|submit|e|s|end|01:00:00|0:0|FAILED\r\n'
+    assert slurm_line_job(short.encode()) == slurm_job(split_slurm(short))
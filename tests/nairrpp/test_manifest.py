@@ -0,0 +1,75 @@
+import os
+
+from nairrpp.manifest import Manifest, filehash, mapping_version
+
+
+def write(path, text, mtime_ns=None):
+    path.write_text(text)
+    if mtime_ns is not None:
+        os.utime(str(path), ns=(mtime_ns, mtime_ns))
+    return str(path)
+
+
+def test_new_and_recorded_inputs(tmp_path):
+    manifest_path = str(tmp_path / 'manifest.json')
+    first = write(tmp_path / 'a.log', 'a\n')
+    second = write(tmp_path / 'b.log', 'b\n')
+
+    manifest = Manifest(manifest_path, {'acct': 'NAIRR1'})
+    assert list(manifest.changed([(first, 'a.log'), (second, 'b.log')])) == [(first, 'a.log'), (second, 'b.log')]
+    manifest.record(first)
+    manifest.save()
+
+    manifest = Manifest(manifest_path, {'acct': 'NAIRR1'})
+    assert list(manifest.changed([(first, 'a.log'), (second, 'b.log')])) == [(second, 'b.log')]
+    assert manifest.entries[first]['sha256'] == filehash(first)
+
+
+def test_touched_input_with_same_content_is_skipped(tmp_path):
+    manifest_path = str(tmp_path / 'manifest.json')
+    path = write(tmp_path / 'a.log', 'a\n', 1000000000)
+
+    manifest = Manifest(manifest_path)
+    manifest.record(path)
+    manifest.save()
+
+    write(tmp_path / 'a.log', 'a\n', 2000000000)
+    manifest = Manifest(manifest_path)
+    assert not manifest.needs_processing(path)
+    assert manifest.entries[path]['mtime_ns'] == 2000000000
+
+    write(tmp_path / 'a.log', 'b\n', 3000000000)
+    assert manifest.needs_processing(path)
+
+
+def test_mapping_change_and_full(tmp_path):
+    manifest_path = str(tmp_path / 'manifest.json')
+    path = write(tmp_path / 'a.log', 'a\n')
+
+    manifest = Manifest(manifest_path, {'acct': 'NAIRR1'})
+    manifest.record(path)
+    manifest.save()
+
+    assert not Manifest(manifest_path, {'acct': 'NAIRR1'}).needs_processing(path)
+    assert Manifest(manifest_path, {'acct': 'NAIRR2'}).needs_processing(path)
+    assert Manifest(manifest_path, {'acct': 'NAIRR1'}, full=True).needs_processing(path)
+
+
+def test_unreadable_manifest_reprocesses_everything(tmp_path):
+    manifest_path = tmp_path / 'manifest.json'
+    manifest_path.write_text('{not json')
+    path = write(tmp_path / 'a.log', 'a\n')
+
+    assert Manifest(str(manifest_path)).needs_processing(path)
+
+
+def test_save_only_when_dirty(tmp_path):
+    manifest_path = tmp_path / 'manifest.json'
+    Manifest(str(manifest_path)).save()
+    assert not manifest_path.exists()
+
+
+def test_mapping_version():
+    assert mapping_version(None) is None
+    assert mapping_version({'a': 1, 'b': 2}) == mapping_version({'b': 2, 'a': 1})
+    assert mapping_version({'a': 1}) != mapping_version({'a': 2})
@@ -0,0 +1,83 @@
+import os
+
+from nairrpp.output import OutputFile, OutputTree
+
+
+def test_new_output_is_installed(tmp_path):
+    target = tmp_path / 'sub' / 'out.log'
+
+    with OutputFile(str(target)) as out:
+        out.write('a|b\n')
+        out.write(b'c|d\n')
+
+    assert out.changed is True
+    assert out.size == 8
+    assert target.read_bytes() == b'a|b\nc|d\n'
+    assert sorted(path.name for path in target.parent.iterdir()) == ['out.log']
+
+
+def test_unchanged_output_keeps_the_file(tmp_path):
+    target = tmp_path / 'out.log'
+    target.write_text('same\n')
+    inode = os.stat(str(target)).st_ino
+
+    out = OutputFile(str(target))
+    out.write('same\n')
+    assert out.close() is False
+
+    assert os.stat(str(target)).st_ino == inode
+    assert [path.name for path in tmp_path.iterdir()] == ['out.log']
+
+
+def test_changed_output_replaces_the_file(tmp_path):
+    target = tmp_path / 'out.log'
+    target.write_text('old\n')
+
+    out = OutputFile(str(target))
+    out.write('new\n')
+    assert out.close() is True
+    assert target.read_text() == 'new\n'
+
+
+def test_nothing_written(tmp_path):
+    target = tmp_path / 'out.log'
+
+    out = OutputFile(str(target))
+    assert out.close() is None
+    assert not target.exists()
+
+    # An empty write still produces an (empty) output
+    with OutputFile(str(target)) as out:
+        out.write('')
+    assert out.changed is True
+    assert target.read_text() == ''
+
+
+def test_abort(tmp_path):
+    target = tmp_path / 'out.log'
+    target.write_text('old\n')
+
+    try:
+        with OutputFile(str(target)) as out:
+            out.write('partial')
+            raise ValueError('failed')
+    except ValueError:
+        pass
+
+    assert target.read_text() == 'old\n'
+    assert [path.name for path in tmp_path.iterdir()] == ['out.log']
+
+
+def test_changed_outputs_are_staged(tmp_path):
+    tree = OutputTree(str(tmp_path / 'out'), str(tmp_path / 'staging'))
+
+    with tree.open('2024/01.log') as out:
+        out.write('x\n')
+    staged = tmp_path / 'staging' / '2024' / '01.log'
+    assert staged.read_text() == 'x\n'
+
+    staged.unlink()
+    with tree.open('2024/01.log') as out:
+        out.write('x\n')
+    assert out.changed is False
+    assert not staged.exists()
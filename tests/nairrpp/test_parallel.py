@@ -0,0 +1,21 @@
+from nairrpp.parallel import Stats, process_files
+
+
+def process(fullpath, filename):
+    stats = Stats()
+    stats.counts['rows_kept'] += 1
+    stats.failed = filename == 'truncated.json'
+    return stats
+
+
+def test_failed_inputs_are_not_recorded(tmp_path):
+    files = []
+    for name in ('a.json', 'truncated.json', 'b.json'):
+        (tmp_path / name).write_text('{}')
+        files.append((str(tmp_path / name), name))
+
+    recorded = []
+    stats = process_files(process, files, done=lambda fullpath, result: recorded.append(fullpath))
+
+    assert recorded == [files[0][0], files[2][0]]
+    assert (stats.counts['files'], stats.counts['files_failed']) == (3, 1)
@@ -0,0 +1,111 @@
+import io
+import json
+
+import pytest
+
+from nairrpp.slurmjson import JsonArrayReader, SlurmJsonReader, SlurmJsonWriter
+
+DOCUMENT = {
+    'meta': {'plugin': {'type': 'openapi/v0.0.38'}, 'Slurm': {'version': {'major': 23}}},
+    'errors': [],
+    'jobs': [
+        {'job_id': 1, 'state': {'current': 'COMPLETED'}, 'time': {'submission': 1700000000, 'end': 1700003600.5}},
+        {'job_id': 22, 'name': 'a "quoted" name, with [brackets] and {braces}', 'tres': None, 'flags': [True, False]},
+        {'job_id': 333, 'exit_code': -1.25e-3, 'nodes': 'gpu[001-004]'},
+    ],
+    'warnings': ['late'],
+}
+
+
+def read(text, chunksize, reader=SlurmJsonReader):
+    jobs = reader(io.StringIO(text), chunksize=chunksize)
+    return list(jobs), jobs
+
+
+@pytest.mark.parametrize('chunksize', [1, 2, 3, 4, 5, 6, 7, 12, 1 << 16])
+def test_reader_chunk_boundaries(chunksize):
+    text = json.dumps(DOCUMENT)
+    jobs, reader = read(text, chunksize)
+    assert jobs == DOCUMENT['jobs']
+    assert reader.header == {'meta': DOCUMENT['meta'], 'errors': []}
+    assert reader.trailer == {'warnings': ['late']}
+
+
+@pytest.mark.parametrize('chunksize', range(1, 16))
+def test_reader_numbers_split_across_chunks(chunksize):
+    assert read('{"jobs": [1.5]}', chunksize)[0] == [1.5]
+    assert read('{"jobs": [12345, -0.5e+10, 7], "n": 42}', chunksize)[0] == [12345, -0.5e+10, 7]
+    assert read('{"jobs": [12345, -0.5e+10, 7], "n": 42}', chunksize)[1].trailer == {'n': 42}
+
+
+@pytest.mark.parametrize('chunksize', [1, 4, 1 << 16])
+def test_reader_whitespace_and_empty(chunksize):
+    jobs, reader = read(' {\n "meta" : {} ,\n "jobs" : [ ]\n}\n', chunksize)
+    assert jobs == []
+    assert reader.header == {'meta': {}}
+    assert read('{}', chunksize)[0] == []
+
+
+@pytest.mark.parametrize('text', ['{"jobs": [1, 2', '{"jobs": [1 2]}', '{"jobs": [1.]}', '[1]', '{"jobs": [1], }'])
+def test_reader_invalid(text):
+    with pytest.raises(json.JSONDecodeError):
+        read(text, 2)
+
+
+@pytest.mark.parametrize('chunksize', [1, 3, 1 << 16])
+def test_array_reader(chunksize):
+    assert read('[{"a": 1}, 2.25, "x"]', chunksize, JsonArrayReader)[0] == [{'a': 1}, 2.25, 'x']
+    with pytest.raises(json.JSONDecodeError):
+        read('[1] 2', chunksize, JsonArrayReader)
+
+
+@pytest.mark.parametrize('buffersize', [1, 64, 1 << 18])
+def test_writer_matches_json_dump(tmp_path, buffersize):
+    target = tmp_path / 'out.json'
+    header = {'meta': DOCUMENT['meta'], 'errors': []}
+
+    with SlurmJsonWriter(str(target), header, buffersize=buffersize) as writer:
+        for job in DOCUMENT['jobs']:
+            writer.write(job)
+        writer.close({'warnings': ['late']})
+
+    assert writer.count == 3
+    assert target.read_text() == json.dumps(DOCUMENT)
+
+
+def test_writer_round_trip(tmp_path):
+    source = tmp_path / 'in.json'
+    source.write_text(json.dumps(DOCUMENT))
+    target = tmp_path / 'out.json'
+
+    with source.open() as filep:
+        reader = SlurmJsonReader(filep, chunksize=5)
+        with SlurmJsonWriter(str(target), reader.header) as writer:
+            for job in reader:
+                if job['job_id'] != 22:
+                    writer.write(job)
+            writer.close(reader.trailer)
+
+    expected = dict(DOCUMENT, jobs=[job for job in DOCUMENT['jobs'] if job['job_id'] != 22])
+    assert target.read_text() == json.dumps(expected)
+
+
+def test_writer_without_jobs_writes_nothing(tmp_path):
+    target = tmp_path / 'out.json'
+    with SlurmJsonWriter(str(target), {'meta': {}}) as writer:
+        pass
+    assert writer.count == 0
+    assert not target.exists()
+
+
+def test_writer_abort_keeps_existing_output(tmp_path):
+    target = tmp_path / 'out.json'
+    target.write_text('old')
+
+    with pytest.raises(RuntimeError):
+        with SlurmJsonWriter(str(target)) as writer:
+            writer.write({'job_id': 1})
+            raise RuntimeError('failed')
+
+    assert target.read_text() == 'old'
+    assert [path.name for path in tmp_path.iterdir()] == ['out.json']